@@ -1,277 +1,3648 @@
+import atexit
+import base64
+import bisect
+import click
+import cProfile
+import gzip
+import hashlib
+import heapq
+import io
+import json
+import math
+import mimetypes
 import os
+import pickle
+import pstats
+import random
+import re
+import signal
+import socket
 import sqlite3
-from datetime import datetime
-from flask import Flask, render_template, request, redirect, session, url_for
+import sys
+import threading
+import time
+import traceback
+import unicodedata
+import uuid
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+from flask import (
+    Flask, before_render_template, g, has_request_context, make_response, render_template, request,
+    redirect, send_from_directory, session, stream_with_context, template_rendered, url_for,
+)
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
 from sqlalchemy.exc import OperationalError
-from collections import Counter
+from sqlalchemy.orm import Session, contains_eager, joinedload, selectinload, undefer
+from jinja2 import FileSystemBytecodeCache, TemplateError, TemplateSyntaxError, meta, nodes
+from markupsafe import Markup, escape
+from werkzeug.security import safe_join
+from collections import Counter, OrderedDict, deque, namedtuple
+
+try:
+    import brotli  # opcional (pip install brotli): Content-Encoding br
+except ImportError:
+    brotli = None
 
 app = Flask(__name__)
 app.secret_key = "lux_secret"
 
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
-DB_PATH = os.path.join(BASE_DIR, "database.db")
+DB_PATH = os.environ.get("LUX_DB_PATH", os.path.join(BASE_DIR, "database.db"))
 app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + DB_PATH
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
-def ensure_category_description_column():
-    conn = None
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute("PRAGMA table_info(category);")
-        cols = [r[1] for r in cur.fetchall()]
-        if "description" not in cols:
-            cur.execute("ALTER TABLE category ADD COLUMN description TEXT;")
-            conn.commit()
-    finally:
-        if conn:
-            conn.close()
+# Perfis do SQLite, escolhidos por LUX_DB_PROFILE. O "production" usa WAL para
+# leitores não bloquearem escritores, espera o lock (busy_timeout) em vez de
+# estourar "database is locked" e dimensiona o pool por worker.
+SQLITE_PROFILES = {
+    "default": {
+        "pragmas": {},
+        "engine": {},
+    },
+    "production": {
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "busy_timeout": int(os.environ.get("LUX_SQLITE_BUSY_TIMEOUT", 5000)),
+            "mmap_size": int(os.environ.get("LUX_SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+            "cache_size": int(os.environ.get("LUX_SQLITE_CACHE_SIZE", -64000)),  # negativo = KiB
+            "temp_store": "MEMORY",
+        },
+        "engine": {
+            "pool_size": int(os.environ.get("LUX_DB_POOL_SIZE", 5)),
+            "max_overflow": int(os.environ.get("LUX_DB_MAX_OVERFLOW", 5)),
+            "pool_timeout": 10,
+            "connect_args": {"timeout": int(os.environ.get("LUX_SQLITE_BUSY_TIMEOUT", 5000)) / 1000},
+        },
+    },
+}
+DB_PROFILE = os.environ.get("LUX_DB_PROFILE", "production")
+if DB_PROFILE not in SQLITE_PROFILES:
+    raise RuntimeError(f"LUX_DB_PROFILE inválido: {DB_PROFILE} (use {', '.join(SQLITE_PROFILES)})")
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = SQLITE_PROFILES[DB_PROFILE]["engine"]
+
+# cache de páginas/fragmentos: "sqlite" (arquivo compartilhado entre os workers
+# do gunicorn e o `flask run-worker` da máquina), "memory" ou "none".
+# "memory" é por processo: um commit feito em outro worker ou no run-worker não
+# invalida as páginas deste, que ficam velhas até o LUX_CACHE_TTL (use só com
+# um processo, p.ex. no servidor de desenvolvimento)
+app.config["CACHE_BACKEND"] = os.environ.get("LUX_CACHE_BACKEND", "sqlite")
+app.config["CACHE_TTL"] = int(os.environ.get("LUX_CACHE_TTL", 30))
+app.config["CACHE_MAX_ENTRIES"] = int(os.environ.get("LUX_CACHE_MAX_ENTRIES", 512))
+app.config["CACHE_PATH"] = os.environ.get("LUX_CACHE_PATH", os.path.join(BASE_DIR, "cache.db"))
+# max-age das páginas anônimas com ETag (0 = sempre revalida, mas recebe 304)
+app.config["HTTP_MAX_AGE"] = int(os.environ.get("LUX_HTTP_MAX_AGE", 0))
+# limite de queries por request; só é verificado em debug ou com LUX_QUERY_BUDGET_ENFORCE=1
+app.config["QUERY_BUDGET"] = int(os.environ.get("LUX_QUERY_BUDGET", 20))
+app.config["QUERY_BUDGET_ENFORCE"] = os.environ.get("LUX_QUERY_BUDGET_ENFORCE") == "1"
+# estourou o limite: True = erro 500, False = só loga
+app.config["QUERY_BUDGET_STRICT"] = os.environ.get("LUX_QUERY_BUDGET_STRICT") == "1"
+# devolve o nº de queries no header X-Query-Count (usado pelo bench.py)
+app.config["QUERY_COUNT_HEADER"] = os.environ.get("LUX_QUERY_COUNT_HEADER") == "1"
+# instrumentação: loga SQL/requests acima destes limites (ms)
+app.config["SLOW_QUERY_MS"] = float(os.environ.get("LUX_SLOW_QUERY_MS", 200))
+app.config["SLOW_REQUEST_MS"] = float(os.environ.get("LUX_SLOW_REQUEST_MS", 1000))
+# fração dos requests rodados sob cProfile (0 = desligado); só os lentos são guardados
+app.config["PROFILE_SAMPLE"] = float(os.environ.get("LUX_PROFILE_SAMPLE", 0))
+# "1" = captura a pilha de requests que passam do limite enquanto ainda rodam
+app.config["PROFILE_STACKS"] = os.environ.get("LUX_PROFILE_STACKS") == "1"
+app.config["PROFILE_KEEP"] = int(os.environ.get("LUX_PROFILE_KEEP", 20))
+# /admin/metrics: além do Lux logado, aceita "Authorization: Bearer <token>" (Prometheus)
+app.config["METRICS_TOKEN"] = os.environ.get("LUX_METRICS_TOKEN")
+# fila de jobs: espera entre buscas, base da espera exponencial e tempo até
+# um job "running" ser considerado abandonado (s)
+app.config["JOB_POLL_INTERVAL"] = float(os.environ.get("LUX_JOB_POLL_INTERVAL", 1))
+app.config["JOB_RETRY_DELAY"] = float(os.environ.get("LUX_JOB_RETRY_DELAY", 30))
+app.config["JOB_LOCK_TIMEOUT"] = float(os.environ.get("LUX_JOB_LOCK_TIMEOUT", 600))
+# dias que jobs concluídos ficam na tabela antes do expurgo
+app.config["JOB_KEEP_DAYS"] = int(os.environ.get("LUX_JOB_KEEP_DAYS", 7))
+# chat ao vivo (SSE): onde ficam os arquivos de sinal entre workers, de quanto
+# em quanto tempo quem espera olha o arquivo, e duração máxima de um stream (s,
+# abaixo do timeout do gunicorn); o navegador reconecta sozinho com Last-Event-ID
+app.config["SIGNAL_DIR"] = os.environ.get("LUX_SIGNAL_DIR", os.path.join(app.instance_path, "signals"))
+app.config["SSE_SIGNAL_POLL"] = float(os.environ.get("LUX_SSE_SIGNAL_POLL", 0.5))
+app.config["SSE_HEARTBEAT"] = float(os.environ.get("LUX_SSE_HEARTBEAT", 15))
+app.config["SSE_MAX_SECONDS"] = float(os.environ.get("LUX_SSE_MAX_SECONDS", 25))
+# streams abertos ao mesmo tempo por worker (cada um prende uma thread do gthread);
+# acima disso o stream responde 204 e a página consulta ?poll=1 a cada N segundos
+app.config["SSE_MAX_STREAMS"] = int(os.environ.get("LUX_SSE_MAX_STREAMS", 2))
+app.config["SSE_POLL_FALLBACK"] = float(os.environ.get("LUX_SSE_POLL_FALLBACK", 5))
+# agregados de investimento: buckets por hora só dos últimos N dias (os diários ficam todos)
+app.config["ROLLUP_HOURLY_DAYS"] = int(os.environ.get("LUX_ROLLUP_HOURLY_DAYS", 35))
+# ranking "em alta": meia-vida do decaimento (mudar exige `flask rebuild-trending`)
+# e quantos posts ficam pré-calculados por categoria
+app.config["TRENDING_HALF_LIFE_HOURS"] = float(os.environ.get("LUX_TRENDING_HALF_LIFE_HOURS", 24))
+app.config["TRENDING_TOP_K"] = int(os.environ.get("LUX_TRENDING_TOP_K", 10))
+# likes/investimentos gravados em lote por uma thread do worker (ver "ESCRITA ADIADA"):
+# intervalo máximo entre gravações (s), tamanho que antecipa a gravação e limite do buffer
+app.config["WRITE_BEHIND"] = os.environ.get("LUX_WRITE_BEHIND") == "1"
+app.config["WRITE_BEHIND_INTERVAL"] = float(os.environ.get("LUX_WRITE_BEHIND_INTERVAL", 0.2))
+app.config["WRITE_BEHIND_BATCH"] = int(os.environ.get("LUX_WRITE_BEHIND_BATCH", 500))
+app.config["WRITE_BEHIND_MAX_PENDING"] = int(os.environ.get("LUX_WRITE_BEHIND_MAX_PENDING", 5000))
+# lote que falha N vezes seguidas (com espera crescente) é gravado evento a evento
+# e o que não entra nem sozinho é descartado no log, para não travar o buffer
+app.config["WRITE_BEHIND_MAX_RETRIES"] = int(os.environ.get("LUX_WRITE_BEHIND_MAX_RETRIES", 8))
+# compressão das respostas: tamanho mínimo (bytes), nível do gzip e qualidade do brotli
+app.config["COMPRESS_MIN_SIZE"] = int(os.environ.get("LUX_COMPRESS_MIN_SIZE", 500))
+app.config["COMPRESS_LEVEL"] = int(os.environ.get("LUX_COMPRESS_LEVEL", 6))
+app.config["COMPRESS_BROTLI_QUALITY"] = int(os.environ.get("LUX_COMPRESS_BROTLI_QUALITY", 5))
+# bytecode dos templates compilados (compartilhado entre workers); vazio desliga
+app.config["TEMPLATE_CACHE_DIR"] = os.environ.get("LUX_TEMPLATE_CACHE_DIR", os.path.join(app.instance_path, "jinja-cache"))
+# autocompletar: de quanto em quanto tempo (s) o índice em memória é remontado
+# do banco (pega scores novos; nomes/títulos chegam na hora pelo log de mudanças)
+app.config["TYPEAHEAD_REFRESH"] = float(os.environ.get("LUX_TYPEAHEAD_REFRESH", 600))
+
+
+# Score "em alta" em espaço log: cada evento de peso w no instante t vale
+# w * e^(λ·(t - época)), e post.trending guarda o log da soma. Com a época fixa,
+# o decaimento é o mesmo fator para todos os posts, então a ordem já sai certa
+# sem nunca reescalar nada: um evento novo só faz trending = logaddexp(trending, evento).
+TRENDING_EPOCH = datetime(2024, 1, 1)
+TRENDING_DECAY = math.log(2) / (app.config["TRENDING_HALF_LIFE_HOURS"] * 3600)
+
+
+def logaddexp(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    hi, lo = max(a, b), min(a, b)
+    return hi + math.log1p(math.exp(lo - hi))
+
+
+class TrendingSum:
+    # agregado SQL trending_sum(peso, segundos desde a época), para o rebuild
+    def __init__(self):
+        self.peak = None
+        self.acc = 0.0
+
+    def step(self, weight, seconds):
+        if weight is None or seconds is None or weight <= 0:
+            return
+        x = math.log(weight) + TRENDING_DECAY * seconds
+        if self.peak is None:
+            self.peak, self.acc = x, 1.0
+        elif x > self.peak:
+            self.acc = self.acc * math.exp(self.peak - x) + 1.0
+            self.peak = x
+        else:
+            self.acc += math.exp(x - self.peak)
+
+    def finalize(self):
+        return None if self.peak is None else self.peak + math.log(self.acc)
+
+
+@event.listens_for(Engine, "connect")
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    dbapi_connection.create_function("logaddexp", 2, logaddexp, deterministic=True)
+    dbapi_connection.create_aggregate("trending_sum", 2, TrendingSum)
+    cur = dbapi_connection.cursor()
+    # FKs valem em todos os perfis: as exclusões contam com ON DELETE CASCADE
+    cur.execute("PRAGMA foreign_keys = ON;")
+    for name, value in SQLITE_PROFILES[DB_PROFILE]["pragmas"].items():
+        cur.execute(f"PRAGMA {name} = {value};")
+    cur.close()
+
+
+db = SQLAlchemy(app)
+
+class Category(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), unique=True, nullable=False)
+    description = db.Column(db.String(300))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Relacionamento com Company — deixa como estava
+    companies = db.relationship("Company", backref="category", lazy=True, passive_deletes=True)
+
+    # RELACIONAMENTO CORRETO COM POSTS
+    posts = db.relationship(
+        "Post",
+        backref="category",
+        cascade="all, delete-orphan",
+        passive_deletes=True
+    )
+
+
+class Company(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(140), nullable=False, unique=True)
+    bio = db.Column(db.Text)
+    website = db.Column(db.String(250))
+    password = db.Column(db.String(200), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    category_id = db.Column(db.Integer, db.ForeignKey("category.id", ondelete="SET NULL"), nullable=True)
+    # soma dos scores dos posts, mantida junto com Post.score
+    total_score = db.Column(db.Float, default=0, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # o banco apaga os dependentes (ON DELETE CASCADE); o ORM não carrega nada para isso
+    comments = db.relationship("Comment", backref="author", lazy=True, passive_deletes=True)
+    investments_made = db.relationship("InvestmentHistory", backref="investor", lazy=True, foreign_keys='InvestmentHistory.company_id', passive_deletes=True)
+    messages_sent = db.relationship("Message", backref="sender", lazy=True, foreign_keys='Message.sender_id', passive_deletes=True)
+    messages_received = db.relationship("Message", backref="receiver", lazy=True, foreign_keys='Message.receiver_id', passive_deletes=True)
+
+    __table_args__ = (
+        db.Index("ix_company_category_score", "category_id", "total_score"),
+    )
+
+class Post(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(200), nullable=False)
+    content = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    likes = db.Column(db.Integer, default=0)
+    investment = db.Column(db.Integer, default=0)
+    score = db.Column(db.Float, default=0, index=True)
+    # log da soma dos eventos com decaimento (ver TRENDING_EPOCH)
+    trending = db.Column(db.Float, index=True)
+    # muda a cada edição/like/investimento/comentário (ETag e Last-Modified)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    company_id = db.Column(db.Integer, db.ForeignKey("company.id", ondelete="CASCADE"), nullable=False)
+
+    __table_args__ = (
+        db.Index("ix_post_company_created", "company_id", "created_at"),
+        db.Index("ix_post_company_score", "company_id", "score"),
+        db.Index("ix_post_category_created", "category_id", "created_at"),
+        db.Index("ix_post_category_score", "category_id", "score"),
+        db.Index("ix_post_category_trending", "category_id", "trending"),
+    )
+
+    # CASCADE REAL AQUI
+    category_id = db.Column(
+        db.Integer,
+        db.ForeignKey("category.id", ondelete="CASCADE"),
+        nullable=False
+    )
+
+    comments = db.relationship(
+        "Comment",
+        backref="post",
+        lazy=True,
+        cascade="all, delete-orphan",
+        passive_deletes=True
+    )
+
+    investment_history = db.relationship(
+        "InvestmentHistory",
+        backref="post",
+        lazy=True,
+        cascade="all, delete-orphan",
+        passive_deletes=True
+    )
+
+    company = db.relationship("Company", backref=db.backref("posts", passive_deletes=True))
+
+
+class TrendingPost(db.Model):
+    # top-K "em alta" de cada categoria, mantido a cada evento dos posts dela:
+    # a página de categorias lê K linhas por categoria numa query só
+    id = db.Column(db.Integer, primary_key=True)
+    category_id = db.Column(db.Integer, db.ForeignKey("category.id", ondelete="CASCADE"), nullable=False)
+    post_id = db.Column(db.Integer, db.ForeignKey("post.id", ondelete="CASCADE"), nullable=False, index=True)
+    trending = db.Column(db.Float, nullable=False)
+
+    post = db.relationship("Post")
+
+    __table_args__ = (
+        db.UniqueConstraint("category_id", "post_id", name="uq_trending_post_category_post"),
+        db.Index("ix_trending_post_category_trending", "category_id", "trending"),
+    )
+
+
+class Comment(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    content = db.Column(db.String(500), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    company_id = db.Column(db.Integer, db.ForeignKey("company.id", ondelete="CASCADE"), nullable=False, index=True)
+    post_id = db.Column(db.Integer, db.ForeignKey("post.id", ondelete="CASCADE"), nullable=False, index=True)
+
+class PostLike(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey("post.id", ondelete="CASCADE"), nullable=False)
+    company_id = db.Column(db.Integer, db.ForeignKey("company.id", ondelete="CASCADE"), nullable=False, index=True)
+
+    # uma curtida por empresa por post, garantido pelo banco
+    __table_args__ = (
+        db.Index("uq_post_like_post_company", "post_id", "company_id", unique=True),
+    )
+
+class InvestmentHistory(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey("company.id", ondelete="CASCADE"), nullable=False)
+    post_id = db.Column(db.Integer, db.ForeignKey("post.id", ondelete="CASCADE"), nullable=False)
+    amount = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    __table_args__ = (
+        db.Index("ix_investment_history_post_created", "post_id", "created_at"),
+        db.Index("ix_investment_history_company_created", "company_id", "created_at"),
+    )
+
+
+class InvestmentRollup(db.Model):
+    # soma dos investimentos por bucket de tempo, mantida a cada investimento novo
+    # (ver "AGREGADOS DE INVESTIMENTO"); gráficos e rankings leem daqui, não do histórico.
+    # scope: "all" (scope_id 0), "post", "company" (recebido pelos posts da empresa),
+    # "category" (categoria do post) ou "investor" (investido pela empresa)
+    id = db.Column(db.Integer, primary_key=True)
+    grain = db.Column(db.String(4), nullable=False)  # hour/day
+    bucket = db.Column(db.DateTime, nullable=False)
+    scope = db.Column(db.String(10), nullable=False)
+    scope_id = db.Column(db.Integer, nullable=False)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint("scope", "scope_id", "grain", "bucket", name="uq_investment_rollup_key"),
+        # ranking por scope numa janela (top investidores)
+        db.Index("ix_investment_rollup_scope_grain_bucket", "scope", "grain", "bucket"),
+    )
+
+class Message(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    sender_id = db.Column(db.Integer, db.ForeignKey("company.id", ondelete="CASCADE"), nullable=False)
+    receiver_id = db.Column(db.Integer, db.ForeignKey("company.id", ondelete="CASCADE"), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index("ix_message_sender_receiver_created", "sender_id", "receiver_id", "created_at"),
+        db.Index("ix_message_receiver_created", "receiver_id", "created_at"),
+    )
+
+
+class Conversation(db.Model):
+    # resumo por par de empresas (low_id < high_id), mantido a cada mensagem nova:
+    # a caixa de entrada lê daqui em vez de varrer Message
+    id = db.Column(db.Integer, primary_key=True)
+    low_id = db.Column(db.Integer, db.ForeignKey("company.id", ondelete="CASCADE"), nullable=False)
+    high_id = db.Column(db.Integer, db.ForeignKey("company.id", ondelete="CASCADE"), nullable=False)
+    last_message_id = db.Column(db.Integer, db.ForeignKey("message.id", ondelete="SET NULL"), index=True)
+    last_message_at = db.Column(db.DateTime)
+    # não lidas por lado: unread_low = mensagens que low_id ainda não viu
+    unread_low = db.Column(db.Integer, nullable=False, default=0)
+    unread_high = db.Column(db.Integer, nullable=False, default=0)
+
+    last_message = db.relationship("Message")
+
+    __table_args__ = (
+        db.UniqueConstraint("low_id", "high_id", name="uq_conversation_pair"),
+        db.Index("ix_conversation_low_last", "low_id", "last_message_at"),
+        db.Index("ix_conversation_high_last", "high_id", "last_message_at"),
+    )
+
+
+class DataVersion(db.Model):
+    # versão por tipo de dado ("posts", "companies", "categories"), incrementada
+    # na mesma transação que altera os dados; base dos ETags das páginas de ranking
+    name = db.Column(db.String(40), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class Job(db.Model):
+    # fila de trabalho pesado fora do request (ver "FILA DE JOBS")
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(60), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default="{}")
+    status = db.Column(db.String(10), nullable=False, default="queued")  # queued/running/done/failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # mesma chave = mesmo job: enfileirar de novo não duplica
+    idempotency_key = db.Column(db.String(200), unique=True)
+    last_error = db.Column(db.Text)
+    locked_by = db.Column(db.String(80))
+    locked_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index("ix_job_status_run_at", "status", "run_at"),
+    )
+
+
+# -----------------------------
+#   MIGRAÇÕES
+# -----------------------------
+# Cada migração roda uma vez só, na sua própria transação, e a versão aplicada
+# fica registrada em schema_version. Rodar no deploy com `flask upgrade-db`
+# (ou `python update_db.py`); os workers não fazem nenhum DDL ao subir.
+MIGRATIONS = []
+
+def migration(version):
+    def register(fn):
+        MIGRATIONS.append((version, fn.__name__, fn))
+        return fn
+    return register
+
+
+def column_names(conn, table):
+    return {r[1] for r in conn.exec_driver_sql(f"PRAGMA table_info({table});")}
+
+
+def add_column(conn, table, name, ddl):
+    if name in column_names(conn, table):
+        return False
+    conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {name} {ddl};")
+    return True
+
+
+def create_indexes(conn, *names):
+    # os índices ficam declarados nos models; aqui só cria os que faltam
+    wanted = set(names)
+    for table in db.metadata.sorted_tables:
+        for idx in table.indexes:
+            if idx.name in wanted:
+                idx.create(conn, checkfirst=True)
+
+
+def rebuild_scores_sql(conn):
+    # SQL puro de propósito: migrações não podem depender do formato atual dos
+    # models (colunas novas ainda não existem quando uma migração antiga roda)
+    conn.exec_driver_sql(
+        "UPDATE post SET score = COALESCE(likes, 0) * 2 + COALESCE(investment, 0) * 3 "
+        "+ MIN(LENGTH(COALESCE(content, '')) / 100.0, 10) "
+        "+ MIN((SELECT COUNT(*) FROM comment WHERE comment.post_id = post.id), 10);"
+    )
+    conn.exec_driver_sql(
+        "UPDATE company SET total_score = "
+        "(SELECT COALESCE(SUM(score), 0) FROM post WHERE post.company_id = company.id);"
+    )
+
+
+def sync_post_counters_sql(conn):
+    # likes/investimento de cada post a partir das tabelas filhas (a carga em
+    # lote insere post_like/investment_history sem passar pelo bump_post_counters)
+    conn.exec_driver_sql(
+        "UPDATE post SET "
+        "likes = (SELECT COUNT(*) FROM post_like WHERE post_like.post_id = post.id), "
+        "investment = (SELECT COALESCE(SUM(amount), 0) FROM investment_history "
+        "WHERE investment_history.post_id = post.id);"
+    )
+
+
+def rebuild_conversations_sql(conn):
+    # última mensagem de cada par a partir de Message; não mexe nos contadores
+    # de não lidas de conversas que já existem (novas entram zeradas)
+    conn.exec_driver_sql(
+        "INSERT INTO conversation (low_id, high_id, last_message_id, last_message_at, unread_low, unread_high) "
+        "SELECT t.low_id, t.high_id, m.id, m.created_at, 0, 0 FROM ("
+        "  SELECT MIN(sender_id, receiver_id) AS low_id, MAX(sender_id, receiver_id) AS high_id, MAX(id) AS last_id "
+        "  FROM message GROUP BY 1, 2"
+        ") AS t JOIN message AS m ON m.id = t.last_id WHERE true "
+        "ON CONFLICT (low_id, high_id) DO UPDATE SET "
+        "last_message_id = excluded.last_message_id, last_message_at = excluded.last_message_at;"
+    )
+    # pares que ficaram sem mensagem nenhuma
+    conn.exec_driver_sql(
+        "DELETE FROM conversation WHERE last_message_id IS NULL "
+        "OR last_message_id NOT IN (SELECT id FROM message);"
+    )
+
+
+def rebuild_trending_sql(conn):
+    # todos os eventos desde sempre, cada um com o seu peso e instante; likes não
+    # têm data, contam no instante do post
+    seconds = "(julianday({}) - julianday('%s')) * 86400.0" % f"{TRENDING_EPOCH:%Y-%m-%d}"
+    conn.exec_driver_sql(
+        "UPDATE post SET trending = t.value FROM ("
+        "  SELECT post_id, trending_sum(weight, seconds) AS value FROM ("
+        f"    SELECT id AS post_id, 1 + MIN(LENGTH(COALESCE(content, '')) / 100.0, 10) AS weight, {seconds.format('created_at')} AS seconds FROM post"
+        f"    UNION ALL SELECT l.post_id, 2, {seconds.format('p.created_at')} FROM post_like AS l JOIN post AS p ON p.id = l.post_id"
+        f"    UNION ALL SELECT post_id, amount * 3, {seconds.format('created_at')} FROM investment_history WHERE amount > 0"
+        f"    UNION ALL SELECT post_id, 1, {seconds.format('created_at')} FROM comment"
+        "  ) GROUP BY post_id"
+        ") AS t WHERE t.post_id = post.id;"
+    )
+    conn.exec_driver_sql("DELETE FROM trending_post;")
+    conn.exec_driver_sql(
+        "INSERT INTO trending_post (category_id, post_id, trending) "
+        "SELECT category_id, id, trending FROM ("
+        "  SELECT category_id, id, trending, "
+        "  ROW_NUMBER() OVER (PARTITION BY category_id ORDER BY trending DESC, id DESC) AS rn "
+        "  FROM post WHERE trending IS NOT NULL"
+        ") WHERE rn <= ?;",
+        (app.config["TRENDING_TOP_K"],),
+    )
+
+
+# scope -> expressão do scope_id sobre investment_history (i) JOIN post (p)
+ROLLUP_SCOPES = {
+    "all": "0",
+    "post": "i.post_id",
+    "company": "p.company_id",
+    "category": "p.category_id",
+    "investor": "i.company_id",
+}
+# início do bucket no mesmo formato em que o SQLAlchemy grava DateTime no SQLite,
+# para o upsert do flush e o rebuild em SQL caírem na mesma linha
+ROLLUP_GRAINS = {
+    "hour": "%Y-%m-%d %H:00:00.000000",
+    "day": "%Y-%m-%d 00:00:00.000000",
+}
+
+
+def rollup_investments_sql(conn, where="1", params=(), sign=1):
+    # soma (sign=1) ou desconta (sign=-1) nos buckets os investimentos que casam
+    # com `where`: um INSERT ... SELECT ... ON CONFLICT só, para todos os scopes e grãos
+    hourly_days = app.config["ROLLUP_HOURLY_DAYS"]
+    selects = []
+    for grain, fmt in ROLLUP_GRAINS.items():
+        recent = f"AND i.created_at >= datetime('now', '-{hourly_days} days') " if grain == "hour" else ""
+        for scope, expr in ROLLUP_SCOPES.items():
+            selects.append(
+                f"SELECT '{grain}', strftime('{fmt}', i.created_at), '{scope}', {expr}, "
+                f"{sign} * SUM(i.amount), {sign} * COUNT(*) "
+                f"FROM investment_history AS i JOIN post AS p ON p.id = i.post_id "
+                f"WHERE i.created_at IS NOT NULL AND {expr} IS NOT NULL {recent}AND ({where}) "
+                f"GROUP BY 2, 4"
+            )
+    conn.exec_driver_sql(
+        "INSERT INTO investment_rollup (grain, bucket, scope, scope_id, total, count) "
+        f"SELECT * FROM ({' UNION ALL '.join(selects)}) WHERE true "
+        "ON CONFLICT (scope, scope_id, grain, bucket) DO UPDATE SET "
+        "total = total + excluded.total, count = count + excluded.count;",
+        tuple(params) * len(selects),
+    )
+    if sign < 0:
+        conn.exec_driver_sql("DELETE FROM investment_rollup WHERE count <= 0;")
+
+
+def rebuild_rollups_sql(conn):
+    conn.exec_driver_sql("DELETE FROM investment_rollup;")
+    rollup_investments_sql(conn)
+
+
+@migration(1)
+def create_missing_tables(conn):
+    db.metadata.create_all(conn)
+
+
+@migration(2)
+def add_category_description(conn):
+    add_column(conn, "category", "description", "TEXT")
+
+
+@migration(3)
+def add_post_score(conn):
+    add_column(conn, "post", "score", "REAL DEFAULT 0")
+    create_indexes(conn, "ix_post_score")
+
+
+@migration(4)
+def add_company_total_score(conn):
+    add_column(conn, "company", "total_score", "REAL DEFAULT 0")
+    rebuild_scores_sql(conn)
+    create_indexes(conn, "ix_company_total_score", "ix_company_category_score")
+
+
+# Índice de busca (FTS5) sobre company(name, bio) e post(title, content).
+# As tabelas virtuais usam "external content" e ficam em sincronia via triggers,
+# então criar, editar ou apagar (inclusive em massa) já atualiza a busca.
+SEARCH_INDEXES = {
+    "company_fts": ("company", ("name", "bio")),
+    "post_fts": ("post", ("title", "content")),
+}
+
+@migration(5)
+def create_search_index(conn):
+    for fts, (table, cols) in SEARCH_INDEXES.items():
+        col_list = ", ".join(cols)
+        new_vals = ", ".join(f"new.{c}" for c in cols)
+        old_vals = ", ".join(f"old.{c}" for c in cols)
+        conn.exec_driver_sql(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({col_list}, "
+            f"content='{table}', content_rowid='id', tokenize='unicode61 remove_diacritics 2');"
+        )
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}(rowid, {col_list}) VALUES (new.id, {new_vals}); END;"
+        )
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {col_list}) VALUES ('delete', old.id, {old_vals}); END;"
+        )
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {col_list} ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {col_list}) VALUES ('delete', old.id, {old_vals}); "
+            f"INSERT INTO {fts}(rowid, {col_list}) VALUES (new.id, {new_vals}); END;"
+        )
+        conn.exec_driver_sql(f"INSERT INTO {fts}({fts}) VALUES ('rebuild');")
+
+
+@migration(6)
+def add_foreign_key_indexes(conn):
+    create_indexes(
+        conn,
+        "ix_post_company_created",
+        "ix_post_company_score",
+        "ix_post_category_created",
+        "ix_post_category_score",
+        "ix_comment_post_id",
+        "ix_post_like_post_company",
+        "ix_investment_history_created_at",
+        "ix_investment_history_post_created",
+        "ix_investment_history_company_created",
+        "ix_message_sender_receiver_created",
+        "ix_message_receiver_created",
+    )
+    conn.exec_driver_sql("ANALYZE;")
+
+
+@migration(7)
+def unique_post_likes(conn):
+    # remove curtidas duplicadas, troca o índice por um único e
+    # acerta o contador post.likes (que passa a ser incrementado no lugar)
+    conn.exec_driver_sql(
+        "DELETE FROM post_like WHERE id NOT IN "
+        "(SELECT MIN(id) FROM post_like GROUP BY post_id, company_id);"
+    )
+    conn.exec_driver_sql("DROP INDEX IF EXISTS ix_post_like_post_company;")
+    create_indexes(conn, "uq_post_like_post_company")
+    conn.exec_driver_sql(
+        "UPDATE post SET likes = (SELECT COUNT(*) FROM post_like WHERE post_like.post_id = post.id);"
+    )
+    rebuild_scores_sql(conn)
+
+
+@migration(8)
+def add_data_versions(conn):
+    for table in ("post", "company"):
+        if add_column(conn, table, "updated_at", "DATETIME"):
+            conn.exec_driver_sql(f"UPDATE {table} SET updated_at = created_at;")
+    DataVersion.__table__.create(conn, checkfirst=True)
+
+
+@migration(9)
+def add_job_queue(conn):
+    Job.__table__.create(conn, checkfirst=True)
+
+
+@migration(10)
+def add_conversations(conn):
+    Conversation.__table__.create(conn, checkfirst=True)
+    rebuild_conversations_sql(conn)
+
+
+# Tabelas com FK como estavam na versão 11, pai antes do filho. O DDL fica
+# congelado aqui: os models de hoje trazem colunas e índices de migrações
+# posteriores (ex.: post.trending), que precisam ser criados por elas.
+V11_TABLES = (
+    ("company", (
+        "id INTEGER NOT NULL, name VARCHAR(140) NOT NULL, bio TEXT, website VARCHAR(250), "
+        "password VARCHAR(200) NOT NULL, created_at DATETIME, category_id INTEGER, "
+        "total_score FLOAT, updated_at DATETIME, PRIMARY KEY (id), UNIQUE (name), "
+        "FOREIGN KEY(category_id) REFERENCES category (id) ON DELETE SET NULL"
+    ), (
+        "CREATE INDEX ix_company_category_score ON company (category_id, total_score)",
+        "CREATE INDEX ix_company_total_score ON company (total_score)",
+    )),
+    ("post", (
+        "id INTEGER NOT NULL, title VARCHAR(200) NOT NULL, content TEXT, created_at DATETIME, "
+        "likes INTEGER, investment INTEGER, score FLOAT, updated_at DATETIME, "
+        "company_id INTEGER NOT NULL, category_id INTEGER NOT NULL, PRIMARY KEY (id), "
+        "FOREIGN KEY(company_id) REFERENCES company (id) ON DELETE CASCADE, "
+        "FOREIGN KEY(category_id) REFERENCES category (id) ON DELETE CASCADE"
+    ), (
+        "CREATE INDEX ix_post_category_created ON post (category_id, created_at)",
+        "CREATE INDEX ix_post_category_score ON post (category_id, score)",
+        "CREATE INDEX ix_post_company_created ON post (company_id, created_at)",
+        "CREATE INDEX ix_post_company_score ON post (company_id, score)",
+        "CREATE INDEX ix_post_score ON post (score)",
+    )),
+    ("comment", (
+        "id INTEGER NOT NULL, content VARCHAR(500) NOT NULL, created_at DATETIME, "
+        "company_id INTEGER NOT NULL, post_id INTEGER NOT NULL, PRIMARY KEY (id), "
+        "FOREIGN KEY(company_id) REFERENCES company (id) ON DELETE CASCADE, "
+        "FOREIGN KEY(post_id) REFERENCES post (id) ON DELETE CASCADE"
+    ), (
+        "CREATE INDEX ix_comment_company_id ON comment (company_id)",
+        "CREATE INDEX ix_comment_post_id ON comment (post_id)",
+    )),
+    ("post_like", (
+        "id INTEGER NOT NULL, post_id INTEGER NOT NULL, company_id INTEGER NOT NULL, "
+        "PRIMARY KEY (id), "
+        "FOREIGN KEY(post_id) REFERENCES post (id) ON DELETE CASCADE, "
+        "FOREIGN KEY(company_id) REFERENCES company (id) ON DELETE CASCADE"
+    ), (
+        "CREATE INDEX ix_post_like_company_id ON post_like (company_id)",
+        "CREATE UNIQUE INDEX uq_post_like_post_company ON post_like (post_id, company_id)",
+    )),
+    ("investment_history", (
+        "id INTEGER NOT NULL, company_id INTEGER NOT NULL, post_id INTEGER NOT NULL, "
+        "amount INTEGER NOT NULL, created_at DATETIME, PRIMARY KEY (id), "
+        "FOREIGN KEY(company_id) REFERENCES company (id) ON DELETE CASCADE, "
+        "FOREIGN KEY(post_id) REFERENCES post (id) ON DELETE CASCADE"
+    ), (
+        "CREATE INDEX ix_investment_history_company_created ON investment_history (company_id, created_at)",
+        "CREATE INDEX ix_investment_history_created_at ON investment_history (created_at)",
+        "CREATE INDEX ix_investment_history_post_created ON investment_history (post_id, created_at)",
+    )),
+    ("message", (
+        "id INTEGER NOT NULL, sender_id INTEGER NOT NULL, receiver_id INTEGER NOT NULL, "
+        "content TEXT NOT NULL, created_at DATETIME, PRIMARY KEY (id), "
+        "FOREIGN KEY(sender_id) REFERENCES company (id) ON DELETE CASCADE, "
+        "FOREIGN KEY(receiver_id) REFERENCES company (id) ON DELETE CASCADE"
+    ), (
+        "CREATE INDEX ix_message_receiver_created ON message (receiver_id, created_at)",
+        "CREATE INDEX ix_message_sender_receiver_created ON message (sender_id, receiver_id, created_at)",
+    )),
+    ("conversation", (
+        "id INTEGER NOT NULL, low_id INTEGER NOT NULL, high_id INTEGER NOT NULL, "
+        "last_message_id INTEGER, last_message_at DATETIME, unread_low INTEGER NOT NULL, "
+        "unread_high INTEGER NOT NULL, PRIMARY KEY (id), "
+        "CONSTRAINT uq_conversation_pair UNIQUE (low_id, high_id), "
+        "FOREIGN KEY(low_id) REFERENCES company (id) ON DELETE CASCADE, "
+        "FOREIGN KEY(high_id) REFERENCES company (id) ON DELETE CASCADE, "
+        "FOREIGN KEY(last_message_id) REFERENCES message (id) ON DELETE SET NULL"
+    ), (
+        "CREATE INDEX ix_conversation_high_last ON conversation (high_id, last_message_at)",
+        "CREATE INDEX ix_conversation_last_message_id ON conversation (last_message_id)",
+        "CREATE INDEX ix_conversation_low_last ON conversation (low_id, last_message_at)",
+    )),
+)
+
+# (tabela, coluna, tabela pai, ON DELETE) das FKs acima
+V11_FOREIGN_KEYS = (
+    ("company", "category_id", "category", "SET NULL"),
+    ("post", "company_id", "company", "CASCADE"),
+    ("post", "category_id", "category", "CASCADE"),
+    ("comment", "company_id", "company", "CASCADE"),
+    ("comment", "post_id", "post", "CASCADE"),
+    ("post_like", "post_id", "post", "CASCADE"),
+    ("post_like", "company_id", "company", "CASCADE"),
+    ("investment_history", "company_id", "company", "CASCADE"),
+    ("investment_history", "post_id", "post", "CASCADE"),
+    ("message", "sender_id", "company", "CASCADE"),
+    ("message", "receiver_id", "company", "CASCADE"),
+    ("conversation", "low_id", "company", "CASCADE"),
+    ("conversation", "high_id", "company", "CASCADE"),
+    ("conversation", "last_message_id", "message", "SET NULL"),
+)
+
+
+def rebuild_table(conn, name, columns, indexes):
+    # SQLite não altera FK de tabela existente: cria a nova com o DDL dado,
+    # copia, apaga a antiga e renomeia (roda com foreign_keys=OFF)
+    tmp = f"_new_{name}"
+    conn.exec_driver_sql(f"CREATE TABLE {tmp} ({columns});")
+    existing = column_names(conn, name)
+    cols = ", ".join(c for c in column_names(conn, tmp) if c in existing)
+    conn.exec_driver_sql(f"INSERT INTO {tmp} ({cols}) SELECT {cols} FROM {name};")
+    conn.exec_driver_sql(f"DROP TABLE {name};")
+    conn.exec_driver_sql(f"ALTER TABLE {tmp} RENAME TO {name};")
+    for index in indexes:
+        conn.exec_driver_sql(index)
+
+
+@migration(11)
+def cascade_foreign_keys(conn):
+    # 1) órfãos de hoje (FKs nunca foram verificadas): apaga ou zera, conforme o ON DELETE
+    for table, col, parent, ondelete in V11_FOREIGN_KEYS:
+        orphan = f"{col} IS NOT NULL AND {col} NOT IN (SELECT id FROM {parent})"
+        if ondelete == "SET NULL":
+            conn.exec_driver_sql(f"UPDATE {table} SET {col} = NULL WHERE {orphan};")
+        else:
+            conn.exec_driver_sql(f"DELETE FROM {table} WHERE {orphan};")
+    # 2) tabelas recriadas com ON DELETE CASCADE / SET NULL
+    for name, columns, indexes in V11_TABLES:
+        rebuild_table(conn, name, columns, indexes)
+    # 3) o que dependia das linhas apagadas: contadores, scores, busca, conversas
+    conn.exec_driver_sql(
+        "UPDATE post SET likes = (SELECT COUNT(*) FROM post_like WHERE post_like.post_id = post.id);"
+    )
+    rebuild_scores_sql(conn)
+    create_search_index(conn)
+    rebuild_conversations_sql(conn)
+    violations = conn.exec_driver_sql("PRAGMA foreign_key_check;").fetchall()
+    if violations:
+        raise RuntimeError(f"FKs inválidas depois da migração: {violations[:10]}")
+
+
+@migration(12)
+def add_investment_rollups(conn):
+    InvestmentRollup.__table__.create(conn, checkfirst=True)
+    rebuild_rollups_sql(conn)
+
+
+@migration(13)
+def add_post_trending(conn):
+    add_column(conn, "post", "trending", "FLOAT")
+    create_indexes(conn, "ix_post_trending", "ix_post_category_trending")
+    TrendingPost.__table__.create(conn, checkfirst=True)
+    rebuild_trending_sql(conn)
+
+
+def schema_version():
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE IF NOT EXISTS schema_version "
+            "(version INTEGER PRIMARY KEY, name TEXT NOT NULL, applied_at DATETIME NOT NULL);"
+        )
+        return conn.exec_driver_sql("SELECT COALESCE(MAX(version), 0) FROM schema_version;").scalar()
+
+
+def run_migrations():
+    # importação interrompida antes: volta índices e busca antes de migrar
+    restore_bulk_load()
+    current = schema_version()
+    applied = []
+    for version, name, fn in sorted(MIGRATIONS):
+        if version <= current:
+            continue
+        with db.engine.connect() as conn:
+            # mudança de schema com FKs desligadas (o PRAGMA não vale dentro de
+            # transação, então vem antes do begin); a conexão volta ao pool com ON
+            conn.exec_driver_sql("PRAGMA foreign_keys = OFF;")
+            conn.commit()
+            try:
+                with conn.begin():
+                    fn(conn)
+                    conn.exec_driver_sql(
+                        "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?);",
+                        (version, name, datetime.utcnow()),
+                    )
+            finally:
+                conn.exec_driver_sql("PRAGMA foreign_keys = ON;")
+                conn.commit()
+        applied.append(name)
+    return applied
+
+
+@app.cli.command("upgrade-db")
+def upgrade_db_command():
+    applied = run_migrations()
+    for name in applied:
+        print(f"Migração aplicada: {name}")
+    print(f"Banco na versão {schema_version()}.")
+    if restore_bulk_load():
+        print("Índices e gatilhos de busca de uma importação interrompida recriados.")
+
+def fix_companies_missing_category():
+    try:
+        companies = Company.query.filter((Company.category_id == None)).all()
+    except:
+        return
+    updates = 0
+    for comp in companies:
+        posts = Post.query.filter_by(company_id=comp.id).all()
+        if not posts:
+            continue
+        cat_ids = [p.category_id for p in posts if p.category_id]
+        if not cat_ids:
+            continue
+        most_common = Counter(cat_ids).most_common(1)
+        if most_common:
+            comp.category_id = most_common[0][0]
+            updates += 1
+    if updates > 0:
+        db.session.commit()
+
+# -----------------------------
+#   SCORE DOS POSTS
+# -----------------------------
+# score = likes*2 + investimento*3 + min(len(conteúdo)/100, 10) + min(comentários, 10)
+# A conta roda direto no SQLite (sem carregar post.comments) e não faz commit:
+# quem chama junta tudo num commit só por evento (like, investimento, comentário, edição).
+def comments_count_expr():
+    return (
+        db.select(db.func.count(Comment.id))
+        .where(Comment.post_id == Post.id)
+        .correlate(Post)
+        .scalar_subquery()
+    )
+
+
+def post_score_expr():
+    comments_count = comments_count_expr()
+    return (
+        db.func.coalesce(Post.likes, 0) * 2
+        + db.func.coalesce(Post.investment, 0) * 3
+        + db.func.min(db.func.length(db.func.coalesce(Post.content, "")) / 100.0, 10)
+        + db.func.min(comments_count, 10)
+    )
+
+
+def company_score_expr():
+    return (
+        db.select(db.func.coalesce(db.func.sum(Post.score), 0))
+        .where(Post.company_id == Company.id)
+        .scalar_subquery()
+    )
+
+
+def update_company_scores(*company_ids):
+    ids = {cid for cid in company_ids if cid}
+    if not ids:
+        return
+    db.session.execute(
+        db.update(Company).where(Company.id.in_(ids)).values(total_score=company_score_expr())
+    )
+
+
+def bump_post_counters(post, likes=0, investment=0):
+    # like/investimento: incrementa no lugar, sem recontar o histórico.
+    # likes e investimento entram linearmente no score, então o delta basta.
+    delta = likes * 2 + investment * 3
+    values = {
+        "likes": db.func.coalesce(Post.likes, 0) + likes,
+        "investment": db.func.coalesce(Post.investment, 0) + investment,
+        "score": db.func.coalesce(Post.score, 0) + delta,
+    }
+    if delta > 0:
+        values["trending"] = db.func.logaddexp(Post.trending, trending_event(delta))
+    db.session.execute(
+        db.update(Post).where(Post.id == post.id).values(**values),
+        execution_options={"synchronize_session": False},
+    )
+    db.session.execute(
+        db.update(Company)
+        .where(Company.id == post.company_id)
+        .values(total_score=db.func.coalesce(Company.total_score, 0) + delta),
+        execution_options={"synchronize_session": False},
+    )
+    if delta > 0:
+        refresh_trending_top(db.session.connection(), post.category_id, post.id)
+
+
+def add_like(post, company_id):
+    # o índice único faz o INSERT virar no-op se a empresa já curtiu
+    result = db.session.execute(
+        sqlite_insert(PostLike)
+        .values(post_id=post.id, company_id=company_id)
+        .on_conflict_do_nothing()
+    )
+    if result.rowcount:
+        bump_post_counters(post, likes=1)
+    db.session.commit()
+    return bool(result.rowcount)
+
+
+def add_investment(post, company_id, amount):
+    db.session.add(InvestmentHistory(company_id=company_id, post_id=post.id, amount=amount))
+    bump_post_counters(post, investment=amount)
+    db.session.commit()
+
+
+def calculate_post_score(post):
+    db.session.execute(
+        db.update(Post).where(Post.id == post.id).values(score=post_score_expr())
+    )
+    update_company_scores(post.company_id)
+    return post.score
+
+
+# diferença de arredondamento entre o score incremental e o recalculado
+SCORE_DRIFT = 1e-6
+SCORE_FIX_BATCH = 1000
+
+
+def score_drift(column, expr):
+    return db.or_(column.is_(None), db.func.abs(column - expr) > SCORE_DRIFT)
+
+
+def update_all_scores():
+    # reconciliação: procura as linhas cujo score guardado divergiu do recalculado
+    # (só leitura, sem segurar o lock de escrita) e reescreve só essas, em lotes.
+    # updated_at fica como está (recálculo não é edição) e as versões/caches só
+    # mudam se alguma linha mudou. Posts antes: o score da empresa soma os deles.
+    fixed = {}
+    for model, column, expr in (
+        (Post, Post.score, post_score_expr()),
+        (Company, Company.total_score, company_score_expr()),
+    ):
+        ids = db.session.scalars(db.select(model.id).where(score_drift(column, expr))).all()
+        db.session.commit()
+        fixed[model.__tablename__] = len(ids)
+        for start in range(0, len(ids), SCORE_FIX_BATCH):
+            chunk = ids[start:start + SCORE_FIX_BATCH]
+            result = db.session.connection().execute(
+                db.update(model)
+                .where(model.id.in_(chunk), score_drift(column, expr))
+                .values({column: expr, model.updated_at: model.updated_at})
+            )
+            if result.rowcount:
+                db.session.info.setdefault("cache_tags", set()).update(CACHE_TAGS_BY_MODEL[model])
+            db.session.commit()
+    return fixed
+
+
+@app.cli.command("rebuild-scores")
+def rebuild_scores_command():
+    fixed = update_all_scores()
+    print(f"Scores recalculados: {fixed['post']} posts e {fixed['company']} empresas corrigidos.")
+
+# -----------------------------
+#   EM ALTA (trending)
+# -----------------------------
+# Ranking com decaimento ao lado do score de sempre. Pesos iguais aos do score:
+# like 2, investimento 3 por real, comentário 1, e o post nasce com
+# 1 + tamanho do conteúdo. Cada evento entra incrementalmente (logaddexp no
+# UPDATE que já existia) e atualiza o top-K da categoria se o post entrar nele.
+# Apagar não desconta (o peso antigo some sozinho com o tempo).
+RANKING_MODES = {"score": Post.score, "trending": Post.trending}
+
+
+def trending_event(weight, at=None):
+    return math.log(weight) + TRENDING_DECAY * ((at or datetime.utcnow()) - TRENDING_EPOCH).total_seconds()
+
+
+@app.template_global()
+def trending_heat(value):
+    # peso "de agora": soma dos eventos já com o decaimento aplicado
+    if value is None:
+        return 0.0
+    return math.exp(value - trending_event(1))
+
+
+def ranking_mode():
+    mode = request.args.get("mode")
+    return mode if mode in RANKING_MODES else "score"
+
+
+def bump_trending(post, weight):
+    db.session.execute(
+        db.update(Post)
+        .where(Post.id == post.id)
+        .values(trending=db.func.logaddexp(Post.trending, trending_event(weight))),
+        execution_options={"synchronize_session": False},
+    )
+    refresh_trending_top(db.session.connection(), post.category_id, post.id)
+
+
+def refresh_trending_top(conn, category_id, post_id=None):
+    # com post_id, só reescreve o top-K se o post já está nele, passou o último
+    # colocado ou a categoria ainda tem vaga
+    k = app.config["TRENDING_TOP_K"]
+    if post_id is not None:
+        current = db.select(Post.trending).where(Post.id == post_id).scalar_subquery()
+        count, floor, present, value = conn.execute(
+            db.select(
+                db.func.count(TrendingPost.id),
+                db.func.min(TrendingPost.trending),
+                db.func.coalesce(db.func.sum(db.case((TrendingPost.post_id == post_id, 1), else_=0)), 0),
+                current,
+            ).where(TrendingPost.category_id == category_id)
+        ).one()
+        if count >= k and not present and (value is None or value < floor):
+            return
+    conn.execute(db.delete(TrendingPost).where(TrendingPost.category_id == category_id))
+    conn.execute(
+        db.insert(TrendingPost).from_select(
+            ["category_id", "post_id", "trending"],
+            db.select(Post.category_id, Post.id, Post.trending)
+            .where(Post.category_id == category_id, Post.trending.isnot(None))
+            .order_by(Post.trending.desc(), Post.id.desc())
+            .limit(k),
+        )
+    )
+
+
+@event.listens_for(Post, "before_insert")
+def set_initial_trending(mapper, connection, target):
+    if target.trending is None:
+        weight = 1 + min(len(target.content or "") / 100, 10)
+        target.trending = trending_event(weight, target.created_at)
+
+
+@event.listens_for(Session, "after_flush")
+def refresh_trending_on_flush(session, flush_context):
+    # post novo pode entrar no top-K; post apagado abre vaga (a linha dele sai pelo CASCADE)
+    changed = [obj for obj in list(session.new) + list(session.deleted) if isinstance(obj, Post)]
+    for post in changed:
+        refresh_trending_top(session.connection(), post.category_id, post.id)
+
+
+def trending_by_category():
+    rows = (
+        db.session.query(TrendingPost)
+        .options(joinedload(TrendingPost.post).joinedload(Post.company))
+        .order_by(TrendingPost.category_id, TrendingPost.trending.desc())
+    )
+    by_category = {}
+    for row in rows:
+        by_category.setdefault(row.category_id, []).append(row.post)
+    return by_category
+
+
+def rebuild_trending():
+    with db.engine.begin() as conn:
+        rebuild_trending_sql(conn)
+
+
+@app.cli.command("rebuild-trending")
+def rebuild_trending_command():
+    rebuild_trending()
+    print("Ranking em alta recalculado.")
+
+
+# -----------------------------
+#   AGREGADOS DE INVESTIMENTO
+# -----------------------------
+# Totais por post, empresa, categoria e investidor em buckets por hora e por dia
+# (tabela investment_rollup). Cada investimento novo soma nos seus buckets no
+# mesmo flush; as exclusões em massa descontam antes de apagar. "Investido ao
+# longo do tempo" e "maiores investidores" leem algumas centenas de buckets em
+# vez de varrer o histórico. `flask rebuild-rollups` refaz tudo a partir dele.
+ROLLUP_MAX_DAYS = 365
+
+
+@event.listens_for(Session, "after_flush")
+def update_investment_rollups(session, flush_context):
+    ids = [obj.id for obj in session.new if isinstance(obj, InvestmentHistory)]
+    if not ids:
+        return
+    marks = ", ".join("?" * len(ids))
+    rollup_investments_sql(session.connection(), f"i.id IN ({marks})", ids)
+
+
+def unroll_investments(where, params):
+    # chamar ANTES de apagar os investimentos (ou o que cascateia para eles)
+    rollup_investments_sql(db.session.connection(), where, params, sign=-1)
+
+
+def rollup_window(grain, days):
+    now = datetime.utcnow()
+    if grain == "hour":
+        return now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=days * 24 - 1), timedelta(hours=1)
+    return now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days - 1), timedelta(days=1)
+
+
+def rollup_days(grain, days):
+    limit = app.config["ROLLUP_HOURLY_DAYS"] if grain == "hour" else ROLLUP_MAX_DAYS
+    return min(max(days or 30, 1), limit)
+
+
+def investment_series(scope, scope_id, grain="day", days=30):
+    # um ponto por bucket da janela, com zero onde não houve investimento
+    since, step = rollup_window(grain, days)
+    rows = (
+        db.session.query(InvestmentRollup.bucket, InvestmentRollup.total, InvestmentRollup.count)
+        .filter_by(scope=scope, scope_id=scope_id, grain=grain)
+        .filter(InvestmentRollup.bucket >= since)
+    )
+    by_bucket = {bucket: (total, count) for bucket, total, count in rows}
+    points, bucket, now = [], since, datetime.utcnow()
+    while bucket <= now:
+        total, count = by_bucket.get(bucket, (0, 0))
+        points.append({"bucket": bucket, "total": total, "count": count})
+        bucket += step
+    return points
+
+
+def top_investors(days=30, limit=10):
+    since, _ = rollup_window("day", days)
+    total = db.func.sum(InvestmentRollup.total).label("total")
+    rows = (
+        db.session.query(Company, total, db.func.sum(InvestmentRollup.count))
+        .join(Company, Company.id == InvestmentRollup.scope_id)
+        .filter(
+            InvestmentRollup.scope == "investor",
+            InvestmentRollup.grain == "day",
+            InvestmentRollup.bucket >= since,
+        )
+        .group_by(Company.id)
+        .order_by(total.desc(), Company.id)
+        .limit(limit)
+    )
+    return [{"company": company, "total": amount, "count": count} for company, amount, count in rows]
+
+
+def rebuild_rollups():
+    with db.engine.begin() as conn:
+        rebuild_rollups_sql(conn)
+
+
+@app.cli.command("rebuild-rollups")
+def rebuild_rollups_command():
+    rebuild_rollups()
+    print(f"Agregados de investimento recalculados ({InvestmentRollup.query.count()} buckets).")
+
+
+# -----------------------------
+#   ESCRITA ADIADA (write-behind de likes e investimentos)
+# -----------------------------
+# Com LUX_WRITE_BEHIND=1, "Curtir"/"Investir" não abrem transação no request:
+# o evento entra num buffer do processo e uma thread grava tudo o que juntou
+# numa transação só, a cada LUX_WRITE_BEHIND_INTERVAL segundos ou quando o lote
+# chega a LUX_WRITE_BEHIND_BATCH. Cada post afetado recebe um UPDATE por lote
+# (likes, investment, score, trending), cada empresa dona outro.
+# Durabilidade: no máximo ~um intervalo de eventos fica só na memória; SIGTERM
+# (worker_exit do gunicorn / atexit) grava o que falta, kill -9 perde essa janela.
+# Se o banco falhar o lote volta para o buffer (até LUX_WRITE_BEHIND_MAX_RETRIES vezes;
+# depois vai evento a evento e o que não grava é descartado no log). Com o buffer
+# em LUX_WRITE_BEHIND_MAX_PENDING o próprio request tenta gravar e, sem vaga,
+# responde 503 sem aceitar o evento (contrapressão). Quem agiu vê o próprio evento antes
+# da gravação (pending_writes na sessão, conferido contra o banco no GET).
+PENDING_WRITES_KEEP = 20
+PENDING_WRITES_SECONDS = 60
+
+
+class WriteBehindBuffer:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # também depois do fork: locks e thread não passam para o filho
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.events = []
+        self.thread = None
+        self.failures = 0
+
+    def add(self, event):
+        # buffer cheio: tenta gravar aqui antes de aceitar. Se nem assim há vaga,
+        # recusa (a view responde 503). Evento aceito nunca derruba o request:
+        # o cliente repetiria e o investimento entraria duas vezes
+        if self.pending() >= app.config["WRITE_BEHIND_MAX_PENDING"]:
+            try:
+                self.flush()
+            except Exception:
+                app.logger.exception("Write-behind: buffer cheio e lote não gravado")
+            if self.pending() >= app.config["WRITE_BEHIND_MAX_PENDING"]:
+                return False
+        with self.lock:
+            self.events.append(event)
+            pending = len(self.events)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="lux-write-behind", daemon=True)
+                self.thread.start()
+        if pending >= app.config["WRITE_BEHIND_BATCH"]:
+            self.wake.set()
+        return True
+
+    def pending(self):
+        with self.lock:
+            return len(self.events)
+
+    def run(self):
+        while True:
+            # depois de falhas, espera o dobro a cada vez (até 30s)
+            self.wake.wait(min(app.config["WRITE_BEHIND_INTERVAL"] * 2 ** self.failures, 30))
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                app.logger.exception("Write-behind: lote não gravado, fica no buffer")
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                batch, self.events = self.events, []
+            if not batch:
+                return 0
+            try:
+                with app.app_context():
+                    apply_write_batch(batch)
+            except Exception:
+                self.failures += 1
+                if self.failures < app.config["WRITE_BEHIND_MAX_RETRIES"]:
+                    with self.lock:
+                        self.events[:0] = batch
+                    raise
+                app.logger.exception("Write-behind: lote falhou %d vezes, gravando evento a evento", self.failures)
+                self.failures = 0
+                return self.apply_each(batch)
+            self.failures = 0
+            return len(batch)
+
+    def apply_each(self, batch):
+        written = 0
+        for event in batch:
+            try:
+                with app.app_context():
+                    apply_write_batch([event])
+            except Exception:
+                app.logger.exception("Write-behind: evento descartado: %r", event)
+            else:
+                written += 1
+        return written
+
+
+write_buffer = WriteBehindBuffer()
+
+
+def flush_write_behind():
+    try:
+        flushed = write_buffer.flush()
+    except Exception:
+        app.logger.exception("Write-behind: falha ao gravar no encerramento (%d eventos)", write_buffer.pending())
+        return
+    if flushed:
+        app.logger.info("Write-behind: %d eventos gravados no encerramento", flushed)
+
+
+atexit.register(flush_write_behind)
+
+
+def queue_write(kind, post, company_id, amount=0):
+    # False: buffer cheio e o banco não deu vazão (nada foi aceito)
+    at = datetime.utcnow()
+    if not write_buffer.add((kind, post.id, company_id, amount, at)):
+        return False
+    pending = session.get("pending_writes", [])
+    if kind == "like":
+        # curtir de novo não soma: fica só o último like pendente do post
+        pending = [e for e in pending if e[:2] != [post.id, "like"]]
+    pending.append([post.id, kind, amount, at.isoformat()])
+    session["pending_writes"] = pending[-PENDING_WRITES_KEEP:]
+    return True
+
+
+def write_behind_busy():
+    response = app.response_class("Muitas gravações pendentes, tente de novo em instantes.", status=503)
+    response.headers["Retry-After"] = "1"
+    return response
+
+
+def apply_write_batch(batch):
+    post_ids = {e[1] for e in batch}
+    company_ids = {e[2] for e in batch}
+    posts = {
+        pid: (owner, category)
+        for pid, owner, category in db.session.query(Post.id, Post.company_id, Post.category_id)
+        .filter(Post.id.in_(post_ids))
+    }
+    alive = {cid for (cid,) in db.session.query(Company.id).filter(Company.id.in_(company_ids))}
+    # post ou empresa apagados enquanto o evento esperava: descarta
+    batch = [e for e in batch if e[1] in posts and e[2] in alive]
+    if not batch:
+        return
+
+    conn = db.session.connection()
+    likes = sorted({(pid, cid) for kind, pid, cid, _, _ in batch if kind == "like"})
+    liked = Counter()
+    if likes:
+        liked.update(conn.execute(
+            sqlite_insert(PostLike)
+            .values([{"post_id": pid, "company_id": cid} for pid, cid in likes])
+            .on_conflict_do_nothing()
+            .returning(PostLike.post_id)
+        ).scalars())
+    # pelo ORM: o after_flush mantém os agregados de investimento
+    db.session.add_all([
+        InvestmentHistory(company_id=cid, post_id=pid, amount=amount, created_at=at)
+        for kind, pid, cid, amount, at in batch if kind == "invest"
+    ])
+    db.session.flush()
+
+    # deltas por post; trending é a soma (em log) dos eventos, cada um no seu instante
+    deltas = {}
+    for kind, pid, cid, amount, at in batch:
+        if kind == "like":
+            # só os likes que entraram de fato (o INSERT ignora repetidos)
+            if not liked[pid]:
+                continue
+            liked[pid] -= 1
+            weight = 2
+        else:
+            weight = amount * 3
+        row = deltas.setdefault(pid, {"pid": pid, "dl": 0, "di": 0, "ds": 0, "ev": None})
+        if kind == "like":
+            row["dl"] += 1
+        else:
+            row["di"] += amount
+        row["ds"] += weight
+        row["ev"] = logaddexp(row["ev"], trending_event(weight, at))
+
+    rows = list(deltas.values())
+    owners = Counter()
+    for row in rows:
+        owners[posts[row["pid"]][0]] += row["ds"]
+    if rows:
+        post = Post.__table__.c
+        conn.execute(
+            Post.__table__.update()
+            .where(post.id == db.bindparam("pid"))
+            .values(
+                likes=db.func.coalesce(post.likes, 0) + db.bindparam("dl"),
+                investment=db.func.coalesce(post.investment, 0) + db.bindparam("di"),
+                score=db.func.coalesce(post.score, 0) + db.bindparam("ds"),
+                trending=db.func.logaddexp(post.trending, db.bindparam("ev")),
+            ),
+            rows,
+        )
+        company = Company.__table__.c
+        conn.execute(
+            Company.__table__.update()
+            .where(company.id == db.bindparam("cid"))
+            .values(total_score=db.func.coalesce(company.total_score, 0) + db.bindparam("ds")),
+            [{"cid": cid, "ds": delta} for cid, delta in owners.items()],
+        )
+        for row in rows:
+            refresh_trending_top(conn, posts[row["pid"]][1], row["pid"])
+        # UPDATEs em lote pelo Core: marca as tags à mão (cache/versões no commit)
+        db.session.info.setdefault("cache_tags", set()).update(("posts", "companies"))
+    db.session.commit()
+
+
+def pending_overlay(post):
+    # o que a empresa logada fez neste post e ainda não está no banco
+    # (pode estar no buffer de outro worker): (likes, investimento)
+    entries = [e for e in session.get("pending_writes", []) if e[0] == post.id]
+    if not entries or "company_id" not in session:
+        return 0, 0
+    company_id = session["company_id"]
+    cutoff = datetime.utcnow() - timedelta(seconds=PENDING_WRITES_SECONDS)
+    entries = [e for e in entries if datetime.fromisoformat(e[3]) >= cutoff]
+    likes = investment = 0
+    confirmed = set()
+    if any(e[1] == "like" for e in entries):
+        exists = db.session.query(
+            PostLike.query.filter_by(post_id=post.id, company_id=company_id).exists()
+        ).scalar()
+        if exists:
+            confirmed.update(e[3] for e in entries if e[1] == "like")
+        else:
+            likes = 1
+    stamps = [datetime.fromisoformat(e[3]) for e in entries if e[1] == "invest"]
+    if stamps:
+        saved = {
+            at.isoformat() for (at,) in db.session.query(InvestmentHistory.created_at).filter(
+                InvestmentHistory.post_id == post.id,
+                InvestmentHistory.company_id == company_id,
+                InvestmentHistory.created_at.in_(stamps),
+            )
+        }
+        confirmed |= saved
+        investment = sum(e[2] for e in entries if e[1] == "invest" and e[3] not in saved)
+    keep = [
+        e for e in session.get("pending_writes", [])
+        if e[0] != post.id or (e in entries and e[3] not in confirmed)
+    ]
+    if keep != session.get("pending_writes"):
+        session["pending_writes"] = keep
+    return likes, investment
+
+
+# -----------------------------
+#   IMPORTAÇÃO / EXPORTAÇÃO EM MASSA
+# -----------------------------
+# Dois formatos:
+#   .json  -> o formato do database.json: {"companies": [...], "categories": [...], ...}
+#   .jsonl -> um registro por linha: {"type": "posts", "id": 1, ...}
+# A ordem abaixo respeita as chaves estrangeiras (quem é referenciado vem antes).
+# Importar grava em lotes (executemany) com um commit por lote e recalcula os
+# scores uma vez só no fim; exportar lê com yield_per, sem carregar tudo na memória.
+DATA_TABLES = OrderedDict([
+    ("categories", Category),
+    ("companies", Company),
+    ("posts", Post),
+    ("comments", Comment),
+    ("likes", PostLike),
+    ("investments", InvestmentHistory),
+    ("messages", Message),
+])
+IMPORT_BATCH_SIZE = 50000
+
+
+def import_plan(model, replace=False):
+    # monta uma vez por tabela: o INSERT cru e, por coluna, como obter o valor
+    # (default do model quando falta, DateTime em texto ISO -> formato do SQLite)
+    dialect = db.engine.dialect
+    columns = list(model.__table__.columns)
+    fields = []
+    for column in columns:
+        default = column.default.arg if column.default is not None else None
+        process = column.type.dialect_impl(dialect).bind_processor(dialect)
+        if isinstance(column.type, db.DateTime):
+            parse = lambda v, p=process: p(datetime.fromisoformat(v) if isinstance(v, str) else v)
+        else:
+            parse = process
+        fields.append((column.name, default, parse))
+    sql = "INSERT INTO {} ({}) VALUES ({})".format(
+        model.__tablename__,
+        ", ".join(c.name for c in columns),
+        ", ".join("?" for _ in columns),
+    )
+    if replace:
+        # upsert, não INSERT OR REPLACE: o REPLACE apaga a linha antiga e, com
+        # as FKs em CASCADE, levaria junto tudo que depende dela
+        sql += " ON CONFLICT (id) DO UPDATE SET " + ", ".join(
+            f"{c.name} = excluded.{c.name}" for c in columns if c.name != "id"
+        )
+    return sql, fields
+
+
+def import_row(fields, record):
+    row = []
+    for name, default, parse in fields:
+        if name in record:
+            value = record[name]
+        elif default is not None:
+            value = default(None) if callable(default) else default
+        else:
+            value = None
+        row.append(parse(value) if parse and value is not None else value)
+    return tuple(row)
+
+
+def insert_batches(rows_by_type, batch_size=IMPORT_BATCH_SIZE, replace=False):
+    # rows_by_type: iterável de (tipo, registro), já na ordem das FKs.
+    # executemany direto no driver: no volume de um snapshot, o processamento
+    # de parâmetros do SQLAlchemy custa mais que o próprio INSERT
+    plans = {kind: import_plan(model, replace) for kind, model in DATA_TABLES.items()}
+    counts = Counter()
+    batch, batch_type = [], None
+
+    def flush():
+        if not batch:
+            return
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql(plans[batch_type][0], batch)
+        counts[batch_type] += len(batch)
+        batch.clear()
+
+    for kind, record in rows_by_type:
+        if kind not in plans:
+            raise ValueError(f"tipo de registro desconhecido: {kind!r}")
+        if kind != batch_type or len(batch) >= batch_size:
+            flush()
+            batch_type = kind
+        batch.append(import_row(plans[kind][1], record))
+    flush()
+    return counts
+
+
+def read_json_snapshot(path):
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    for kind in DATA_TABLES:
+        for record in data.get(kind) or ():
+            yield kind, record
+
+
+def read_jsonl_snapshot(path):
+    # as linhas podem vir em qualquer ordem: guardamos só as que chegam antes
+    # da tabela que referenciam (no export, já saem na ordem certa)
+    order = list(DATA_TABLES)
+    pending = {kind: [] for kind in order}
+    position = 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            kind = record.pop("type", None)
+            if kind not in pending:
+                raise ValueError(f"tipo de registro desconhecido: {kind!r}")
+            index = order.index(kind)
+            if index < position:
+                pending[kind].append(record)
+                continue
+            position = index
+            yield kind, record
+    for kind in order:
+        for record in pending[kind]:
+            yield kind, record
+
+
+def bulk_load_indexes():
+    # índices não únicos das tabelas importadas (os únicos ficam: garantem a carga)
+    return [
+        index
+        for model in DATA_TABLES.values()
+        for index in model.__table__.indexes
+        if not index.unique
+    ]
+
+
+def import_snapshot(path, batch_size=IMPORT_BATCH_SIZE, replace=False):
+    reader = read_jsonl_snapshot if path.endswith(".jsonl") else read_json_snapshot
+    return import_records(reader(path), batch_size=batch_size, replace=replace)
+
+
+def bulk_load_pending(conn):
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS bulk_load (id INTEGER PRIMARY KEY, started_at DATETIME NOT NULL);"
+    )
+    return conn.exec_driver_sql("SELECT started_at FROM bulk_load;").first() is not None
+
+
+def restore_bulk_load(force=False):
+    # recria o que import_records tirou. A marca em bulk_load entra na mesma
+    # transação do DROP e sai na do CREATE: se o processo morreu no meio da carga,
+    # a próxima `flask upgrade-db` (release do deploy) encontra a marca e refaz
+    with db.engine.begin() as conn:
+        if not bulk_load_pending(conn) and not force:
+            return False
+        for index in bulk_load_indexes():
+            index.create(conn, checkfirst=True)
+        create_search_index(conn)
+        conn.exec_driver_sql("ANALYZE;")
+        conn.exec_driver_sql("DELETE FROM bulk_load;")
+    return True
+
+
+def import_records(records, batch_size=IMPORT_BATCH_SIZE, replace=False):
+    # records: iterável de (tipo, registro) na ordem das FKs (arquivo ou gerador)
+    # manter índices e FTS linha a linha custa mais que a própria carga:
+    # tira os índices secundários e o gatilho de INSERT da busca, e no fim
+    # recria tudo de uma vez (a migração 5 recria o gatilho e reconstrói o FTS)
+    with db.engine.begin() as conn:
+        bulk_load_pending(conn)
+        for index in bulk_load_indexes():
+            index.drop(conn, checkfirst=True)
+        for fts in SEARCH_INDEXES:
+            conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {fts}_ai;")
+        conn.exec_driver_sql("INSERT INTO bulk_load (started_at) VALUES (?);", (datetime.utcnow(),))
+    try:
+        counts = insert_batches(records, batch_size=batch_size, replace=replace)
+    finally:
+        restore_bulk_load(force=True)
+    if counts["likes"] or counts["investments"]:
+        # contadores antes dos scores: o score sai de likes/investimento
+        with db.engine.begin() as conn:
+            sync_post_counters_sql(conn)
+    if counts["messages"]:
+        with db.engine.begin() as conn:
+            rebuild_conversations_sql(conn)
+    if counts["investments"]:
+        rebuild_rollups()
+    # os INSERTs em lote passam por fora do ORM: marca as tags à mão para o
+    # commit do rebuild de scores versionar e invalidar o cache
+    db.session.info.setdefault("cache_tags", set()).update(("categories", "companies", "posts"))
+    # idem o autocompletar: cada worker remonta o índice
+    typeahead_change("all", "rebuild", None)
+    update_all_scores()
+    rebuild_trending()
+    return counts
+
+
+def export_rows(model, chunk_size=1000):
+    table = model.__table__
+    result = db.session.execute(
+        table.select().order_by(*table.primary_key.columns),
+        execution_options={"yield_per": chunk_size},
+    )
+    for row in result.mappings():
+        yield {k: v.isoformat() if isinstance(v, datetime) else v for k, v in row.items()}
+
+
+def export_snapshot(path):
+    counts = Counter()
+    with open(path, "w", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for kind, model in DATA_TABLES.items():
+                for row in export_rows(model):
+                    f.write(json.dumps({"type": kind, **row}, ensure_ascii=False) + "\n")
+                    counts[kind] += 1
+            return counts
+        # .json escrito aos pedaços, no mesmo formato do database.json
+        f.write("{")
+        for n, (kind, model) in enumerate(DATA_TABLES.items()):
+            f.write(("," if n else "") + "\n  " + json.dumps(kind) + ": [")
+            for row in export_rows(model):
+                f.write(("," if counts[kind] else "") + "\n    " + json.dumps(row, ensure_ascii=False))
+                counts[kind] += 1
+            f.write("\n  ]")
+        f.write("\n}\n")
+    return counts
+
+
+@app.cli.command("import-data")
+@click.argument("path")
+@click.option("--batch-size", default=IMPORT_BATCH_SIZE, show_default=True, help="Linhas por transação.")
+@click.option("--replace", is_flag=True, help="Sobrescreve linhas com o mesmo id.")
+def import_data_command(path, batch_size, replace):
+    started = time.perf_counter()
+    counts = import_snapshot(path, batch_size=batch_size, replace=replace)
+    for kind in DATA_TABLES:
+        if counts[kind]:
+            print(f"{kind}: {counts[kind]} linhas")
+    print(f"Importação concluída em {time.perf_counter() - started:.1f}s.")
+
+
+@app.cli.command("export-data")
+@click.argument("path")
+def export_data_command(path):
+    started = time.perf_counter()
+    counts = export_snapshot(path)
+    for kind in DATA_TABLES:
+        print(f"{kind}: {counts[kind]} linhas")
+    print(f"Exportação concluída em {time.perf_counter() - started:.1f}s.")
+
+
+# -----------------------------
+#   EXCLUSÃO EM CASCATA
+# -----------------------------
+# Conta ou categoria inteira em poucos DELETE ... WHERE ... IN (subquery), numa
+# transação só, sem carregar nada no Python. As FKs com ON DELETE CASCADE ficam
+# como rede de segurança (e cobrem o db.session.delete(post) das outras rotas).
+# Sem commit: quem chama faz (e o commit invalida cache/versões pelas tags).
+touched_posts = db.table("touched_post", db.column("id"))
+
+
+def delete_company_cascade(company_id):
+    conn = db.session.connection()
+    # posts de OUTRAS empresas que perdem like/investimento/comentário desta
+    conn.exec_driver_sql("CREATE TEMP TABLE IF NOT EXISTS touched_post (id INTEGER PRIMARY KEY);")
+    conn.exec_driver_sql("DELETE FROM touched_post;")
+    conn.exec_driver_sql(
+        "INSERT INTO touched_post (id) "
+        "SELECT post_id FROM post_like WHERE company_id = ? "
+        "UNION SELECT post_id FROM investment_history WHERE company_id = ? "
+        "UNION SELECT post_id FROM comment WHERE company_id = ? "
+        "EXCEPT SELECT id FROM post WHERE company_id = ?;",
+        (company_id,) * 4,
+    )
+    touched = db.select(touched_posts.c.id)
+
+    # contadores desnormalizados: tira só o que era desta empresa
+    likes_by = (
+        db.select(db.func.count(PostLike.id))
+        .where(PostLike.post_id == Post.id, PostLike.company_id == company_id)
+        .scalar_subquery()
+    )
+    invested_by = (
+        db.select(db.func.coalesce(db.func.sum(InvestmentHistory.amount), 0))
+        .where(InvestmentHistory.post_id == Post.id, InvestmentHistory.company_id == company_id)
+        .scalar_subquery()
+    )
+    db.session.execute(
+        db.update(Post)
+        .where(Post.id.in_(touched))
+        .values(
+            likes=db.func.coalesce(Post.likes, 0) - likes_by,
+            investment=db.func.coalesce(Post.investment, 0) - invested_by,
+        ),
+        execution_options={"synchronize_session": False},
+    )
+
+    unroll_investments("i.company_id = ? OR p.company_id = ?", (company_id, company_id))
+    own_categories = [cid for (cid,) in db.session.query(Post.category_id).filter_by(company_id=company_id).distinct()]
+    own_posts = db.select(Post.id).where(Post.company_id == company_id)
+    for model in (Comment, PostLike, InvestmentHistory):
+        db.session.execute(
+            db.delete(model).where((model.company_id == company_id) | model.post_id.in_(own_posts)),
+            execution_options={"synchronize_session": False},
+        )
+    db.session.execute(
+        db.delete(Message).where((Message.sender_id == company_id) | (Message.receiver_id == company_id)),
+        execution_options={"synchronize_session": False},
+    )
+    db.session.execute(
+        db.delete(Conversation).where((Conversation.low_id == company_id) | (Conversation.high_id == company_id)),
+        execution_options={"synchronize_session": False},
+    )
+    db.session.execute(
+        db.delete(Post).where(Post.company_id == company_id),
+        execution_options={"synchronize_session": False},
+    )
+    db.session.execute(
+        db.delete(Company).where(Company.id == company_id),
+        execution_options={"synchronize_session": False},
+    )
+
+    # scores dos posts afetados e das empresas donas deles
+    db.session.execute(
+        db.update(Post).where(Post.id.in_(touched)).values(score=post_score_expr()),
+        execution_options={"synchronize_session": False},
+    )
+    db.session.execute(
+        db.update(Company)
+        .where(Company.id.in_(db.select(Post.company_id).where(Post.id.in_(touched))))
+        .values(total_score=company_score_expr()),
+        execution_options={"synchronize_session": False},
+    )
+    # os posts da empresa saíram do top-K "em alta" pelo CASCADE: completa as vagas
+    for category_id in own_categories:
+        refresh_trending_top(conn, category_id)
+    # sai do autocompletar junto com os posts dela
+    typeahead_change("company", "del", company_id)
+    # o que estava carregado na sessão não existe mais
+    db.session.expire_all()
+
+
+def delete_category_cascade(category_id):
+    owners = [cid for (cid,) in db.session.query(Post.company_id).filter_by(category_id=category_id).distinct()]
+    in_category = db.select(Post.id).where(Post.category_id == category_id)
+    unroll_investments("p.category_id = ?", (category_id,))
+    for model in (Comment, PostLike, InvestmentHistory):
+        db.session.execute(
+            db.delete(model).where(model.post_id.in_(in_category)),
+            execution_options={"synchronize_session": False},
+        )
+    db.session.execute(
+        db.delete(Post).where(Post.category_id == category_id),
+        execution_options={"synchronize_session": False},
+    )
+    db.session.execute(
+        db.update(Company).where(Company.category_id == category_id).values(category_id=None),
+        execution_options={"synchronize_session": False},
+    )
+    db.session.execute(
+        db.delete(Category).where(Category.id == category_id),
+        execution_options={"synchronize_session": False},
+    )
+    update_company_scores(*owners)
+    typeahead_change("category", "del", category_id)
+    db.session.expire_all()
+
+
+# -----------------------------
+#   FILA DE JOBS
+# -----------------------------
+# Trabalho pesado sai do request: a view enfileira (na mesma transação da
+# mudança que o originou) e responde na hora; o worker (`flask run-worker`,
+# processo à parte) executa. A fila é a tabela job do próprio SQLite:
+#   - pegar um job é um UPDATE ... RETURNING só (atômico com vários workers);
+#   - falhou: volta para a fila com espera exponencial, até max_attempts;
+#   - worker morreu no meio: o job "running" travado há muito tempo volta à fila;
+#   - idempotency_key única: enfileirar de novo o mesmo trabalho é no-op,
+#     exceto se o job com a chave falhou de vez: aí ele volta para a fila.
+# O agendador do worker enfileira os jobs periódicos com a janela de tempo na
+# chave, então vários workers não duplicam a mesma execução.
+JOB_HANDLERS = {}
+# (tipo, intervalo em segundos)
+PERIODIC_JOBS = [
+    ("rebuild_scores", 3600),
+    ("backfill_categories", 3600),
+    ("purge_jobs", 86400),
+    ("rebuild_conversations", 86400),
+    ("purge_rollups", 86400),
+]
+
+
+def job(kind):
+    def register(fn):
+        JOB_HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+def enqueue(kind, key=None, run_at=None, max_attempts=3, **payload):
+    # não faz commit: o job entra junto com a transação de quem chamou.
+    # Chave já usada por um job que esgotou as tentativas: reaproveita a linha
+    # (volta para a fila zerado) em vez de bloquear a chave para sempre
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"job desconhecido: {kind}")
+    values = dict(
+        kind=kind,
+        payload=json.dumps(payload),
+        status="queued",
+        attempts=0,
+        run_at=run_at or datetime.utcnow(),
+        max_attempts=max_attempts,
+    )
+    stmt = sqlite_insert(Job).values(idempotency_key=key, **values)
+    if key is not None:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Job.idempotency_key],
+            set_=dict(values, locked_by=None, locked_at=None, finished_at=None),
+            where=Job.status == "failed",
+        )
+    result = db.session.execute(stmt)
+    return bool(result.rowcount)
+
+
+def claim_job(worker_id):
+    now = datetime.utcnow()
+    next_id = (
+        db.select(Job.id)
+        .where(Job.status == "queued", Job.run_at <= now)
+        .order_by(Job.run_at, Job.id)
+        .limit(1)
+        .scalar_subquery()
+    )
+    with db.engine.begin() as conn:
+        return conn.execute(
+            db.update(Job)
+            .where(Job.id == next_id)
+            .values(status="running", attempts=Job.attempts + 1, locked_by=worker_id, locked_at=now)
+            .returning(Job.id, Job.kind, Job.payload, Job.attempts, Job.max_attempts)
+        ).first()
+
+
+def finish_job(job_id, **values):
+    with db.engine.begin() as conn:
+        conn.execute(db.update(Job).where(Job.id == job_id).values(locked_by=None, **values))
+
+
+def run_job(claimed):
+    try:
+        JOB_HANDLERS[claimed.kind](**json.loads(claimed.payload))
+    except Exception as e:
+        db.session.rollback()
+        error = f"{type(e).__name__}: {e}"
+        if claimed.attempts >= claimed.max_attempts:
+            app.logger.error("Job %s #%d falhou de vez: %s", claimed.kind, claimed.id, error)
+            finish_job(claimed.id, status="failed", last_error=error, finished_at=datetime.utcnow())
+        else:
+            delay = app.config["JOB_RETRY_DELAY"] * 2 ** (claimed.attempts - 1)
+            app.logger.warning("Job %s #%d falhou (tentativa %d), nova tentativa em %.0fs: %s",
+                               claimed.kind, claimed.id, claimed.attempts, delay, error)
+            finish_job(claimed.id, status="queued", last_error=error,
+                       run_at=datetime.utcnow() + timedelta(seconds=delay))
+        return False
+    finally:
+        db.session.remove()
+    finish_job(claimed.id, status="done", finished_at=datetime.utcnow())
+    return True
+
+
+def requeue_stale_jobs():
+    limit = datetime.utcnow() - timedelta(seconds=app.config["JOB_LOCK_TIMEOUT"])
+    with db.engine.begin() as conn:
+        conn.execute(
+            db.update(Job)
+            .where(Job.status == "running", Job.locked_at < limit)
+            .values(status="queued", locked_by=None, last_error="worker parou no meio do job")
+        )
+
+
+def schedule_periodic_jobs():
+    now = time.time()
+    for kind, interval in PERIODIC_JOBS:
+        enqueue(kind, key=f"{kind}@{int(now // interval)}")
+    db.session.commit()
+
+
+def work_queue(worker_id, stop, once=False):
+    with app.app_context():
+        while not stop.is_set():
+            claimed = claim_job(worker_id)
+            if claimed is None:
+                if once:
+                    return
+                stop.wait(app.config["JOB_POLL_INTERVAL"])
+                continue
+            run_job(claimed)
+
+
+def run_worker(threads=1, once=False, stop=None):
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    stop = stop or threading.Event()
+    with app.app_context():
+        requeue_stale_jobs()
+        schedule_periodic_jobs()
+    if once:
+        work_queue(worker_id, stop, once=True)
+        return
+    pool = [
+        threading.Thread(target=work_queue, args=(f"{worker_id}:{n}", stop), daemon=True)
+        for n in range(threads)
+    ]
+    for t in pool:
+        t.start()
+    # a thread principal só agenda e recolhe jobs de workers que morreram
+    while not stop.wait(30):
+        with app.app_context():
+            requeue_stale_jobs()
+            schedule_periodic_jobs()
+    for t in pool:
+        t.join()
+
+
+def start_worker_thread():
+    # worker dentro do processo (servidor de desenvolvimento, sem `run-worker`)
+    threading.Thread(target=run_worker, name="lux-job-worker", daemon=True).start()
+
+
+@app.cli.command("run-worker")
+@click.option("--threads", default=1, show_default=True, help="Jobs em paralelo.")
+@click.option("--once", is_flag=True, help="Esvazia a fila e sai (cron/deploy).")
+def run_worker_command(threads, once):
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    print(f"Worker iniciado ({threads} thread(s)).")
+    try:
+        run_worker(threads=threads, once=once, stop=stop)
+    except KeyboardInterrupt:
+        stop.set()
+    print("Worker encerrado.")
+
+
+@app.cli.command("jobs")
+def jobs_command():
+    for status, count in db.session.query(Job.status, db.func.count(Job.id)).group_by(Job.status):
+        print(f"{status}: {count}")
+    for j in Job.query.filter_by(status="failed").order_by(Job.id.desc()).limit(20):
+        print(f"  #{j.id} {j.kind} ({j.attempts} tentativas): {j.last_error}")
+
+
+@job("rebuild_scores")
+def rebuild_scores_job():
+    # os scores são mantidos incrementalmente; aqui só se corrige o que divergiu
+    fixed = update_all_scores()
+    if any(fixed.values()):
+        app.logger.warning("rebuild_scores: scores divergentes corrigidos %s", fixed)
+
+
+@job("backfill_categories")
+def backfill_categories_job():
+    fix_companies_missing_category()
+
+
+@job("rebuild_conversations")
+def rebuild_conversations_job():
+    # backfill/reconciliação: mensagens que entraram por fora do ORM (import-data)
+    with db.engine.begin() as conn:
+        rebuild_conversations_sql(conn)
+
+
+@job("purge_rollups")
+def purge_rollups_job():
+    # buckets por hora além da janela configurada (os diários ficam)
+    limit = datetime.utcnow() - timedelta(days=app.config["ROLLUP_HOURLY_DAYS"])
+    db.session.execute(
+        db.delete(InvestmentRollup).where(InvestmentRollup.grain == "hour", InvestmentRollup.bucket < limit),
+        execution_options={"synchronize_session": False},
+    )
+    db.session.commit()
+
+
+@job("purge_jobs")
+def purge_jobs_job():
+    limit = datetime.utcnow() - timedelta(days=app.config["JOB_KEEP_DAYS"])
+    db.session.execute(
+        db.delete(Job).where(Job.status == "done", Job.finished_at < limit),
+        execution_options={"synchronize_session": False},
+    )
+    db.session.commit()
+
+
+@job("delete_company")
+def delete_company_job(company_id, name):
+    # confere o nome: o id pode ter sido reaproveitado por uma empresa nova
+    empresa = db.session.get(Company, company_id)
+    if not empresa or empresa.name != name:
+        return
+    delete_company_cascade(company_id)
+    db.session.commit()
+
+
+# -----------------------------
+#   CONSULTAS (eager loading)
+# -----------------------------
+# Cada view carrega aqui exatamente o que o template dela lê,
+# num número fixo de queries (nada de lazy load dentro de loop no Jinja).
+
+# nº de comentários como coluna adiada: só entra no SELECT (como subquery) com undefer()
+Post.comments_count = db.column_property(comments_count_expr(), deferred=True)
+
+
+def load_top_posts(limit=50, mode="score"):
+    return (
+        Post.query.options(joinedload(Post.company), undefer(Post.comments_count))
+        .order_by(RANKING_MODES[mode].desc())
+        .limit(limit)
+        .all()
+    )
+
+
+def load_post(post_id):
+    # post_view.html: autor, categoria e comentários com os autores
+    return (
+        Post.query.options(
+            joinedload(Post.company),
+            joinedload(Post.category),
+            selectinload(Post.comments).joinedload(Comment.author),
+        )
+        .filter(Post.id == post_id)
+        .first_or_404()
+    )
+
+
+def load_categories_with_posts(query=None):
+    # categories.html: posts de cada categoria com a empresa de cada post
+    query = query if query is not None else Category.query
+    return query.options(selectinload(Category.posts).joinedload(Post.company)).all()
+
+
+def posts_with_company(query):
+    return query.options(joinedload(Post.company))
+
+
+def investments_with_relations(query):
+    # post (com a empresa dona) e investidor de cada linha do histórico
+    return query.options(
+        joinedload(InvestmentHistory.post).joinedload(Post.company),
+        joinedload(InvestmentHistory.investor),
+    )
+
+
+# -----------------------------
+#   PAGINAÇÃO POR CURSOR (keyset)
+# -----------------------------
+# Em vez de OFFSET, cada página continua a partir da chave (ex.: created_at, id)
+# da última linha vista, então o custo por página não cresce com o histórico.
+# O token leva a direção: "n:" = próxima página, "p:" = página anterior.
+PAGE_SIZE = 50
+
+KeysetPage = namedtuple("KeysetPage", "items next_cursor prev_cursor")
+
+
+def encode_cursor(direction, values):
+    raw = json.dumps(
+        [v.isoformat() if isinstance(v, datetime) else v for v in values],
+        separators=(",", ":"),
+    )
+    return direction + ":" + base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token, columns):
+    try:
+        direction, data = token.split(":", 1)
+        values = json.loads(base64.urlsafe_b64decode(data + "=" * (-len(data) % 4)))
+        if direction not in ("n", "p") or len(values) != len(columns):
+            return None, None
+        values = [
+            datetime.fromisoformat(v) if isinstance(col.type, db.DateTime) and v is not None else v
+            for col, v in zip(columns, values)
+        ]
+        return direction, values
+    except (ValueError, TypeError):
+        return None, None
+
+
+def keyset_paginate(query, *columns, cursor=None, per_page=PAGE_SIZE, descending=True):
+    direction, values = decode_cursor(cursor, columns) if cursor else (None, None)
+    key = db.tuple_(*columns)
+    backwards = direction == "p"
+
+    if values is not None:
+        # "para frente" na ordem pedida é < quando desc, > quando asc
+        if descending != backwards:
+            query = query.filter(key < db.tuple_(*values))
+        else:
+            query = query.filter(key > db.tuple_(*values))
+
+    if descending != backwards:
+        query = query.order_by(*[c.desc() for c in columns])
+    else:
+        query = query.order_by(*[c.asc() for c in columns])
+
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    def key_of(obj):
+        return [getattr(obj, c.key) for c in columns]
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if has_more or backwards:
+            next_cursor = encode_cursor("n", key_of(rows[-1]))
+        if (has_more and backwards) or (values is not None and not backwards):
+            prev_cursor = encode_cursor("p", key_of(rows[0]))
+    return KeysetPage(rows, next_cursor, prev_cursor)
+
+
+@app.template_global()
+def page_url(param, token):
+    args = dict(request.view_args or {})
+    args.update(request.args.to_dict())
+    args[param] = token
+    return url_for(request.endpoint, **args)
+
+
+# -----------------------------
+#   INSTRUMENTAÇÃO (queries, tempos, profiling)
+# -----------------------------
+# Por request: nº de queries, tempo total em SQL, linhas (objetos ORM carregados +
+# linhas afetadas por escrita), tempo de render dos templates e a latência.
+# Os agregados ficam num registro em memória por processo e saem em formato
+# Prometheus em /admin/metrics (cada worker do gunicorn expõe os seus números).
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500, 1000, 10000)
+
+METRICS = {
+    "lux_requests_total": ("counter", "Requests por rota, método e status.", None),
+    "lux_request_duration_seconds": ("histogram", "Latência dos requests por rota.", LATENCY_BUCKETS),
+    "lux_request_queries": ("histogram", "Queries SQL por request.", COUNT_BUCKETS),
+    "lux_request_sql_seconds": ("histogram", "Tempo total em SQL por request.", LATENCY_BUCKETS),
+    "lux_request_rows": ("histogram", "Linhas por request (objetos ORM carregados + linhas escritas).", COUNT_BUCKETS),
+    "lux_template_render_seconds": ("histogram", "Tempo de render por template.", LATENCY_BUCKETS),
+    "lux_slow_queries_total": ("counter", "Queries acima de LUX_SLOW_QUERY_MS.", None),
+    "lux_slow_requests_total": ("counter", "Requests acima de LUX_SLOW_REQUEST_MS.", None),
+    "lux_profiles_captured_total": ("counter", "Perfis/pilhas guardados para requests lentos.", None),
+}
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = METRICS[name][2]
+        with self.lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = [[0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    h[0][i] += 1
+            h[1] += value
+            h[2] += 1
+
+    def render(self):
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {k: (list(v[0]), v[1], v[2]) for k, v in self.histograms.items()}
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                for (n, labels), value in sorted(counters.items()):
+                    if n == name:
+                        lines.append(f"{name}{format_labels(labels)} {value}")
+                continue
+            for (n, labels), (counts, total, count) in sorted(histograms.items()):
+                if n != name:
+                    continue
+                for bound, c in zip(buckets, counts):
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', repr(float(bound))),))} {c}")
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{format_labels(labels)} {total}")
+                lines.append(f"{name}_count{format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels) + "}"
+
+
+metrics = MetricsRegistry()
+# perfis e pilhas dos últimos requests lentos (mais novos no fim)
+slow_profiles = deque(maxlen=app.config["PROFILE_KEEP"])
+# requests em andamento, para o amostrador de pilhas: thread -> (início, método, caminho)
+inflight_requests = {}
+
+
+def request_label():
+    # endpoint, não a URL: /post/1, /post/2... viram uma série só
+    return request.endpoint or "unmatched"
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def count_request_queries(conn, cursor, statement, parameters, context, executemany):
+    # início guardado no contexto da própria execução (não numa pilha por conexão):
+    # statement que falha não tem after_cursor_execute e não desalinha os seguintes
+    if context is not None:
+        context.lux_query_started = time.perf_counter()
+    if has_request_context():
+        g.query_count = g.get("query_count", 0) + 1
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def time_request_queries(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "lux_query_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    in_request = has_request_context()
+    if in_request:
+        g.sql_time = g.get("sql_time", 0.0) + elapsed
+        if cursor.rowcount > 0:
+            g.row_count = g.get("row_count", 0) + cursor.rowcount
+    if elapsed * 1000 >= app.config["SLOW_QUERY_MS"]:
+        where = f"{request.method} {request.path}" if in_request else "fora de request"
+        app.logger.warning("SQL lento (%.0f ms, %s): %s", elapsed * 1000, where, " ".join(statement.split())[:500])
+        metrics.inc("lux_slow_queries_total", {"endpoint": request_label() if in_request else "none"})
+
+
+@event.listens_for(db.Model, "load", propagate=True)
+def count_loaded_rows(target, context):
+    if has_request_context():
+        g.row_count = g.get("row_count", 0) + 1
+
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+    g.setdefault("render_started", []).append(time.perf_counter())
+
+
+@template_rendered.connect_via(app)
+def stop_template_timer(sender, template, context, **extra):
+    started = g.get("render_started")
+    if started:
+        metrics.observe("lux_template_render_seconds", {"template": template.name or "?"}, time.perf_counter() - started.pop())
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if app.config["PROFILE_STACKS"]:
+        inflight_requests[threading.get_ident()] = (g.request_started, request.method, request.full_path)
+    if app.config["PROFILE_SAMPLE"] and random.random() < app.config["PROFILE_SAMPLE"]:
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+@app.after_request
+def check_query_budget(response):
+    g.response_status = response.status_code
+    count = g.get("query_count", 0)
+    if app.config["QUERY_COUNT_HEADER"]:
+        response.headers["X-Query-Count"] = str(count)
+    if not (app.debug or app.config["QUERY_BUDGET_ENFORCE"]):
+        return response
+    budget = app.config["QUERY_BUDGET"]
+    if count > budget:
+        msg = f"{request.method} {request.path} fez {count} queries (limite {budget})"
+        if app.config["QUERY_BUDGET_STRICT"]:
+            raise RuntimeError(msg)
+        app.logger.warning(msg)
+    return response
+
+
+@app.teardown_request
+def record_request_metrics(exc):
+    # teardown roda também quando a view levanta exceção (conta como 500)
+    started = g.pop("request_started", None)
+    inflight_requests.pop(threading.get_ident(), None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+
+    endpoint = request_label()
+    status = g.get("response_status", 500)
+    queries = g.get("query_count", 0)
+    sql_time = g.get("sql_time", 0.0)
+    labels = {"endpoint": endpoint}
+    metrics.inc("lux_requests_total", {"endpoint": endpoint, "method": request.method, "status": status})
+    metrics.observe("lux_request_duration_seconds", labels, elapsed)
+    metrics.observe("lux_request_queries", labels, queries)
+    metrics.observe("lux_request_sql_seconds", labels, sql_time)
+    metrics.observe("lux_request_rows", labels, g.get("row_count", 0))
+
+    if elapsed * 1000 < app.config["SLOW_REQUEST_MS"] or g.get("long_lived"):
+        return
+    metrics.inc("lux_slow_requests_total", labels)
+    app.logger.warning(
+        "Request lento: %s %s %.0f ms (%d queries, %.0f ms em SQL)",
+        request.method, request.full_path, elapsed * 1000, queries, sql_time * 1000,
+    )
+    if profiler is not None:
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(40)
+        save_slow_profile("cprofile", request.method, request.full_path, elapsed, out.getvalue())
+
+
+def save_slow_profile(kind, method, path, elapsed, text):
+    slow_profiles.append({
+        "kind": kind,
+        "at": datetime.utcnow().isoformat(timespec="seconds"),
+        "request": f"{method} {path}",
+        "elapsed_ms": round(elapsed * 1000),
+        "text": text,
+    })
+    metrics.inc("lux_profiles_captured_total", {"kind": kind})
+
+
+def sample_slow_stacks():
+    # thread de fundo: pega a pilha de quem passou do limite enquanto ainda roda,
+    # uma vez por request (mostra onde ele está preso, sem o custo do cProfile)
+    limit = app.config["SLOW_REQUEST_MS"] / 1000.0
+    seen = set()
+    while True:
+        time.sleep(max(limit / 2, 0.05))
+        frames = sys._current_frames()
+        now = time.perf_counter()
+        for ident, (started, method, path) in list(inflight_requests.items()):
+            if now - started < limit or (ident, started) in seen or ident not in frames:
+                continue
+            seen.add((ident, started))
+            save_slow_profile("stack", method, path, now - started, "".join(traceback.format_stack(frames[ident])))
+        seen = {key for key in seen if inflight_requests.get(key[0], (None,))[0] == key[1]}
+
+
+def start_stack_sampler():
+    # uma por processo: no fork só a thread que chamou o fork sobrevive
+    if not app.config["PROFILE_STACKS"]:
+        return
+    if any(t.name == "lux-stack-sampler" for t in threading.enumerate()):
+        return
+    threading.Thread(target=sample_slow_stacks, name="lux-stack-sampler", daemon=True).start()
+
+
+def is_metrics_admin():
+    token = app.config["METRICS_TOKEN"]
+    if token and request.headers.get("Authorization") == f"Bearer {token}":
+        return True
+    return session.get("name") == "Lux"
+
+
+@app.route("/admin/metrics")
+def admin_metrics():
+    if not is_metrics_admin():
+        return "Acesso restrito", 403
+    return app.response_class(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/admin/profiles")
+def admin_profiles():
+    if not is_metrics_admin():
+        return "Acesso restrito", 403
+    if not slow_profiles:
+        return app.response_class("Nenhum request lento capturado.\n", mimetype="text/plain")
+    parts = [
+        f"=== {p['at']} {p['request']} ({p['elapsed_ms']} ms, {p['kind']}) ===\n{p['text']}"
+        for p in reversed(slow_profiles)
+    ]
+    return app.response_class("\n".join(parts), mimetype="text/plain")
+
+
+# -----------------------------
+#   CACHE DE PÁGINAS E FRAGMENTOS
+# -----------------------------
+class MemoryCache:
+    # TTL + LRU dentro do processo
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at < time.time():
+                del self.data[key]
+                return None
+            self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.data[key] = (value, time.time() + ttl if ttl else None)
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_entries:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+class SQLiteCache:
+    # mesmo contrato do MemoryCache, num arquivo separado do banco principal,
+    # então todos os workers da máquina enxergam as mesmas entradas e invalidações
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self.local = threading.local()
+        with self.conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(key TEXT PRIMARY KEY, value BLOB, expires_at REAL, used_at REAL);"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_used_at ON cache (used_at);")
+
+    def conn(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL;")
+            conn.execute("PRAGMA synchronous = OFF;")
+            self.local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self.conn()
+        row = conn.execute("SELECT value, expires_at FROM cache WHERE key = ?;", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if row[1] is not None and row[1] < now:
+            conn.execute("DELETE FROM cache WHERE key = ?;", (key,))
+            return None
+        conn.execute("UPDATE cache SET used_at = ? WHERE key = ?;", (now, key))
+        return pickle.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        conn = self.conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at, used_at) VALUES (?, ?, ?, ?);",
+            (key, pickle.dumps(value), now + ttl if ttl else None, now),
+        )
+        count = conn.execute("SELECT COUNT(*) FROM cache;").fetchone()[0]
+        if count > self.max_entries:
+            conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY used_at LIMIT ?);",
+                (count - self.max_entries,),
+            )
+
+    def delete(self, key):
+        self.conn().execute("DELETE FROM cache WHERE key = ?;", (key,))
+
+    def clear(self):
+        self.conn().execute("DELETE FROM cache;")
+
+
+class NullCache:
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+def make_cache_backend():
+    kind = app.config["CACHE_BACKEND"]
+    if kind == "memory":
+        return MemoryCache(app.config["CACHE_MAX_ENTRIES"])
+    if kind == "sqlite":
+        return SQLiteCache(app.config["CACHE_PATH"], app.config["CACHE_MAX_ENTRIES"])
+    if kind == "none":
+        return NullCache()
+    raise RuntimeError(f"LUX_CACHE_BACKEND inválido: {kind}")
+
+
+page_cache = make_cache_backend()
+
+# Invalidação por tag: a chave de cada página leva o token atual das tags de que
+# ela depende. Invalidar = trocar o token, e as entradas antigas morrem pelo LRU/TTL.
+# Token novo (não contador) para que uma tag despejada pelo LRU nunca "volte" a um
+# valor antigo. Abaixo, quais tags cada model afeta.
+CACHE_TAGS_BY_MODEL = {
+    Category: ("categories",),
+    Company: ("companies",),
+    Post: ("posts",),
+    Comment: ("posts",),
+    PostLike: ("posts",),
+    InvestmentHistory: ("posts",),
+}
+
+
+def tag_token(tag):
+    token = page_cache.get("tag:" + tag)
+    if token is None:
+        token = uuid.uuid4().hex[:12]
+        page_cache.set("tag:" + tag, token)
+    return token
+
+
+def invalidate_cache(*tags):
+    for tag in tags:
+        page_cache.set("tag:" + tag, uuid.uuid4().hex[:12])
+
+
+def cache_key(kind, tags, *parts):
+    tokens = ".".join(tag_token(t) for t in tags)
+    return ":".join([kind, tokens] + [str(p) for p in parts])
+
+
+def cached_page(*tags, ttl=None, arg_tags=None):
+    # só GET anônimo: a página não depende de sessão, então é igual para todo visitante.
+    # arg_tags: tags a mais quando o parâmetro vem na URL ({"q": ("posts",)}: a busca lê posts)
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != "GET" or "company_id" in session:
+                return view(*args, **kwargs)
+            page_tags = tags
+            for arg, extra in (arg_tags or {}).items():
+                if request.args.get(arg, "").strip():
+                    page_tags = page_tags + tuple(extra)
+            key = cache_key("page", page_tags, request.full_path)
+            # compress_response guarda/usa a versão comprimida sob a mesma chave
+            g.page_cache_key, g.page_cache_ttl = key, ttl or app.config["CACHE_TTL"]
+            hit = page_cache.get(key)
+            if hit is not None:
+                body, mimetype = hit
+                return app.response_class(body, mimetype=mimetype)
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.direct_passthrough:
+                page_cache.set(key, (response.get_data(), response.mimetype), ttl or app.config["CACHE_TTL"])
+            return response
+        return wrapper
+    return decorator
+
+
+@app.template_global()
+def cached_fragment(name, *parts, tags=("posts", "companies", "categories"), ttl=None, caller=None):
+    # uso no template: {% call cached_fragment("nome", id) %} ... {% endcall %}
+    key = cache_key("fragment", tags, name, *parts)
+    html = page_cache.get(key)
+    if html is None:
+        html = str(caller())
+        page_cache.set(key, html, ttl or app.config["CACHE_TTL"])
+    return Markup(html)
+
+
+def cache_tags_for(mapper):
+    return CACHE_TAGS_BY_MODEL.get(mapper.class_, ())
+
+
+@event.listens_for(Session, "before_flush")
+def collect_cache_tags_on_flush(session, flush_context, instances):
+    changed = session.info.setdefault("cache_tags", set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        changed.update(CACHE_TAGS_BY_MODEL.get(type(obj), ()))
+
+
+@event.listens_for(Session, "do_orm_execute")
+def collect_cache_tags_on_bulk(orm_execute_state):
+    # UPDATE/DELETE/INSERT em massa (contadores, scores) não passam pelo flush
+    if orm_execute_state.is_select or orm_execute_state.bind_mapper is None:
+        return
+    changed = orm_execute_state.session.info.setdefault("cache_tags", set())
+    changed.update(cache_tags_for(orm_execute_state.bind_mapper))
+
+
+@event.listens_for(Session, "before_commit")
+def bump_data_versions(session):
+    # o flush do commit ainda não rodou; roda antes para coletar as tags
+    session.flush()
+    tags = session.info.get("cache_tags")
+    if not tags:
+        return
+    now = datetime.utcnow()
+    stmt = sqlite_insert(DataVersion).values([{"name": t, "version": 1, "changed_at": now} for t in sorted(tags)])
+    session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[DataVersion.name],
+            set_={"version": DataVersion.version + 1, "changed_at": now},
+        )
+    )
+
+
+@event.listens_for(Session, "after_commit")
+def invalidate_cache_after_commit(session):
+    tags = session.info.pop("cache_tags", None)
+    if tags:
+        invalidate_cache(*tags)
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_cache_tags(session):
+    session.info.pop("cache_tags", None)
+
+
+# -----------------------------
+#   GET CONDICIONAL (ETag / Last-Modified)
+# -----------------------------
+# Cada página declara de que dados depende (uma função que devolve uma "semente"
+# e a data da última mudança). Se o navegador/proxy já tem a mesma versão,
+# respondemos 304 sem consultar o resto nem renderizar nada.
+def data_versions(*tags):
+    rows = DataVersion.query.filter(DataVersion.name.in_(tags)).all()
+    seed = sorted((r.name, r.version) for r in rows)
+    return seed, max((r.changed_at for r in rows), default=None)
+
+
+def conditional_page(version):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != "GET":
+                return view(*args, **kwargs)
+            seed, last_modified = version(**kwargs)
+            if seed is None:
+                return view(*args, **kwargs)
+            # a navegação muda com o login, então a sessão entra no ETag
+            raw = repr((seed, session.get("company_id"), request.full_path))
+            etag = hashlib.sha1(raw.encode()).hexdigest()[:20]
+            if last_modified is not None:
+                last_modified = last_modified.replace(microsecond=0, tzinfo=timezone.utc)
+
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(etag)
+            else:
+                not_modified = (
+                    last_modified is not None
+                    and request.if_modified_since is not None
+                    and last_modified <= request.if_modified_since
+                )
+            response = app.response_class(status=304) if not_modified else make_response(view(*args, **kwargs))
+            if response.status_code in (200, 304):
+                response.set_etag(etag)
+                if last_modified is not None:
+                    response.last_modified = last_modified
+                if "company_id" in session:
+                    response.headers["Cache-Control"] = "private, no-cache"
+                else:
+                    response.headers["Cache-Control"] = f"public, max-age={app.config['HTTP_MAX_AGE']}, must-revalidate"
+                response.vary.add("Cookie")
+            return response
+        return wrapper
+    return decorator
+
+
+def post_version(post_id):
+    # write-behind ainda não gravado por esta sessão: sem 304, a página soma o pendente
+    if any(e[0] == post_id for e in session.get("pending_writes", ())):
+        return None, None
+    updated_at = db.session.query(Post.updated_at).filter(Post.id == post_id).scalar()
+    if updated_at is None:
+        return None, None
+    # a página mostra também o nome da empresa, da categoria e dos autores dos
+    # comentários: renomear qualquer um deles muda as versões de companies/categories
+    comments = (
+        db.session.query(db.func.count(Comment.id), db.func.max(Comment.id), db.func.max(Comment.created_at))
+        .filter(Comment.post_id == post_id)
+        .one()
+    )
+    seed, changed_at = data_versions("companies", "categories")
+    last = max(d for d in (updated_at, comments[2], changed_at) if d is not None)
+    return (post_id, updated_at.isoformat(), comments[0], comments[1], seed), last
+
+
+def company_version(company_id):
+    updated_at = db.session.query(Company.updated_at).filter(Company.id == company_id).scalar()
+    if updated_at is None:
+        return None, None
+    # post novo, editado ou apagado: a contagem cobre o que sumiu, o max o resto
+    posts_count, posts_at = (
+        db.session.query(db.func.count(Post.id), db.func.max(Post.updated_at))
+        .filter(Post.company_id == company_id)
+        .one()
+    )
+    seed, changed_at = data_versions("categories")
+    last = max(d for d in (updated_at, posts_at, changed_at) if d is not None)
+    return (company_id, updated_at.isoformat(), posts_count, posts_at and posts_at.isoformat(), seed), last
+
+
+def ranking_version(**kwargs):
+    return data_versions("posts", "companies", "categories")
+
+
+# -----------------------------
+#   COMPRESSÃO E ARQUIVOS ESTÁTICOS
+# -----------------------------
+# Respostas de texto (HTML, JSON, CSS...) saem comprimidas conforme o
+# Accept-Encoding (br se o pacote brotli estiver instalado, senão gzip), a partir
+# de LUX_COMPRESS_MIN_SIZE bytes. Streams (SSE) e arquivos (send_file) passam direto.
+# Páginas do cache_page guardam também a versão comprimida: o hit não recomprime.
+#
+# Estáticos: asset_url("css/lux.css") vira /static/css/lux.<hash>.css, servido
+# com cache de um ano e "immutable" (mudou o conteúdo, muda a URL).
+# `flask build-assets` grava .gz/.br ao lado de cada arquivo de texto e o /static
+# entrega a versão pré-comprimida (nível máximo, sem custo por request).
+COMPRESSIBLE_TYPES = {
+    "text/html", "text/css", "text/plain", "text/csv", "text/javascript",
+    "application/javascript", "application/json", "image/svg+xml",
+}
+PRECOMPRESSED_SUFFIX = {"br": ".br", "gzip": ".gz"}
+STATIC_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# "css/lux.css" -> "css/lux.<hash>.css" e o inverso (preenchidos por load_assets)
+asset_manifest = {}
+asset_sources = {}
+
+
+def accepted_encodings():
+    # em ordem de preferência, só as que o cliente aceita (q > 0)
+    offered = ("br", "gzip") if brotli is not None else ("gzip",)
+    return [e for e in offered if request.accept_encodings[e]]
+
+
+def compress_body(data, encoding, best=False):
+    if encoding == "br":
+        return brotli.compress(data, quality=11 if best else app.config["COMPRESS_BROTLI_QUALITY"])
+    # mtime=0: mesmo conteúdo, mesmos bytes (ETag estável dos .gz)
+    return gzip.compress(data, compresslevel=9 if best else app.config["COMPRESS_LEVEL"], mtime=0)
+
+
+@app.after_request
+def compress_response(response):
+    if response.mimetype not in COMPRESSIBLE_TYPES or response.direct_passthrough or response.is_streamed:
+        return response
+    response.vary.add("Accept-Encoding")
+    if response.status_code < 200 or response.status_code in (204, 206, 304) or "Content-Encoding" in response.headers:
+        return response
+    encodings = accepted_encodings()
+    if not encodings or len(response.get_data()) < app.config["COMPRESS_MIN_SIZE"]:
+        return response
+    encoding = encodings[0]
+    # só o 200 é o corpo que está no cache da página
+    key = g.get("page_cache_key") if response.status_code == 200 else None
+    body = page_cache.get(f"{key}:{encoding}") if key else None
+    if body is None:
+        body = compress_body(response.get_data(), encoding)
+        if key:
+            page_cache.set(f"{key}:{encoding}", body, g.page_cache_ttl)
+    response.set_data(body)
+    response.headers["Content-Encoding"] = encoding
+    # o corpo mudou de bytes: o ETag forte vira fraco (o If-None-Match compara fraco)
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def load_assets():
+    manifest, sources = {}, {}
+    root = app.static_folder
+    for folder, _, files in os.walk(root):
+        for name in files:
+            if name.endswith((".gz", ".br", ".tmp")):
+                continue
+            path = os.path.join(folder, name)
+            rel = os.path.relpath(path, root).replace(os.sep, "/")
+            with open(path, "rb") as f:
+                digest = hashlib.sha1(f.read()).hexdigest()[:10]
+            stem, ext = os.path.splitext(rel)
+            manifest[rel] = f"{stem}.{digest}{ext}"
+            sources[manifest[rel]] = rel
+    asset_manifest.clear()
+    asset_manifest.update(manifest)
+    asset_sources.clear()
+    asset_sources.update(sources)
+
+
+@app.template_global()
+def asset_url(path):
+    # em debug o arquivo muda sem reiniciar: sem hash (e sem cache longo)
+    if not app.debug:
+        path = asset_manifest.get(path, path)
+    return url_for("static", filename=path)
+
+
+def serve_static(filename):
+    source = asset_sources.get(filename, filename)
+    mimetype = mimetypes.guess_type(source)[0]
+    response = None
+    if mimetype in COMPRESSIBLE_TYPES:
+        path = safe_join(app.static_folder, source)
+        for encoding in accepted_encodings():
+            packed = source + PRECOMPRESSED_SUFFIX[encoding]
+            packed_path = safe_join(app.static_folder, packed)
+            # .gz/.br mais velho que o original (editado sem build-assets): ignora
+            if path and os.path.isfile(packed_path) and os.path.getmtime(packed_path) >= os.path.getmtime(path):
+                response = send_from_directory(app.static_folder, packed, mimetype=mimetype)
+                response.headers["Content-Encoding"] = encoding
+                break
+        if response is None:
+            response = send_from_directory(app.static_folder, source)
+        response.vary.add("Accept-Encoding")
+    else:
+        response = send_from_directory(app.static_folder, source)
+    if filename in asset_sources:
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    return response
+
+
+app.view_functions["static"] = serve_static
+
+
+def build_assets():
+    load_assets()
+    written = 0
+    for rel in sorted(asset_manifest):
+        if mimetypes.guess_type(rel)[0] not in COMPRESSIBLE_TYPES:
+            continue
+        path = os.path.join(app.static_folder, rel)
+        with open(path, "rb") as f:
+            data = f.read()
+        for encoding, suffix in PRECOMPRESSED_SUFFIX.items():
+            target = path + suffix
+            if encoding == "br" and brotli is None:
+                continue
+            if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+                continue
+            # arquivo temporário + rename: workers nunca leem um .gz pela metade
+            with open(target + ".tmp", "wb") as f:
+                f.write(compress_body(data, encoding, best=True))
+            os.replace(target + ".tmp", target)
+            written += 1
+    return written
+
+
+@app.cli.command("build-assets")
+def build_assets_command():
+    written = build_assets()
+    for rel, hashed in sorted(asset_manifest.items()):
+        print(f"{rel} -> {hashed}")
+    print(f"{written} arquivos pré-comprimidos gravados" + ("" if brotli is not None else " (só gzip: pacote brotli ausente)"))
+
+
+load_assets()
+
+
+# -----------------------------
+#   BUSCA (FTS5)
+# -----------------------------
+SEARCH_PER_PAGE = 20
+SEARCH_MAX_RESULTS = 200
+
+def fts_query(q):
+    # cada palavra vira um prefixo entre aspas: "robo aut" -> "robo"* "aut"*
+    terms = re.findall(r"\w+", q or "")
+    return " ".join(f'"{t}"*' for t in terms)
+
+
+def _search_ids(fts, table, order_col, q, page, per_page, company_id=None):
+    match = fts_query(q)
+    if not match:
+        return []
+    sql = (
+        f"SELECT {table}.id FROM {fts} JOIN {table} ON {table}.id = {fts}.rowid "
+        f"WHERE {fts} MATCH :match"
+    )
+    params = {"match": match, "limit": per_page, "offset": (max(page, 1) - 1) * per_page}
+    if company_id is not None:
+        sql += f" AND {table}.company_id = :company_id"
+        params["company_id"] = company_id
+    # bm25 com peso maior para o nome/título; empate decidido pelo score
+    sql += f" ORDER BY bm25({fts}, 10.0, 1.0), {table}.{order_col} DESC LIMIT :limit OFFSET :offset"
+    return [r[0] for r in db.session.execute(db.text(sql), params)]
+
+
+def _load_in_order(model, ids):
+    if not ids:
+        return []
+    found = {obj.id: obj for obj in model.query.filter(model.id.in_(ids))}
+    return [found[i] for i in ids if i in found]
+
+
+def search_companies(q, page=1, per_page=SEARCH_PER_PAGE):
+    ids = _search_ids("company_fts", "company", "total_score", q, page, per_page)
+    return _load_in_order(Company, ids)
+
+
+def search_posts(q, company_id=None, page=1, per_page=SEARCH_PER_PAGE):
+    ids = _search_ids("post_fts", "post", "score", q, page, per_page, company_id=company_id)
+    return _load_in_order(Post, ids)
+
+
+def matching_company_ids(q, limit=SEARCH_MAX_RESULTS):
+    # empresas que batem pelo nome/bio ou por algum post
+    ids = set(_search_ids("company_fts", "company", "total_score", q, 1, limit))
+    post_ids = _search_ids("post_fts", "post", "score", q, 1, limit)
+    if post_ids:
+        ids.update(
+            cid for (cid,) in db.session.query(Post.company_id).filter(Post.id.in_(post_ids)).distinct()
+        )
+    return ids
+
+
+def companies_by_category(ids=None):
+    # todas as empresas numa query só, já ordenadas, agrupadas por categoria
+    query = Company.query.filter(Company.category_id.isnot(None))
+    if ids is not None:
+        if not ids:
+            return {}
+        query = query.filter(Company.id.in_(ids))
+    grouped = {}
+    for comp in query.order_by(Company.total_score.desc()):
+        grouped.setdefault(comp.category_id, []).append(comp)
+    return grouped
+
+
+# -----------------------------
+#   AUTOCOMPLETAR (índice de prefixos em memória)
+# -----------------------------
+# /typeahead responde das estruturas em memória de cada worker, sem SQLite:
+# vocabulário ordenado (bisect acha as palavras com o prefixo digitado) e, para
+# cada palavra, os ids em ordem de score; o top-N sai de um heapq.merge dessas
+# listas, parando no N-ésimo resultado.
+# Montado no warm-up (ou na primeira consulta); criar/renomear/apagar empresa ou
+# post vira um evento gravado no commit num log em SIGNAL_DIR, que todo worker
+# lê a partir do ponto onde parou (um os.stat por consulta). Scores mudam a
+# todo like: a ordem usa o score do último rebuild (LUX_TYPEAHEAD_REFRESH).
+TYPEAHEAD_LIMIT = 8
+TYPEAHEAD_MAX_LIMIT = 20
+# candidatos examinados no máximo quando há mais de um termo (filtro pelos outros)
+TYPEAHEAD_SCAN = 2000
+TYPEAHEAD_LOG = "typeahead.log"
+TYPEAHEAD_LOG_MAX = 1024 * 1024
+
+
+def typeahead_words(text):
+    # minúsculas e sem acento: "Inovação" e "inovacao" são a mesma palavra
+    text = unicodedata.normalize("NFKD", (text or "").casefold())
+    return re.findall(r"\w+", "".join(ch for ch in text if not unicodedata.combining(ch)))
+
+
+class PrefixIndex:
+    def __init__(self):
+        self.words = []     # vocabulário, ordenado
+        self.postings = {}  # palavra -> [ids], score decrescente
+        # id -> (texto, score, " palavras ", empresa, categoria); as palavras numa
+        # string só: "é prefixo de alguma palavra" vira um `" termo" in palavras`
+        self.items = {}
+
+    def rank(self, item_id):
+        return -self.items[item_id][1]
+
+    def entry(self, text, score, company_id, category_id):
+        words = sorted(set(typeahead_words(text)))
+        return (text, score or 0.0, " " + " ".join(words) + " ", company_id, category_id), words
+
+    def add(self, item_id, text, score, company_id=None, category_id=None):
+        if score is None and item_id in self.items:
+            # renomeado sem score carregado: mantém o do índice
+            score = self.items[item_id][1]
+        self.remove(item_id)
+        self.items[item_id], words = self.entry(text, score, company_id, category_id)
+        for word in words:
+            ids = self.postings.get(word)
+            if ids is None:
+                ids = self.postings[word] = []
+                bisect.insort(self.words, word)
+            bisect.insort(ids, item_id, key=self.rank)
+
+    def remove(self, item_id):
+        item = self.items.get(item_id)
+        if item is None:
+            return
+        for word in item[2].split():
+            ids = self.postings[word]
+            ids.remove(item_id)
+            if not ids:
+                del self.postings[word]
+                del self.words[bisect.bisect_left(self.words, word)]
+        del self.items[item_id]
+
+    def load(self, rows):
+        # carga inicial: ordena uma vez em vez de insort linha a linha
+        for item_id, text, score, company_id, category_id in rows:
+            self.items[item_id], words = self.entry(text, score, company_id, category_id)
+            for word in words:
+                self.postings.setdefault(word, []).append(item_id)
+        for ids in self.postings.values():
+            ids.sort(key=self.rank)
+        self.words = sorted(self.postings)
+
+    def prefixed(self, term):
+        lo = bisect.bisect_left(self.words, term)
+        hi = bisect.bisect_left(self.words, term + "\uffff", lo)
+        return self.words[lo:hi]
+
+    def search(self, terms, limit, exact=False, company_id=None, company_ids=None):
+        # todo termo é prefixo de alguma palavra do texto (como o FTS: "robo aut");
+        # exact=True: palavra inteira. company_ids: os posts de company_id, se poucos
+        needles = [f" {t} " if exact else f" {t}" for t in terms]
+        if company_ids is not None and len(company_ids) <= TYPEAHEAD_SCAN:
+            found = [i for i in company_ids if self.matches(i, needles)]
+            return sorted(found, key=self.rank)[:limit]
+        groups = [([t] if t in self.postings else []) if exact else self.prefixed(t) for t in terms]
+        if not all(groups):
+            return []
+        # a lista mais curta conduz; os outros termos (e a empresa) filtram
+        driver = min(groups, key=lambda words: sum(len(self.postings[w]) for w in words))
+        streams = [self.postings[w] for w in driver]
+        candidates = streams[0] if len(streams) == 1 else heapq.merge(*streams, key=self.rank)
+        found, seen = [], set()
+        for n, item_id in enumerate(candidates):
+            if n >= TYPEAHEAD_SCAN or len(found) == limit:
+                break
+            if item_id in seen:
+                continue
+            seen.add(item_id)
+            if company_id is not None and self.items[item_id][3] != company_id:
+                continue
+            if len(terms) == 1 or self.matches(item_id, needles):
+                found.append(item_id)
+        return found
+
+    def matches(self, item_id, needles):
+        words = self.items[item_id][2]
+        return all(needle in words for needle in needles)
+
+
+class Typeahead:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.companies = PrefixIndex()
+        self.posts = PrefixIndex()
+        self.company_posts = {}  # empresa -> [ids dos posts] (lista: bem menor que set)
+        self.built_at = None
+        self.log_ino = None
+        self.log_offset = 0
+        self.rebuilding = False
+
+    def reset(self):
+        # depois do fork: o índice herdado do master vale, o lock não
+        self.lock = threading.Lock()
+        self.rebuilding = False
+
+    def log_path(self):
+        return signal_path(TYPEAHEAD_LOG)
+
+    def log_stat(self):
+        try:
+            st = os.stat(self.log_path())
+        except FileNotFoundError:
+            return None, 0
+        return st.st_ino, st.st_size
+
+    def build(self):
+        # posição do log ANTES de ler o banco: o que vier depois é reaplicado
+        # (os eventos são idempotentes)
+        ino, offset = self.log_stat()
+        companies, posts = PrefixIndex(), PrefixIndex()
+        with app.app_context():
+            companies.load((cid, name, score, None, None) for cid, name, score in
+                           db.session.query(Company.id, Company.name, Company.total_score))
+            posts.load(db.session.query(Post.id, Post.title, Post.score, Post.company_id, Post.category_id))
+            db.session.remove()
+        company_posts = {}
+        for post_id, item in posts.items.items():
+            company_posts.setdefault(item[3], []).append(post_id)
+        with self.lock:
+            self.companies, self.posts, self.company_posts = companies, posts, company_posts
+            self.log_ino, self.log_offset = ino, offset
+            self.built_at = time.monotonic()
+        self.sync()
+
+    def rebuild_in_background(self):
+        with self.lock:
+            if self.rebuilding:
+                return
+            self.rebuilding = True
+
+        def run():
+            try:
+                self.build()
+            except Exception:
+                app.logger.exception("Autocompletar: rebuild do índice falhou")
+            finally:
+                self.rebuilding = False
+
+        threading.Thread(target=run, name="lux-typeahead", daemon=True).start()
+
+    def sync(self):
+        ino, size = self.log_stat()
+        if ino != self.log_ino and self.log_ino is not None:
+            # log rotacionado desde o último build: não dá para emendar
+            self.rebuild_in_background()
+            return
+        if size <= self.log_offset and ino == self.log_ino:
+            return
+        with self.lock:
+            if ino != self.log_ino:
+                # log criado depois do build: tudo nele é novo
+                self.log_ino, self.log_offset = ino, 0
+            with open(self.log_path(), "rb") as f:
+                f.seek(self.log_offset)
+                chunk = f.read(size - self.log_offset)
+            # linha pela metade (outro worker escrevendo): fica para a próxima
+            end = chunk.rfind(b"\n") + 1
+            self.log_offset += end
+            rebuild = False
+            for line in chunk[:end].splitlines():
+                rebuild = self.apply(json.loads(line)) or rebuild
+        if rebuild:
+            self.rebuild_in_background()
+
+    def apply(self, change):
+        kind, op, item_id, *rest = change
+        if kind == "all":
+            return True
+        if kind == "company" and op == "set":
+            self.companies.add(item_id, rest[0], rest[1])
+        elif kind == "company":
+            self.companies.remove(item_id)
+            for post_id in self.company_posts.pop(item_id, ()):
+                self.posts.remove(post_id)
+        elif kind == "post" and op == "set":
+            title, score, company_id, category_id = rest
+            old = self.posts.items.get(item_id)
+            if score is None and old is not None:
+                score = old[1]
+            self.drop_post(item_id)
+            self.posts.add(item_id, title, score, company_id, category_id)
+            self.company_posts.setdefault(company_id, []).append(item_id)
+        elif kind == "post":
+            self.drop_post(item_id)
+        elif kind == "category":
+            for post_id in [p for p, item in self.posts.items.items() if item[4] == item_id]:
+                self.drop_post(post_id)
+        return False
+
+    def drop_post(self, post_id):
+        item = self.posts.items.get(post_id)
+        if item is not None:
+            ids = self.company_posts.get(item[3])
+            if ids and post_id in ids:
+                ids.remove(post_id)
+            self.posts.remove(post_id)
+
+    def publish(self, changes):
+        # uma escrita só com O_APPEND: linhas de workers diferentes não se misturam
+        os.makedirs(app.config["SIGNAL_DIR"], exist_ok=True)
+        path = self.log_path()
+        data = "".join(json.dumps(c, ensure_ascii=False) + "\n" for c in changes).encode()
+        with open(path, "ab") as f:
+            f.write(data)
+            rotate = f.tell() > TYPEAHEAD_LOG_MAX
+        if rotate:
+            # log grande: recomeça vazio; cada worker percebe o inode novo e reconstrói
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}"
+            open(tmp, "wb").close()
+            os.replace(tmp, path)
+
+    def ensure_fresh(self):
+        if self.built_at is None:
+            self.build()
+            return
+        self.sync()
+        if time.monotonic() - self.built_at > app.config["TYPEAHEAD_REFRESH"]:
+            self.rebuild_in_background()
+
+    def suggest(self, q, limit=TYPEAHEAD_LIMIT):
+        self.ensure_fresh()
+        # "empresa + post": posts da melhor empresa que bate com a primeira parte
+        company_part, plus, post_part = q.partition("+")
+        with self.lock:
+            if plus:
+                # a empresa já foi digitada inteira (veio o "+"): palavras exatas
+                company_ids = self.companies.search(typeahead_words(company_part), 1, exact=True)
+                terms = typeahead_words(post_part)
+                if not company_ids:
+                    return []
+                company_id = company_ids[0]
+                company = self.companies.items[company_id][0]
+                if not terms:
+                    return [self.company_item(company_id)]
+                posts = self.posts.search(
+                    terms, limit, company_id=company_id, company_ids=self.company_posts.get(company_id, ()),
+                )
+                return [self.post_item(pid, label=f"{company} + {self.posts.items[pid][0]}") for pid in posts]
+            terms = typeahead_words(q)
+            if not terms:
+                return []
+            items = [self.company_item(cid) for cid in self.companies.search(terms, limit)]
+            items += [self.post_item(pid) for pid in self.posts.search(terms, limit - len(items))]
+            return items
+
+    def company_item(self, company_id):
+        name = self.companies.items[company_id][0]
+        return {"type": "company", "id": company_id, "label": name,
+                "url": url_for("company_detail", company_id=company_id)}
+
+    def post_item(self, post_id, label=None):
+        title, _, _, company_id, _ = self.posts.items[post_id]
+        company = self.companies.items.get(company_id)
+        return {"type": "post", "id": post_id, "label": label or title,
+                "company": company[0] if company else None,
+                "url": url_for("post_view", post_id=post_id)}
+
+
+typeahead = Typeahead()
+
+
+def typeahead_change(*change):
+    # chamado dentro da transação; publicado só no commit
+    db.session.info.setdefault("typeahead", []).append(list(change))
+
+
+def typeahead_set(obj):
+    # score só se já estiver carregado (não dispara SELECT no meio do flush)
+    loaded = db.inspect(obj).dict
+    if isinstance(obj, Company):
+        return ["company", "set", obj.id, obj.name, loaded.get("total_score")]
+    return ["post", "set", obj.id, obj.title, loaded.get("score"), obj.company_id, obj.category_id]
+
+
+@event.listens_for(Session, "after_flush")
+def collect_typeahead_changes(session, flush_context):
+    # no after_flush new/dirty/deleted e o histórico dos atributos ainda são os do flush
+    changes = session.info.setdefault("typeahead", [])
+    for obj in session.new:
+        if isinstance(obj, (Company, Post)):
+            changes.append(typeahead_set(obj))
+    for obj in session.dirty:
+        if isinstance(obj, Company) and db.inspect(obj).attrs.name.history.has_changes():
+            changes.append(typeahead_set(obj))
+        elif isinstance(obj, Post) and db.inspect(obj).attrs.title.history.has_changes():
+            changes.append(typeahead_set(obj))
+    for obj in session.deleted:
+        if isinstance(obj, (Company, Post)):
+            changes.append([type(obj).__name__.lower(), "del", obj.id])
+
+
+@event.listens_for(Session, "after_commit")
+def publish_typeahead_changes(session):
+    changes = session.info.pop("typeahead", None)
+    if not changes:
+        return
+    try:
+        typeahead.publish(changes)
+    except OSError:
+        app.logger.exception("Autocompletar: não consegui gravar o log de mudanças")
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_typeahead_changes(session):
+    session.info.pop("typeahead", None)
+
+
+# -----------------------------
+#   CONVERSAS (caixa de entrada)
+# -----------------------------
+# Cada mensagem nova atualiza, no mesmo flush, a linha do par em conversation
+# (última mensagem e não lidas de quem recebeu). Inbox e "Conversas recentes"
+# viram uma query indexada por empresa, ordenada pela mensagem mais recente.
+@event.listens_for(Session, "after_flush")
+def update_conversations(session, flush_context):
+    messages = sorted((obj for obj in session.new if isinstance(obj, Message)), key=lambda m: m.id)
+    if not messages:
+        return
+    conn = session.connection()
+    for msg in messages:
+        low, high = sorted((msg.sender_id, msg.receiver_id))
+        stmt = sqlite_insert(Conversation).values(
+            low_id=low,
+            high_id=high,
+            last_message_id=msg.id,
+            last_message_at=msg.created_at,
+            unread_low=int(msg.receiver_id == low != msg.sender_id),
+            unread_high=int(msg.receiver_id == high != msg.sender_id),
+        )
+        conn.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[Conversation.low_id, Conversation.high_id],
+                set_={
+                    "last_message_id": stmt.excluded.last_message_id,
+                    "last_message_at": stmt.excluded.last_message_at,
+                    "unread_low": Conversation.unread_low + stmt.excluded.unread_low,
+                    "unread_high": Conversation.unread_high + stmt.excluded.unread_high,
+                },
+            )
+        )
+
+
+def unread_for(conversation, company_id):
+    return conversation.unread_low if conversation.low_id == company_id else conversation.unread_high
 
-def ensure_post_score_column():
-    conn = None
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute("PRAGMA table_info(post);")
-        cols = [r[1] for r in cur.fetchall()]
-        if "score" not in cols:
-            cur.execute("ALTER TABLE post ADD COLUMN score REAL DEFAULT 0;")
-            conn.commit()
-    finally:
-        if conn:
-            conn.close()
 
-ensure_category_description_column()
-ensure_post_score_column()
+def conversation_between(company_id, other_id):
+    low, high = sorted((company_id, other_id))
+    return Conversation.query.filter_by(low_id=low, high_id=high).first()
 
-db = SQLAlchemy(app)
 
-class Category(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(120), unique=True, nullable=False)
-    description = db.Column(db.String(300))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+def mark_conversation_read(conversation, company_id):
+    # não faz commit; só escreve se havia algo não lido
+    if not conversation or not unread_for(conversation, company_id):
+        return
+    if conversation.low_id == company_id:
+        conversation.unread_low = 0
+    else:
+        conversation.unread_high = 0
 
-    # Relacionamento com Company — deixa como estava
-    companies = db.relationship("Company", backref="category", lazy=True)
 
-    # RELACIONAMENTO CORRETO COM POSTS
-    posts = db.relationship(
-        "Post",
-        backref="category",
-        cascade="all, delete-orphan",
-        passive_deletes=True
+def conversations_for(company_id, limit=None):
+    other_id = db.case((Conversation.low_id == company_id, Conversation.high_id), else_=Conversation.low_id)
+    query = (
+        db.session.query(Conversation, Company)
+        .join(Company, Company.id == other_id)
+        .options(joinedload(Conversation.last_message))
+        .filter((Conversation.low_id == company_id) | (Conversation.high_id == company_id))
+        .order_by(Conversation.last_message_at.desc(), Conversation.id.desc())
     )
+    if limit:
+        query = query.limit(limit)
+    return [
+        {"other": other, "last_msg": conv.last_message, "unread": unread_for(conv, company_id)}
+        for conv, other in query
+    ]
 
 
-class Company(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(140), nullable=False, unique=True)
-    bio = db.Column(db.Text)
-    website = db.Column(db.String(250))
-    password = db.Column(db.String(200), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    category_id = db.Column(db.Integer, db.ForeignKey("category.id"), nullable=True)
-    comments = db.relationship("Comment", backref="author", lazy=True)
-    investments_made = db.relationship("InvestmentHistory", backref="investor", lazy=True, foreign_keys='InvestmentHistory.company_id')
-    messages_sent = db.relationship("Message", backref="sender", lazy=True, foreign_keys='Message.sender_id')
-    messages_received = db.relationship("Message", backref="receiver", lazy=True, foreign_keys='Message.receiver_id')
+# -----------------------------
+#   CHAT EM TEMPO REAL (SSE)
+# -----------------------------
+# A página do chat abre um EventSource em /chat/<id>/stream e recebe só as
+# mensagens com id maior que a última que já tem (Last-Event-ID na reconexão).
+# O stream não fica consultando o banco: espera um "sinal" de mensagem nova.
+# Entre workers do gunicorn o sinal é um arquivo por conversa, trocado a cada
+# commit com Message (os.replace => inode novo); quem espera só faz stat() nele.
+# Dentro do mesmo processo, uma Condition acorda os streams na hora.
+SSE_BATCH = 200
+new_message_signal = threading.Condition()
 
-class Post(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    title = db.Column(db.String(200), nullable=False)
-    content = db.Column(db.Text)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    likes = db.Column(db.Integer, default=0)
-    investment = db.Column(db.Integer, default=0)
-    score = db.Column(db.Float, default=0)
 
-    company_id = db.Column(db.Integer, db.ForeignKey("company.id"), nullable=False)
+class StreamSlots:
+    # limite de streams por worker: sem ele, N abas de chat abertas ocupam todas
+    # as threads do gthread e o resto do site para de responder
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
 
-    # CASCADE REAL AQUI
-    category_id = db.Column(
-        db.Integer,
-        db.ForeignKey("category.id", ondelete="CASCADE"),
-        nullable=False
-    )
+    def acquire(self):
+        with self.lock:
+            if self.active >= app.config["SSE_MAX_STREAMS"]:
+                return False
+            self.active += 1
+            return True
 
-    comments = db.relationship(
-        "Comment",
-        backref="post",
-        lazy=True,
-        cascade="all, delete-orphan"
-    )
+    def release(self):
+        with self.lock:
+            self.active = max(0, self.active - 1)
 
-    investment_history = db.relationship(
-        "InvestmentHistory",
-        backref="post",
-        lazy=True,
-        cascade="all, delete-orphan"
-    )
+    def reset(self):
+        with self.lock:
+            self.active = 0
 
-    company = db.relationship("Company", backref="posts")
 
+stream_slots = StreamSlots()
 
-class Comment(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    content = db.Column(db.String(500), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    company_id = db.Column(db.Integer, db.ForeignKey("company.id"), nullable=False)
-    post_id = db.Column(db.Integer, db.ForeignKey("post.id"), nullable=False)
 
-class PostLike(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    post_id = db.Column(db.Integer, db.ForeignKey("post.id"), nullable=False)
-    company_id = db.Column(db.Integer, db.ForeignKey("company.id"), nullable=False)
+def conversation_key(a, b):
+    low, high = sorted((a, b))
+    return f"chat-{low}-{high}"
 
-class InvestmentHistory(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    company_id = db.Column(db.Integer, db.ForeignKey("company.id"), nullable=False)
-    post_id = db.Column(db.Integer, db.ForeignKey("post.id"), nullable=False)
-    amount = db.Column(db.Integer, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-class Message(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    sender_id = db.Column(db.Integer, db.ForeignKey("company.id"), nullable=False)
-    receiver_id = db.Column(db.Integer, db.ForeignKey("company.id"), nullable=False)
-    content = db.Column(db.Text, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+def signal_path(key):
+    return os.path.join(app.config["SIGNAL_DIR"], key)
 
-def fix_companies_missing_category():
+
+def ring_signal(key):
+    os.makedirs(app.config["SIGNAL_DIR"], exist_ok=True)
+    path = signal_path(key)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}"
+    with open(tmp, "w") as f:
+        f.write(datetime.utcnow().isoformat())
+    os.replace(tmp, path)
+    with new_message_signal:
+        new_message_signal.notify_all()
+
+
+def signal_stamp(key):
     try:
-        companies = Company.query.filter((Company.category_id == None)).all()
-    except:
-        return
-    updates = 0
-    for comp in companies:
-        posts = Post.query.filter_by(company_id=comp.id).all()
-        if not posts:
-            continue
-        cat_ids = [p.category_id for p in posts if p.category_id]
-        if not cat_ids:
-            continue
-        most_common = Counter(cat_ids).most_common(1)
-        if most_common:
-            comp.category_id = most_common[0][0]
-            updates += 1
-    if updates > 0:
-        db.session.commit()
+        st = os.stat(signal_path(key))
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns
 
-def calculate_post_score(post):
-    base = (post.likes or 0) * 2 + (post.investment or 0) * 3
-    content_factor = min(len(post.content or "") / 100, 10)
-    comment_factor = min(len(post.comments), 10)
-    post.score = base + content_factor + comment_factor
-    db.session.commit()
-    return post.score
 
+def wait_for_signal(key, stamp, timeout):
+    # devolve o carimbo novo assim que o arquivo muda, ou o atual no timeout
+    deadline = time.monotonic() + timeout
+    while True:
+        current = signal_stamp(key)
+        remaining = deadline - time.monotonic()
+        if current != stamp or remaining <= 0:
+            return current
+        with new_message_signal:
+            new_message_signal.wait(min(remaining, app.config["SSE_SIGNAL_POLL"]))
 
-def update_all_scores():
-    for p in Post.query.all():
-        calculate_post_score(p)
-
-def get_sorted_companies(category, q=None):
-    companies = category.companies
-    companies_with_score = []
-    for c in companies:
-        total_score = sum((p.score or 0) for p in c.posts)
-        c.total_score = total_score
-        companies_with_score.append(c)
-    companies_with_score.sort(key=lambda x: x.total_score, reverse=True)
-    if q:
-        ql = q.lower()
-        return [c for c in companies_with_score if ql in c.name.lower() or any(ql in p.title.lower() for p in c.posts)]
-    return companies_with_score
+
+@event.listens_for(Session, "before_flush")
+def collect_chat_signals(session, flush_context, instances):
+    for obj in session.new:
+        if isinstance(obj, Message):
+            session.info.setdefault("chat_signals", set()).add(conversation_key(obj.sender_id, obj.receiver_id))
+
+
+@event.listens_for(Session, "after_commit")
+def ring_chat_signals(session):
+    for key in session.info.pop("chat_signals", ()):
+        ring_signal(key)
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_chat_signals(session):
+    session.info.pop("chat_signals", None)
+
+
+def messages_after(company_id, other_id, last_id, limit=SSE_BATCH):
+    return (
+        Message.query.filter(
+            ((Message.sender_id == company_id) & (Message.receiver_id == other_id)) |
+            ((Message.sender_id == other_id) & (Message.receiver_id == company_id)),
+            Message.id > last_id,
+        )
+        .order_by(Message.id)
+        .limit(limit)
+        .all()
+    )
+
+
+def message_data(msg):
+    return {
+        "id": msg.id,
+        "sender_id": msg.sender_id,
+        "content": msg.content,
+        "created_at": msg.created_at.strftime("%d/%m/%Y %H:%M"),
+    }
+
+
+def message_event(msg):
+    return f"id: {msg.id}\nevent: message\ndata: {json.dumps(message_data(msg), ensure_ascii=False)}\n\n"
+
+
+def deliver_messages(company_id, other_id, last_id, render):
+    # saída montada antes do commit: o commit expira as linhas (e o remove() do
+    # stream as desanexa), então msg.id depois dele daria DetachedInstanceError
+    rows = messages_after(company_id, other_id, last_id)
+    out = [render(msg) for msg in rows]
+    if rows:
+        last_id = rows[-1].id
+    if any(msg.receiver_id == company_id for msg in rows):
+        mark_conversation_read(conversation_between(company_id, other_id), company_id)
+        db.session.commit()
+    return last_id, out
 
 
 @app.route("/")
+@cached_page("categories", "companies", arg_tags={"q": ("posts",)})
 def home():
     cats = Category.query.order_by(Category.name).all()
     q = request.args.get("q", "").strip()
+    by_category = companies_by_category(matching_company_ids(q) if q else None)
     for c in cats:
-        c.companies_sorted = get_sorted_companies(c, q if q else None)
+        c.companies_sorted = by_category.get(c.id, [])
     return render_template("home.html", categories=cats, q=q)
-def calculate_post_score(post):
-    base = (post.likes or 0) * 2 + (post.investment or 0) * 3
-    content_factor = min(len(post.content or "") / 100, 10)
-    comment_factor = min(len(post.comments), 10)
-    post.score = base + content_factor + comment_factor
-    db.session.commit()
-    return post.score
 
 @app.route("/categories")
+@conditional_page(ranking_version)
+@cached_page("categories", "companies", "posts")
 def categories():
     q = request.args.get("q", "").strip()
-    cats = Category.query.all()
+    cats = load_categories_with_posts()
+    trending = trending_by_category()
+    for c in cats:
+        c.trending_posts = trending.get(c.id, [])
 
     # Lógica do Top IA
     top_category = Category.query.filter_by(name="Top melhores empresas por ia").first()
     if top_category:
-        all_companies = Company.query.all()
-        companies_with_score = []
-
-        for comp in all_companies:
-            total = sum((p.score or 0) for p in comp.posts)
-            if total >= 1:  # só empresas com pelo menos 1 ponto
-                comp.total_score = total  # atributo temporário
-                companies_with_score.append(comp)
-
-        # ordena e limita a 100
-        top_category.companies_sorted = sorted(companies_with_score, key=lambda x: x.total_score, reverse=True)[:100]
+        # só empresas com pelo menos 1 ponto, ordena e limita a 100
+        top_category.companies_sorted = (
+            Company.query.filter(Company.total_score >= 1)
+            .order_by(Company.total_score.desc())
+            .limit(100)
+            .all()
+        )
 
     # Busca
     if q:
         parts = q.split(maxsplit=1)
         if len(parts) == 2:
             company_name, post_title = parts
-            company = Company.query.filter(Company.name.ilike(f"%{company_name}%")).first()
-            if company:
-                post = Post.query.filter(
-                    Post.company_id == company.id,
-                    Post.title.ilike(f"%{post_title}%")
-                ).first()
-                if post:
-                    return redirect(url_for("post_detail", post_id=post.id))
+            companies = search_companies(company_name, per_page=1)
+            if companies:
+                posts = search_posts(post_title, company_id=companies[0].id, per_page=1)
+                if posts:
+                    return redirect(url_for("post_detail", post_id=posts[0].id))
 
         # busca parcial se não achar combinação exata
-        q_lower = q.lower()
+        by_category = companies_by_category(matching_company_ids(q))
         filtered_cats = []
         for c in cats:
-            companies_matching = []
-            for comp in c.companies:
-                if q_lower in comp.name.lower():
-                    companies_matching.append(comp)
-                else:
-                    matching_posts = [p for p in comp.posts if q_lower in (p.title or "").lower()]
-                    if matching_posts:
-                        companies_matching.append(comp)
-            if companies_matching:
-                c.companies_sorted = companies_matching
+            if c.id in by_category:
+                c.companies_sorted = by_category[c.id]
                 filtered_cats.append(c)
         cats = filtered_cats
     else:
-        # ordena normalmente as outras categorias
+        # ordena normalmente as outras categorias (uma query só, já ordenada)
+        by_category = companies_by_category()
         for c in cats:
             if getattr(c, "companies_sorted", None):
                 continue  # Top IA já calculada
-            companies_with_score = []
-            for comp in c.companies:
-                total = sum((p.score or 0) for p in comp.posts)
-                comp.total_score = total
-                companies_with_score.append(comp)
-            c.companies_sorted = sorted(companies_with_score, key=lambda x: x.total_score, reverse=True)
+            c.companies_sorted = by_category.get(c.id, [])
 
     return render_template("categories.html", categories=cats, q=q)
 
 @app.route("/posts/<int:post_id>")
+@conditional_page(post_version)
 def post_detail(post_id):
-    post = Post.query.get_or_404(post_id)
+    post = load_post(post_id)
     return render_template("post_view.html", post=post)
 
 # rota da empresa se precisar
 @app.route("/companies/<int:company_id>")
+@conditional_page(company_version)
 def company_detail(company_id):
     company = Company.query.get_or_404(company_id)
     return render_template("company_detail.html", company=company)
@@ -279,20 +3650,29 @@ def company_detail(company_id):
 @app.route("/categories/<int:category_id>")
 def view_category(category_id):
     cat = Category.query.get_or_404(category_id)
-    posts = Post.query.filter_by(category_id=category_id).order_by(Post.created_at.desc()).all()
-    return render_template("category.html", category=cat, posts=posts)
+    page = keyset_paginate(
+        posts_with_company(Post.query.filter_by(category_id=category_id)),
+        Post.created_at, Post.id,
+        cursor=request.args.get("cursor"),
+    )
+    return render_template("category.html", category=cat, posts=page.items, pager=page)
 
 @app.route("/categories/<int:category_id>/companies")
+@conditional_page(ranking_version)
+@cached_page("categories", "posts", "companies")
 def category_companies(category_id):
     category = Category.query.get_or_404(category_id)
 
-    posts = db.session.query(Post).join(Company).filter(Post.category_id == category_id).all()
+    posts = (
+        db.session.query(Post)
+        .join(Post.company)
+        .options(contains_eager(Post.company))
+        .filter(Post.category_id == category_id)
+        .all()
+    )
 
     companies_map = {}
     for p in posts:
-        if p.score is None or p.score == 0:
-            calculate_post_score(p)
-
         comp = p.company
         if not comp:
             continue
@@ -343,23 +3723,34 @@ def edit_post(post_id):
     return render_template("edit_post.html", post=post)
 
 @app.route("/company/<int:company_id>/website")
+@conditional_page(company_version)
 def company_website(company_id):
     company = Company.query.get_or_404(company_id)
-    posts = Post.query.filter_by(company_id=company.id).order_by(Post.created_at.desc()).all()
-    return render_template("company_website.html", company=company, posts=posts)
+    page = keyset_paginate(
+        Post.query.filter_by(company_id=company.id),
+        Post.created_at, Post.id,
+        cursor=request.args.get("cursor"),
+    )
+    return render_template("company_website.html", company=company, posts=page.items, pager=page)
 
 
 
 @app.route("/history")
 def history_global():
-    investments = InvestmentHistory.query.order_by(InvestmentHistory.created_at.desc()).limit(200).all()
-    return render_template("history.html", investments=investments)
+    page = keyset_paginate(
+        investments_with_relations(InvestmentHistory.query),
+        InvestmentHistory.created_at, InvestmentHistory.id,
+        cursor=request.args.get("cursor"),
+    )
+    return render_template("history.html", investments=page.items, pager=page)
 
 @app.route("/top_posts")
+@conditional_page(ranking_version)
+@cached_page("posts", "companies")
 def top_posts():
-    update_all_scores()
-    posts = Post.query.order_by(Post.score.desc()).limit(50).all()
-    return render_template("top_posts.html", posts=posts)
+    mode = ranking_mode()
+    posts = load_top_posts(50, mode)
+    return render_template("top_posts.html", posts=posts, mode=mode)
 
 @app.route("/login", methods=["GET", "POST"])
 def login():
@@ -381,6 +3772,9 @@ def logout():
     
     
 
+RECENT_CHATS = 5
+
+
 @app.route("/my_account", methods=["GET", "POST"])
 def my_account():
     if "company_id" not in session:
@@ -398,38 +3792,26 @@ def my_account():
             return redirect(url_for("chat", other_id=other_company.id))
         return "Empresa não encontrada", 404
 
-    investments_received = (
-        db.session.query(InvestmentHistory)
-        .join(Post, InvestmentHistory.post_id == Post.id)
-        .filter(Post.company_id == company.id)
-        .order_by(InvestmentHistory.created_at.desc())
-        .all()
+    received_page = keyset_paginate(
+        investments_received_by(company.id),
+        InvestmentHistory.created_at, InvestmentHistory.id,
+        cursor=request.args.get("received_cursor"),
     )
 
-    investments_made = (
-        InvestmentHistory.query
-        .filter_by(company_id=company.id)
-        .order_by(InvestmentHistory.created_at.desc())
-        .all()
+    made_page = keyset_paginate(
+        investments_with_relations(InvestmentHistory.query).filter_by(company_id=company.id),
+        InvestmentHistory.created_at, InvestmentHistory.id,
+        cursor=request.args.get("made_cursor"),
     )
 
-    contacts = set()
-    msgs = Message.query.filter(
-        (Message.sender_id == company.id) | (Message.receiver_id == company.id)
-    ).all()
-    for m in msgs:
-        if m.sender_id != company.id:
-            contacts.add(m.sender_id)
-        if m.receiver_id != company.id:
-            contacts.add(m.receiver_id)
-    contact_companies = Company.query.filter(Company.id.in_(contacts)).all() if contacts else []
-
     return render_template(
         "my_account.html",
         company=company,
-        investments_received=investments_received,
-        investments_made=investments_made,
-        contacts=contact_companies
+        investments_received=received_page.items,
+        investments_made=made_page.items,
+        received_pager=received_page,
+        made_pager=made_page,
+        recent_chats=conversations_for(company.id, limit=RECENT_CHATS),
     )
 
 @app.route("/my_investments")
@@ -437,8 +3819,62 @@ def my_investments():
     if "company_id" not in session:
         return redirect("/login")
     company = Company.query.get(session["company_id"])
-    investments = InvestmentHistory.query.filter_by(company_id=company.id).order_by(InvestmentHistory.created_at.desc()).all()
-    return render_template("my_investments.html", investments=investments)
+    page = keyset_paginate(
+        investments_with_relations(InvestmentHistory.query).filter_by(company_id=company.id),
+        InvestmentHistory.created_at, InvestmentHistory.id,
+        cursor=request.args.get("cursor"),
+    )
+    return render_template("my_investments.html", investments=page.items, pager=page)
+
+
+def investments_received_by(company_id):
+    return (
+        investments_with_relations(InvestmentHistory.query)
+        .join(Post, InvestmentHistory.post_id == Post.id)
+        .filter(Post.company_id == company_id)
+    )
+
+
+@app.route("/companies/<int:company_id>/history")
+def company_history(company_id):
+    company = Company.query.get_or_404(company_id)
+    page = keyset_paginate(
+        investments_received_by(company.id),
+        InvestmentHistory.created_at, InvestmentHistory.id,
+        cursor=request.args.get("cursor"),
+    )
+    return render_template("company_history.html", company=company, investments=page.items, pager=page)
+
+
+@app.route("/analytics")
+@cached_page("posts", "companies")
+def analytics():
+    days = rollup_days("day", request.args.get("days", type=int))
+    return render_template(
+        "analytics.html",
+        title="Investimentos na plataforma",
+        days=days,
+        series=[("Investido por dia", investment_series("all", 0, days=days))],
+        investors=top_investors(days),
+    )
+
+
+@app.route("/companies/<int:company_id>/analytics")
+@cached_page("posts", "companies")
+def company_analytics(company_id):
+    company = Company.query.get_or_404(company_id)
+    days = rollup_days("day", request.args.get("days", type=int))
+    return render_template(
+        "analytics.html",
+        title=f"Investimentos de {company.name}",
+        company=company,
+        days=days,
+        series=[
+            ("Recebido pelos posts, por dia", investment_series("company", company.id, days=days)),
+            ("Investido pela empresa, por dia", investment_series("investor", company.id, days=days)),
+        ],
+        investors=None,
+    )
 
 
 @app.route("/messages")
@@ -446,14 +3882,7 @@ def inbox():
     if "company_id" not in session:
         return redirect("/login")
     me = session["company_id"]
-
-    ids = db.session.query(Message.sender_id).filter(Message.receiver_id == me).distinct().all()
-    ids2 = db.session.query(Message.receiver_id).filter(Message.sender_id == me).distinct().all()
-
-    flat = set([i[0] for i in ids] + [i[0] for i in ids2])
-    contacts = Company.query.filter(Company.id.in_(flat)).all() if flat else []
-
-    return render_template("inbox.html", contacts=contacts)
+    return render_template("inbox.html", conversations=conversations_for(me))
 
 
 @app.route("/chat/<int:other_id>", methods=["GET", "POST"])
@@ -472,12 +3901,73 @@ def chat(other_id):
             db.session.commit()
         return redirect(url_for("chat", other_id=other_id))
 
-    messages = Message.query.filter(
-        ((Message.sender_id == company.id) & (Message.receiver_id == other_id)) |
-        ((Message.sender_id == other_id) & (Message.receiver_id == company.id))
-    ).order_by(Message.created_at).all()
+    # página mais recente primeiro; "próxima" = mensagens mais antigas
+    page = keyset_paginate(
+        Message.query.filter(
+            ((Message.sender_id == company.id) & (Message.receiver_id == other_id)) |
+            ((Message.sender_id == other_id) & (Message.receiver_id == company.id))
+        ),
+        Message.created_at, Message.id,
+        cursor=request.args.get("cursor"),
+    )
+    messages = list(reversed(page.items))
+    # só a página mais recente recebe mensagens novas ao vivo (e zera as não lidas)
+    live = not request.args.get("cursor")
+    if live:
+        mark_conversation_read(conversation_between(company.id, other_id), company.id)
+        db.session.commit()
+    last_id = messages[-1].id if messages else 0
+
+    return render_template(
+        "messages.html", other=other_company, messages=messages, pager=page, current_user=company,
+        live=live, last_id=last_id,
+    )
+
 
-    return render_template("messages.html", other=other_company, messages=messages, current_user=company)
+@app.route("/chat/<int:other_id>/stream")
+def chat_stream(other_id):
+    if "company_id" not in session:
+        return "Faça login", 401
+    company_id = session["company_id"]
+    Company.query.get_or_404(other_id)
+    last_id = request.headers.get("Last-Event-ID", type=int) or request.args.get("after", 0, type=int)
+    if request.args.get("poll"):
+        # fallback sem conexão longa (worker sem vaga para stream)
+        last_id, messages = deliver_messages(company_id, other_id, last_id, message_data)
+        return api_json({"messages": messages, "last_id": last_id, "poll": app.config["SSE_POLL_FALLBACK"]})
+    if not stream_slots.acquire():
+        # 204 faz o EventSource desistir de reconectar; a página passa a consultar ?poll=1
+        response = app.response_class(status=204)
+        response.headers["X-Poll-Interval"] = str(app.config["SSE_POLL_FALLBACK"])
+        return response
+    key = conversation_key(company_id, other_id)
+    # conexão longa: fora das métricas de request lento e do amostrador de pilhas
+    g.long_lived = True
+    inflight_requests.pop(threading.get_ident(), None)
+
+    def events():
+        nonlocal last_id
+        yield "retry: 3000\n\n"
+        started = time.monotonic()
+        while time.monotonic() - started < app.config["SSE_MAX_SECONDS"]:
+            # carimbo antes da consulta: um commit no meio não se perde
+            stamp = signal_stamp(key)
+            last_id, batch = deliver_messages(company_id, other_id, last_id, message_event)
+            # devolve a conexão ao pool enquanto espera
+            db.session.remove()
+            yield from batch
+            if len(batch) == SSE_BATCH:
+                continue
+            if wait_for_signal(key, stamp, app.config["SSE_HEARTBEAT"]) == stamp:
+                yield ": ping\n\n"
+
+    response = app.response_class(stream_with_context(events()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    # libera a vaga quando o servidor fecha a resposta (fim, erro ou cliente saiu),
+    # mesmo que o gerador nunca tenha começado
+    response.call_on_close(stream_slots.release)
+    return response
 
 
 @app.route("/edit_account", methods=["GET", "POST"])
@@ -505,18 +3995,19 @@ def edit_account():
 
     return render_template("edit_account.html", company=company)
 @app.route("/category_rank/<int:category_id>")
+@conditional_page(ranking_version)
+@cached_page("categories", "posts", "companies")
 def category_rank(category_id):
     category = Category.query.get_or_404(category_id)
 
-    posts = Post.query.filter_by(category_id=category.id).all()
-
-    # recalcula se precisar
-    for p in posts:
-        calculate_post_score(p)
-
-    posts_sorted = sorted(posts, key=lambda p: (p.score or 0), reverse=True)
+    mode = ranking_mode()
+    page = keyset_paginate(
+        posts_with_company(Post.query.filter_by(category_id=category.id)),
+        RANKING_MODES[mode], Post.id,
+        cursor=request.args.get("cursor"),
+    )
 
-    return render_template("category_rank.html", category=category, posts=posts_sorted)
+    return render_template("category_rank.html", category=category, posts=page.items, pager=page, mode=mode)
 
 
 
@@ -533,8 +4024,8 @@ def edit_post(post_id):
     if request.method == "POST":
         post.title = request.form.get("title").strip()
         post.content = request.form.get("content").strip()
-        db.session.commit()
         calculate_post_score(post)
+        db.session.commit()
         return redirect(f"/post/{post.id}")
 
     return render_template("edit_post.html", post=post)
@@ -574,17 +4065,18 @@ def new_post(category_id):
             investment=int(invest)
         )
         db.session.add(post)
-        db.session.commit()
-
+        db.session.flush()
         calculate_post_score(post)
+        db.session.commit()
         return redirect(url_for("post_view", post_id=post.id))
 
     return render_template("new_post.html", category=category, categories=categories)
 
 
 @app.route("/post/<int:post_id>", methods=["GET", "POST"])
+@conditional_page(post_version)
 def post_view(post_id):
-    post = Post.query.get_or_404(post_id)
+    post = load_post(post_id) if request.method == "GET" else Post.query.get_or_404(post_id)
 
     if request.method == "POST":
         # Comentário
@@ -596,8 +4088,9 @@ def post_view(post_id):
             if text:
                 c = Comment(content=text, company_id=session["company_id"], post_id=post.id)
                 db.session.add(c)
-                db.session.commit()
                 calculate_post_score(post)
+                bump_trending(post, 1)
+                db.session.commit()
 
             return redirect(url_for("post_view", post_id=post.id))
 
@@ -606,18 +4099,11 @@ def post_view(post_id):
             if "company_id" not in session:
                 return redirect("/login")
 
-            company_id = session["company_id"]
-            liked = PostLike.query.filter_by(post_id=post.id, company_id=company_id).first()
-            if not liked:
-                like = PostLike(post_id=post.id, company_id=company_id)
-                db.session.add(like)
-                db.session.commit()  # Commit primeiro para salvar o like
-
-                # Atualiza o post.likes contando direto do banco
-                post.likes = PostLike.query.filter_by(post_id=post.id).count()
-                calculate_post_score(post)
-                db.session.commit()
-
+            if app.config["WRITE_BEHIND"]:
+                if not queue_write("like", post, session["company_id"]):
+                    return write_behind_busy()
+            else:
+                add_like(post, session["company_id"])
             return redirect(url_for("post_view", post_id=post.id))
 
         # Investimento
@@ -626,23 +4112,23 @@ def post_view(post_id):
                 return redirect("/login")
 
             amount = int(request.form.get("invest", 0))
-            if amount > 0:
-                inv = InvestmentHistory(company_id=session["company_id"], post_id=post.id, amount=amount)
-                db.session.add(inv)
-                db.session.commit()  # Commit primeiro para salvar o investimento
-
-                # Atualiza o post.investment contando direto do banco
-                post.investment = db.session.query(db.func.sum(InvestmentHistory.amount)).filter_by(post_id=post.id).scalar() or 0
-                calculate_post_score(post)
-                db.session.commit()
+            if amount > 0 and app.config["WRITE_BEHIND"]:
+                if not queue_write("invest", post, session["company_id"], amount):
+                    return write_behind_busy()
+            elif amount > 0:
+                add_investment(post, session["company_id"], amount)
 
             return redirect(url_for("post_view", post_id=post.id))
 
-    # Atualiza likes e investment antes de renderizar
-    likes_count = PostLike.query.filter_by(post_id=post.id).count()
-    investment_total = db.session.query(db.func.sum(InvestmentHistory.amount)).filter_by(post_id=post.id).scalar() or 0
-
-    return render_template("post_view.html", post=post, likes_count=likes_count, investment_total=investment_total)
+    # contadores mantidos no próprio post (ver bump_post_counters), mais o que
+    # esta empresa fez e o write-behind ainda não gravou
+    pending_likes, pending_investment = pending_overlay(post)
+    return render_template(
+        "post_view.html",
+        post=post,
+        likes_count=(post.likes or 0) + pending_likes,
+        investment_total=(post.investment or 0) + pending_investment,
+    )
 
 
 @app.route("/post/<int:post_id>/delete", methods=["POST"])
@@ -659,7 +4145,11 @@ def delete_post(post_id):
     if logged_company.name.lower() != "lux" and logged_company.id != post.company_id:
         return "Você não pode apagar esse post", 403
 
+    company_id = post.company_id
+    unroll_investments("i.post_id = ?", (post.id,))
     db.session.delete(post)
+    db.session.flush()
+    update_company_scores(company_id)
     db.session.commit()
     return redirect("/")
 
@@ -676,9 +4166,11 @@ def delete_comment(comment_id):
     if logged_company.name.lower() != "lux" and logged_company.id != comment.company_id:
         return "Você não pode apagar esse comentário", 403
 
+    post = comment.post
     db.session.delete(comment)
+    calculate_post_score(post)
     db.session.commit()
-    return redirect(url_for("post_view", post_id=comment.post_id))
+    return redirect(url_for("post_view", post_id=post.id))
 
 @app.route("/categories/<int:category_id>/delete", methods=["POST"])
 def delete_category(category_id):
@@ -686,7 +4178,7 @@ def delete_category(category_id):
         return "Você não pode apagar categorias", 403
 
     category = Category.query.get_or_404(category_id)
-    db.session.delete(category)
+    delete_category_cascade(category.id)
     db.session.commit()
     return redirect("/categories")
 
@@ -757,26 +4249,33 @@ def search_combined():
     if not company_name or not post_name:
         return "Formato correto: empresa + título do post", 400
 
-    # Busca empresa
-    comp = Company.query.filter(Company.name.ilike(f"%{company_name}%")).first()
-    if not comp:
+    page = request.args.get("page", 1, type=int)
+
+    # Busca empresa (a melhor no ranking da busca)
+    companies = search_companies(company_name, per_page=1)
+    if not companies:
         return "Empresa não encontrada", 404
+    comp = companies[0]
 
     # Busca posts da empresa
-    posts = Post.query.filter(
-        Post.company_id == comp.id,
-        Post.title.ilike(f"%{post_name}%")
-    ).all()
+    posts = search_posts(post_name, company_id=comp.id, page=page)
 
-    if not posts:
+    if not posts and page == 1:
         return "Nenhum post encontrado para essa empresa com esse título", 404
 
     # Se só tiver 1 post, redireciona direto
-    if len(posts) == 1:
+    if len(posts) == 1 and page == 1:
         return redirect(url_for("post_view", post_id=posts[0].id))
 
     # Se tiver mais de 1, mostrar uma página com todos os posts encontrados
-    return render_template("search_combined_results.html", company=comp, posts=posts)
+    return render_template(
+        "search_combined_results.html",
+        company=comp,
+        posts=posts,
+        q=q,
+        page=page,
+        has_next=len(posts) == SEARCH_PER_PAGE,
+    )
 @app.route("/search_company")
 def search_company():
     # Pega o valor do input
@@ -785,15 +4284,36 @@ def search_company():
     if not q:
         return "Digite o nome da empresa", 400
 
-    # Busca empresa pelo nome (case-insensitive)
-    company = Company.query.filter(Company.name.ilike(f"%{q}%")).first()
+    page = request.args.get("page", 1, type=int)
 
-    if not company:
+    # Busca empresa pelo nome/bio, já ordenada por relevância
+    results = search_companies(q, page=page)
+
+    if not results and page == 1:
         return "Empresa não encontrada", 404
 
-    # Redireciona para a página da empresa
-    return redirect(url_for("company_detail", company_id=company.id))
-    
+    # Um resultado só: redireciona para a página da empresa
+    if len(results) == 1 and page == 1:
+        return redirect(url_for("company_detail", company_id=results[0].id))
+
+    return render_template(
+        "search_company.html",
+        results=results,
+        q=q,
+        page=page,
+        has_next=len(results) == SEARCH_PER_PAGE,
+    )
+
+
+@app.route("/typeahead")
+def typeahead_suggestions():
+    # sugestões enquanto digita (categories.html): só memória, nenhuma query
+    q = request.args.get("q", "").strip()
+    limit = max(1, min(request.args.get("limit", TYPEAHEAD_LIMIT, type=int), TYPEAHEAD_MAX_LIMIT))
+    response = api_json({"q": q, "items": typeahead.suggest(q, limit)})
+    response.headers["Cache-Control"] = "public, max-age=30"
+    return response
+
 
 
 # ---------------------------------------------------
@@ -813,34 +4333,362 @@ def delete_account(company_id):
     if logged_user != empresa.name and logged_user != "Lux":
         return "Você não tem permissão para excluir esta conta.", 403
 
-    try:
-        # Deletar todos os investimentos feitos pela empresa
-        InvestmentHistory.query.filter_by(company_id=empresa.id).delete()
+    # a remoção (posts, investimentos, mensagens) roda no worker (`flask run-worker`):
+    # a resposta diz que foi agendada, não que já aconteceu
+    queued = enqueue("delete_company", key=f"delete_company:{empresa.id}:{empresa.name}",
+                     company_id=empresa.id, name=empresa.name)
+    db.session.commit()
 
-        # Deletar todos os posts e seus investimentos
-        posts = Post.query.filter_by(company_id=empresa.id).all()
-        for post in posts:
-            InvestmentHistory.query.filter_by(post_id=post.id).delete()
-            db.session.delete(post)
+    # Se a própria empresa deletou a si mesma → deslogar
+    if logged_user == empresa.name:
+        session.clear()
 
-        # Deletar mensagens enviadas ou recebidas
-        Message.query.filter(
-            (Message.sender_id == empresa.id) | (Message.receiver_id == empresa.id)
-        ).delete(synchronize_session=False)
+    status = "agendada" if queued else "já estava agendada"
+    return (
+        f"Exclusão da conta {escape(empresa.name)} {status}: a empresa e os dados dela "
+        f"(posts, investimentos, mensagens) serão removidos em instantes. "
+        f'<a href="{url_for("home")}">Voltar ao início</a>',
+        202,
+    )
 
-        # Remover a empresa
-        db.session.delete(empresa)
-        db.session.commit()
 
-        # Se a própria empresa deletou a si mesma → deslogar
-        if logged_user == empresa.name:
-            session.clear()
+# -----------------------------
+#   API JSON (somente leitura) — /api/v1
+# -----------------------------
+# Respostas compactas, ?fields=a,b para escolher campos, paginação por cursor
+# (?cursor=&limit=) e, com ?format=ndjson (ou Accept: application/x-ndjson),
+# a coleção inteira sai em streaming, uma linha por registro, sem montar lista.
+API_MAX_LIMIT = 200
+API_STREAM_BATCH = 500
+
 
-        return redirect(url_for("home"))
+def api_json(payload, status=200):
+    body = json.dumps(payload, separators=(",", ":"), ensure_ascii=False, default=api_default)
+    return app.response_class(body, status=status, mimetype="application/json")
 
-    except Exception as e:
-        db.session.rollback()
-        return f"Erro ao excluir a conta: {str(e)}"
+
+def api_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"não serializável: {type(value).__name__}")
+
+
+def api_error(message, status):
+    return api_json({"error": message}, status)
+
+
+def requested_fields():
+    raw = request.args.get("fields", "")
+    return [f for f in (x.strip() for x in raw.split(",")) if f] or None
+
+
+def pick(data, fields):
+    if not fields:
+        return data
+    return {k: data[k] for k in fields if k in data}
+
+
+def wants_ndjson():
+    if request.args.get("format") == "ndjson":
+        return True
+    return request.accept_mimetypes.best == "application/x-ndjson"
+
+
+def serialize_category(c):
+    return {"id": c.id, "name": c.name, "description": c.description, "created_at": c.created_at}
+
+
+def serialize_company(c):
+    return {
+        "id": c.id,
+        "name": c.name,
+        "bio": c.bio,
+        "website": c.website,
+        "category_id": c.category_id,
+        "total_score": c.total_score or 0,
+        "created_at": c.created_at,
+    }
+
+
+def serialize_post(p):
+    data = {
+        "id": p.id,
+        "title": p.title,
+        "content": p.content,
+        "company_id": p.company_id,
+        "company_name": p.company.name if p.company else None,
+        "category_id": p.category_id,
+        "likes": p.likes or 0,
+        "investment": p.investment or 0,
+        "score": p.score or 0,
+        "trending": round(trending_heat(p.trending), 4),
+        "created_at": p.created_at,
+        "updated_at": p.updated_at,
+    }
+    if "comments_count" in p.__dict__:
+        data["comments_count"] = p.comments_count
+    return data
+
+
+def serialize_investment(inv):
+    return {
+        "id": inv.id,
+        "post_id": inv.post_id,
+        "company_id": inv.company_id,
+        "amount": inv.amount,
+        "created_at": inv.created_at,
+    }
+
+
+def api_collection(query, columns, serialize):
+    fields = requested_fields()
+    if wants_ndjson():
+        stmt = query.order_by(*[c.desc() for c in columns]).statement
+
+        def generate():
+            rows = db.session.execute(stmt, execution_options={"yield_per": API_STREAM_BATCH}).scalars()
+            for obj in rows:
+                yield json.dumps(pick(serialize(obj), fields), separators=(",", ":"),
+                                 ensure_ascii=False, default=api_default) + "\n"
+
+        return app.response_class(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    limit = min(max(request.args.get("limit", PAGE_SIZE, type=int), 1), API_MAX_LIMIT)
+    page = keyset_paginate(query, *columns, cursor=request.args.get("cursor"), per_page=limit)
+    return api_json({
+        "items": [pick(serialize(obj), fields) for obj in page.items],
+        "next_cursor": page.next_cursor,
+        "prev_cursor": page.prev_cursor,
+    })
+
+
+@app.route("/api/v1/categories")
+def api_categories():
+    fields = requested_fields()
+    cats = Category.query.order_by(Category.name).all()
+    return api_json({"items": [pick(serialize_category(c), fields) for c in cats]})
+
+
+@app.route("/api/v1/categories/<int:category_id>/companies")
+def api_category_companies(category_id):
+    if db.session.get(Category, category_id) is None:
+        return api_error("categoria não encontrada", 404)
+    query = Company.query.filter(Company.category_id == category_id)
+    return api_collection(query, (Company.total_score, Company.id), serialize_company)
+
+
+@app.route("/api/v1/companies/top")
+def api_top_companies():
+    return api_collection(Company.query, (Company.total_score, Company.id), serialize_company)
+
+
+@app.route("/api/v1/posts/top")
+def api_top_posts():
+    query = Post.query.options(joinedload(Post.company), undefer(Post.comments_count))
+    category_id = request.args.get("category_id", type=int)
+    if category_id is not None:
+        query = query.filter(Post.category_id == category_id)
+    return api_collection(query, (RANKING_MODES[ranking_mode()], Post.id), serialize_post)
+
+
+@app.route("/api/v1/posts/<int:post_id>")
+def api_post(post_id):
+    post = (
+        Post.query.options(joinedload(Post.company), undefer(Post.comments_count))
+        .filter(Post.id == post_id)
+        .first()
+    )
+    if post is None:
+        return api_error("post não encontrado", 404)
+    return api_json(pick(serialize_post(post), requested_fields()))
+
+
+@app.route("/api/v1/investments")
+def api_investments():
+    # filtros: post_id, company_id (quem investiu), owner_id (dono dos posts)
+    query = InvestmentHistory.query
+    post_id = request.args.get("post_id", type=int)
+    company_id = request.args.get("company_id", type=int)
+    owner_id = request.args.get("owner_id", type=int)
+    if post_id is not None:
+        query = query.filter(InvestmentHistory.post_id == post_id)
+    if company_id is not None:
+        query = query.filter(InvestmentHistory.company_id == company_id)
+    if owner_id is not None:
+        query = query.join(Post, InvestmentHistory.post_id == Post.id).filter(Post.company_id == owner_id)
+    return api_collection(query, (InvestmentHistory.created_at, InvestmentHistory.id), serialize_investment)
+
+
+@app.route("/api/v1/investments/over-time")
+def api_investments_over_time():
+    # ?scope=all|post|company|category|investor&id=&grain=day|hour&days=
+    scope = request.args.get("scope", "all")
+    grain = request.args.get("grain", "day")
+    if scope not in ROLLUP_SCOPES:
+        return api_error(f"scope inválido (use {', '.join(ROLLUP_SCOPES)})", 400)
+    if grain not in ROLLUP_GRAINS:
+        return api_error(f"grain inválido (use {', '.join(ROLLUP_GRAINS)})", 400)
+    scope_id = 0 if scope == "all" else request.args.get("id", type=int)
+    if scope_id is None:
+        return api_error("id obrigatório para este scope", 400)
+    days = rollup_days(grain, request.args.get("days", type=int))
+    return api_json({
+        "scope": scope,
+        "id": scope_id,
+        "grain": grain,
+        "days": days,
+        "points": investment_series(scope, scope_id, grain, days),
+    })
+
+
+@app.route("/api/v1/investors/top")
+def api_top_investors():
+    days = rollup_days("day", request.args.get("days", type=int))
+    limit = min(max(request.args.get("limit", 10, type=int), 1), API_MAX_LIMIT)
+    return api_json({
+        "days": days,
+        "items": [
+            {"company_id": r["company"].id, "name": r["company"].name, "total": r["total"], "count": r["count"]}
+            for r in top_investors(days, limit)
+        ],
+    })
+
+
+# -----------------------------
+#   TEMPLATES (cache de bytecode e pré-compilação)
+# -----------------------------
+# Compilar os templates é o que pesa no primeiro request de um worker novo.
+# O código compilado fica em LUX_TEMPLATE_CACHE_DIR (vazio desliga), reaproveitado
+# por todos os workers, reciclagens e reinícios (invalidado pelo mtime do fonte).
+# `flask compile-templates` compila tudo de uma vez no build/deploy e falha em erro
+# de sintaxe ou em chamada a função que não existe no Jinja (ex.: enumerate), que
+# senão só apareceria em runtime.
+TEMPLATE_CONTEXT_NAMES = {"request", "session", "g", "config", "url_for", "get_flashed_messages", "caller"}
+
+if app.config["TEMPLATE_CACHE_DIR"]:
+    os.makedirs(app.config["TEMPLATE_CACHE_DIR"], exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config["TEMPLATE_CACHE_DIR"])
+
+
+def check_template(name):
+    env = app.jinja_env
+    tree = env.parse(env.loader.get_source(env, name)[0], name)
+    # nomes chamados que não vêm de set/for/macro/import nem dos globais do app;
+    # import no topo de um template filho chega aos blocos pelo contexto
+    imported = {n if isinstance(n, str) else n[1] for node in tree.find_all(nodes.FromImport) for n in node.names}
+    imported |= {node.target for node in tree.find_all(nodes.Import)}
+    undeclared = meta.find_undeclared_variables(tree) - set(env.globals) - TEMPLATE_CONTEXT_NAMES - imported
+    called = {node.node.name for node in tree.find_all(nodes.Call) if isinstance(node.node, nodes.Name)}
+    return [f"{name}: função '{fn}' não existe no Jinja" for fn in sorted(called & undeclared)]
+
+
+def compile_templates(check=True):
+    # check=False: só carrega (warm-up do worker); a checagem fica para o build
+    errors = []
+    for name in app.jinja_env.list_templates():
+        try:
+            app.jinja_env.get_template(name)
+        except TemplateSyntaxError as e:
+            errors.append(f"{name}:{e.lineno}: {e.message}")
+            continue
+        except TemplateError as e:
+            errors.append(f"{name}: {e}")
+            continue
+        if check:
+            errors.extend(check_template(name))
+    return errors
+
+
+@app.cli.command("compile-templates")
+def compile_templates_command():
+    started = time.perf_counter()
+    errors = compile_templates()
+    for error in errors:
+        print(error)
+    if errors:
+        raise SystemExit(f"{len(errors)} erro(s) nos templates")
+    print(f"{len(app.jinja_env.list_templates())} templates compilados em {time.perf_counter() - started:.2f}s")
+
+
+# -----------------------------
+#   SERVIDOR (gunicorn: preload, fork, warm-up)
+# -----------------------------
+# Entrada de produção: `gunicorn -c gunicorn.conf.py`, que chama create_app().
+# Com preload_app o app.py é importado uma vez no master, o warm-up roda lá e
+# os workers nascem por fork já com templates compilados, mappers configurados
+# e o cache de páginas cheio. Depois do fork, after_fork() descarta o que não
+# pode ser compartilhado entre processos (conexões SQLite, locks, threads).
+# Sem preload, cada worker aquece em segundo plano. /ready só responde 200
+# quando o warm-up do processo terminou (readiness do balanceador/orquestrador).
+# só páginas leves: o que o master carrega no warm-up fica na memória de todos os
+# workers (/categories, que carrega todos os posts, inchava cada um em centenas de MB)
+WARMUP_PATHS = [
+    "/",
+    "/top_posts",
+    "/history",
+    "/analytics",
+    "/api/v1/categories",
+    "/api/v1/companies/top",
+    "/api/v1/posts/top",
+]
+warmed_up = threading.Event()
+
+
+def create_app(warm_up=True):
+    start_stack_sampler()
+    if warm_up:
+        start_warm_up()
+    return app
+
+
+def run_warm_up():
+    started = time.perf_counter()
+    with app.app_context():
+        db.Model.registry.configure()
+        # workers não fazem DDL: só avisam (a release roda `flask upgrade-db`)
+        with db.engine.connect() as conn:
+            if conn.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE name = 'bulk_load';"
+            ).first() and conn.exec_driver_sql("SELECT 1 FROM bulk_load;").first():
+                app.logger.error("Importação interrompida: índices e busca incompletos, rode `flask upgrade-db`")
+        for error in compile_templates(check=False):
+            app.logger.error("Template: %s", error)
+    typeahead.build()
+    client = app.test_client()
+    for path in WARMUP_PATHS:
+        status = client.get(path).status_code
+        if status >= 500:
+            app.logger.warning("Warm-up: %s respondeu %d", path, status)
+    warmed_up.set()
+    app.logger.info("Warm-up concluído em %.2fs", time.perf_counter() - started)
+
+
+def start_warm_up():
+    if not warmed_up.is_set():
+        threading.Thread(target=run_warm_up, name="lux-warm-up", daemon=True).start()
+
+
+def after_fork():
+    # conexões do pool do master: o filho abre as suas (close=False não fecha as do pai)
+    with app.app_context():
+        db.engine.dispose(close=False)
+    if isinstance(page_cache, SQLiteCache):
+        page_cache.local = threading.local()
+    metrics.reset()
+    slow_profiles.clear()
+    inflight_requests.clear()
+    write_buffer.reset()
+    typeahead.reset()
+    stream_slots.reset()
+    start_stack_sampler()
+
+
+@app.route("/ready")
+def ready():
+    if not warmed_up.is_set():
+        return "aquecendo", 503
+    db.session.execute(db.text("SELECT 1"))
+    return "ok"
 
 
 # -----------------------------
@@ -848,7 +4696,7 @@ def delete_account(company_id):
 # -----------------------------
 if __name__ == "__main__":
     with app.app_context():
-        db.create_all()
-        fix_companies_missing_category()
-        update_all_scores()
-    app.run(debug=True)
+        run_migrations()
+    # backfill de categorias e rebuild de scores saem do agendador do worker
+    start_worker_thread()
+    create_app().run(debug=True)
@@ -0,0 +1,526 @@
+# Benchmark do Lux: gera uma base sintética e mede as rotas principais.
+#
+#   python bench.py generate --db /tmp/lux-bench.db --scale large
+#   python bench.py run --db /tmp/lux-bench.db --mode client --output bench.json
+#   python bench.py run --db /tmp/lux-bench.db --mode gunicorn --workers 4 --concurrency 16
+#   python bench.py run --db /tmp/lux-bench.db --mode gunicorn --server-config bare --output bare.json
+#
+# O gerador é determinístico (mesma --seed = mesma base) e usa distribuições
+# enviesadas como as de verdade: poucas empresas postam muito, poucos posts
+# concentram likes, comentários e investimentos, poucas conversas concentram
+# as mensagens. O harness mede p50/p95/p99, queries por request (header
+# X-Query-Count) e vazão por rota, e grava tudo em JSON para comparar versões.
+import argparse
+import bisect
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.cookiejar import CookieJar
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+
+SCALES = {
+    "small": dict(companies=200, posts=5_000, comments=10_000, likes=50_000, investments=20_000, messages=10_000),
+    "medium": dict(companies=2_000, posts=100_000, comments=200_000, likes=1_000_000, investments=300_000, messages=100_000),
+    "large": dict(companies=10_000, posts=1_000_000, comments=2_000_000, likes=10_000_000, investments=3_000_000, messages=1_000_000),
+}
+
+CATEGORIES = [
+    ("Tecnologia", "Software, hardware e serviços digitais."),
+    ("Logística", "Empresas focadas em logística."),
+    ("Aplicativo", "Empresas focadas em desenvolver ou trabalhar com aplicativos."),
+    ("Site", "Empresas focadas em criar sites ou trabalhar utilizando eles."),
+    ("Varejo", "Lojas físicas e online."),
+    ("Alimentação", "Restaurantes, mercados e distribuidores."),
+    ("Saúde", "Clínicas, laboratórios e healthtechs."),
+    ("Educação", "Escolas, cursos e plataformas de ensino."),
+    ("Finanças", "Bancos, fintechs e consultorias."),
+    ("Energia", "Geração, distribuição e eficiência energética."),
+    ("Agro", "Produção agrícola e agritech."),
+    ("Construção", "Construtoras, materiais e engenharia."),
+]
+
+WORDS = (
+    "empresa projeto cliente mercado produto serviço equipe parceria lançamento investimento "
+    "crescimento inovação dados plataforma entrega qualidade resultado estratégia rede venda "
+    "sistema aplicativo site logística energia saúde ensino custo prazo meta contrato "
+    "tecnologia automação nuvem segurança analytics marketing operação expansão rodada"
+).split()
+
+PASSWORD = "bench"
+EPOCH = datetime(2024, 1, 1)
+
+
+# -----------------------------
+#   GERADOR DE DADOS
+# -----------------------------
+class Zipf:
+    # sorteio em 1..n com peso 1/rank^s (rank 1 = mais popular)
+    def __init__(self, rng, n, s=1.1):
+        self.rng = rng
+        self.cum = list(itertools.accumulate(1.0 / (k ** s) for k in range(1, n + 1)))
+        self.total = self.cum[-1]
+
+    def __call__(self):
+        return bisect.bisect_left(self.cum, self.rng.random() * self.total) + 1
+
+
+def sentence(rng, low, high):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+
+
+def moment(rng, after=EPOCH, days=700):
+    return after + timedelta(seconds=rng.randrange(days * 86400))
+
+
+def generate_records(counts, seed):
+    # devolve (tipo, registro) na ordem das FKs, no formato do import-data
+    rng = random.Random(seed)
+    n_companies, n_posts = counts["companies"], counts["posts"]
+
+    for i, (name, description) in enumerate(CATEGORIES, start=1):
+        yield "categories", {"id": i, "name": name, "description": description, "created_at": EPOCH}
+
+    category_of = Zipf(rng, len(CATEGORIES), s=0.8)
+    company_category = [None]
+    for i in range(1, n_companies + 1):
+        category_id = category_of()
+        company_category.append(category_id)
+        yield "companies", {
+            "id": i,
+            "name": f"empresa-{i}",
+            "bio": sentence(rng, 8, 40),
+            "website": f"empresa-{i}.com.br",
+            "password": PASSWORD,
+            "created_at": moment(rng, days=60),
+            "category_id": category_id,
+        }
+
+    # poucas empresas postam muito; 80% dos posts caem na categoria da empresa
+    author = Zipf(rng, n_companies)
+    post_created = [None]
+    for i in range(1, n_posts + 1):
+        company_id = author()
+        category_id = company_category[company_id] if rng.random() < 0.8 else rng.randint(1, len(CATEGORIES))
+        created = moment(rng, after=EPOCH + timedelta(days=60), days=640)
+        post_created.append(created)
+        yield "posts", {
+            "id": i,
+            "title": sentence(rng, 3, 9).capitalize(),
+            "content": sentence(rng, 10, int(rng.lognormvariate(3.5, 0.8)) + 11),
+            "created_at": created,
+            "company_id": company_id,
+            "category_id": category_id,
+            "likes": 0,
+            "investment": 0,
+        }
+
+    popular_post = Zipf(rng, n_posts)
+    any_company = lambda: rng.randint(1, n_companies)
+
+    for i in range(1, counts["comments"] + 1):
+        post_id = popular_post()
+        yield "comments", {
+            "id": i,
+            "content": sentence(rng, 3, 30),
+            "company_id": any_company(),
+            "created_at": post_created[post_id] + timedelta(minutes=rng.randrange(60 * 24 * 30)),
+            "post_id": post_id,
+        }
+
+    # like é único por (post, empresa): cada post sorteia quantas curtidas leva
+    # (proporcional à popularidade) e quais empresas curtiram, sem repetir.
+    # A fatia sai do que ainda falta: o que não coube num post (no máximo uma
+    # curtida por empresa) passa para os seguintes
+    remaining = counts["likes"]
+    weights = [1.0 / (k ** 1.1) for k in range(1, n_posts + 1)]
+    remaining_weight = sum(weights)
+    like_id = 0
+    for post_id in range(1, n_posts + 1):
+        if remaining <= 0:
+            break
+        share = remaining * weights[post_id - 1] / remaining_weight
+        remaining_weight -= weights[post_id - 1]
+        k = min(remaining, n_companies, int(share) + (rng.random() < share % 1))
+        remaining -= k
+        for company_id in rng.sample(range(1, n_companies + 1), k):
+            like_id += 1
+            yield "likes", {"id": like_id, "post_id": post_id, "company_id": company_id}
+
+    for i in range(1, counts["investments"] + 1):
+        post_id = popular_post()
+        yield "investments", {
+            "id": i,
+            "company_id": any_company(),
+            "post_id": post_id,
+            # inteiro e positivo, como o formulário de investimento grava (int())
+            "amount": max(1, round(rng.lognormvariate(4, 1.2))),
+            "created_at": post_created[post_id] + timedelta(minutes=rng.randrange(60 * 24 * 90)),
+        }
+
+    # conversas: alguns pares concentram a maior parte das mensagens
+    n_pairs = max(1, counts["messages"] // 20)
+    pairs = []
+    for _ in range(n_pairs):
+        a, b = rng.sample(range(1, n_companies + 1), 2) if n_companies > 1 else (1, 1)
+        pairs.append((a, b))
+    popular_pair = Zipf(rng, n_pairs)
+    start, span = EPOCH + timedelta(days=60), 640 * 86400
+    for i in range(1, counts["messages"] + 1):
+        a, b = pairs[popular_pair() - 1]
+        sender, receiver = (a, b) if rng.random() < 0.5 else (b, a)
+        yield "messages", {
+            "id": i,
+            "sender_id": sender,
+            "receiver_id": receiver,
+            "content": sentence(rng, 2, 25),
+            "created_at": start + timedelta(seconds=i * span // counts["messages"]),
+        }
+
+
+def generate(args):
+    counts = dict(SCALES[args.scale])
+    for name in counts:
+        value = getattr(args, name)
+        if value is not None:
+            counts[name] = value
+
+    if os.path.exists(args.db):
+        if not args.force:
+            sys.exit(f"{args.db} já existe (use --force para recriar)")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+
+    from app import app, import_records, run_migrations
+
+    started = time.perf_counter()
+    with app.app_context():
+        run_migrations()
+        # import_records acerta likes/investimento de cada post a partir das
+        # tabelas geradas e recalcula os scores com eles
+        loaded = import_records(generate_records(counts, args.seed))
+    for kind, n in loaded.items():
+        print(f"{kind}: {n} linhas")
+    print(f"Base gerada em {time.perf_counter() - started:.1f}s: {args.db}")
+
+
+# -----------------------------
+#   HARNESS
+# -----------------------------
+# Cada rota: (nome, precisa de login, função que sorteia a URL)
+def bench_routes(rng, counts):
+    n_companies, n_posts = counts["companies"], counts["posts"]
+    popular_post = Zipf(rng, n_posts) if n_posts else (lambda: 1)
+    busy_company = Zipf(rng, n_companies) if n_companies else (lambda: 1)
+    return {
+        "home": (False, lambda: "/"),
+        "categories": (False, lambda: "/categories"),
+        "top_posts": (False, lambda: "/top_posts"),
+        "post_view": (False, lambda: f"/post/{popular_post()}"),
+        "category_rank": (False, lambda: f"/category_rank/{rng.randint(1, len(CATEGORIES))}"),
+        "search": (False, lambda: "/search_company?" + urllib.parse.urlencode({"q": rng.choice(WORDS)})),
+        "search_combined": (False, lambda: "/search_combined?" + urllib.parse.urlencode(
+            {"q": f"empresa-{busy_company()} + {rng.choice(WORDS)}"}
+        )),
+        "chat": (True, lambda: f"/chat/{busy_company()}"),
+        "my_account": (True, lambda: "/my_account"),
+        "api_posts_top": (False, lambda: "/api/v1/posts/top"),
+        # escrita: POST sem seguir o redirect, nos posts mais populares (disputa pelo lock)
+        "like": (True, lambda: (f"/post/{popular_post()}", {"like": "1"})),
+        "invest": (True, lambda: (f"/post/{popular_post()}", {"invest": str(rng.randint(1, 100))})),
+    }
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(p / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(samples, elapsed):
+    latencies = [s[0] * 1000 for s in samples]
+    queries = [s[2] for s in samples if s[2] is not None]
+    errors = sum(1 for s in samples if s[1] >= 400)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50), 3) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95), 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99), 3) if latencies else None,
+        "mean_ms": round(sum(latencies) / len(latencies), 3) if latencies else None,
+        "queries_per_request": round(sum(queries) / len(queries), 2) if queries else None,
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else None,
+    }
+
+
+class ClientDriver:
+    # in-process, pelo test client do Flask (um client por thread)
+    def __init__(self, args):
+        from app import app
+        app.config["QUERY_COUNT_HEADER"] = True
+        app.config["TESTING"] = False
+        self.app = app
+        self.local = threading.local()
+
+    def client(self, logged_in):
+        key = "auth" if logged_in else "anon"
+        c = getattr(self.local, key, None)
+        if c is None:
+            c = self.app.test_client()
+            if logged_in:
+                c.post("/login", data={"name": "empresa-1", "password": PASSWORD})
+            setattr(self.local, key, c)
+        return c
+
+    def get(self, target, logged_in):
+        url, data = target if isinstance(target, tuple) else (target, None)
+        client = self.client(logged_in)
+        response = client.get(url) if data is None else client.post(url, data=data)
+        count = response.headers.get("X-Query-Count")
+        return response.status_code, int(count) if count is not None else None
+
+    def close(self):
+        pass
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    # o 302 depois de um POST conta como a resposta (não mede o GET seguinte)
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class GunicornDriver:
+    # gunicorn local em subprocesso, requests HTTP de verdade.
+    # --server-config repo: gunicorn.conf.py (gthread, preload, warm-up; espera o /ready)
+    # --server-config bare: `gunicorn app:app` puro (workers sync), para comparar
+    def __init__(self, args):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            self.port = s.getsockname()[1]
+        env = dict(os.environ, LUX_QUERY_COUNT_HEADER="1", LUX_GUNICORN_LOGLEVEL="warning")
+        cmd = [sys.executable, "-m", "gunicorn", "--chdir", BASE_DIR, "-b", f"127.0.0.1:{self.port}"]
+        if args.server_config == "repo":
+            env.update(LUX_GUNICORN_WORKERS=str(args.workers), LUX_GUNICORN_THREADS=str(args.threads))
+            cmd += ["-c", os.path.join(BASE_DIR, "gunicorn.conf.py")]
+            probe = "/ready"
+        else:
+            # arquivo de configuração vazio: sem -c o gunicorn carregaria o gunicorn.conf.py
+            self.empty_config = tempfile.NamedTemporaryFile(suffix=".py")
+            cmd += ["-c", self.empty_config.name, "-w", str(args.workers), "--log-level", "warning", "app:app"]
+            probe = "/login"
+        started = time.perf_counter()
+        self.proc = subprocess.Popen(cmd, env=env)
+        self.base = f"http://127.0.0.1:{self.port}"
+        deadline = time.time() + 120
+        while True:
+            try:
+                urllib.request.urlopen(self.base + probe, timeout=5).read()
+                break
+            except (urllib.error.URLError, OSError):
+                if time.time() > deadline or self.proc.poll() is not None:
+                    self.close()
+                    sys.exit("gunicorn não subiu")
+                time.sleep(0.2)
+        self.startup_seconds = round(time.perf_counter() - started, 2)
+        self.local = threading.local()
+
+    def opener(self, logged_in):
+        key = "auth" if logged_in else "anon"
+        o = getattr(self.local, key, None)
+        if o is None:
+            o = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()), NoRedirect())
+            if logged_in:
+                data = urllib.parse.urlencode({"name": "empresa-1", "password": PASSWORD}).encode()
+                try:
+                    o.open(self.base + "/login", data=data, timeout=30).read()
+                except urllib.error.HTTPError as e:
+                    e.read()
+            setattr(self.local, key, o)
+        return o
+
+    def get(self, target, logged_in):
+        url, data = target if isinstance(target, tuple) else (target, None)
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        try:
+            response = self.opener(logged_in).open(self.base + url, data=body, timeout=60)
+            response.read()
+            status, headers = response.status, response.headers
+        except urllib.error.HTTPError as e:
+            e.read()
+            status, headers = e.code, e.headers
+        count = headers.get("X-Query-Count")
+        return status, int(count) if count is not None else None
+
+    def memory(self):
+        # RSS e PSS (RSS com as páginas compartilhadas divididas entre os processos)
+        # do master e de cada worker, em kB; só Linux
+        def usage(pid):
+            try:
+                with open(f"/proc/{pid}/smaps_rollup") as f:
+                    fields = dict(line.split(":", 1) for line in f if ":" in line)
+            except OSError:
+                return None
+            return {k.lower(): int(fields[k].split()[0]) for k in ("Rss", "Pss") if k in fields}
+
+        workers = []
+        for pid in os.listdir("/proc") if os.path.isdir("/proc") else []:
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, ValueError, IndexError):
+                continue
+            if ppid == self.proc.pid:
+                workers.append(usage(pid))
+        return {"master": usage(self.proc.pid), "workers": [w for w in workers if w]}
+
+    def close(self):
+        self.proc.terminate()
+        self.proc.wait(timeout=30)
+
+
+def table_counts():
+    from app import app, db, DATA_TABLES
+    with app.app_context():
+        return {kind: db.session.query(model).count() for kind, model in DATA_TABLES.items()}
+
+
+def run(args):
+    if not os.path.exists(args.db):
+        sys.exit(f"{args.db} não existe (rode `python bench.py generate` antes)")
+    counts = table_counts()
+    rng = random.Random(args.seed)
+    routes = bench_routes(rng, counts)
+    selected = args.routes.split(",") if args.routes else list(routes)
+    unknown = [r for r in selected if r not in routes]
+    if unknown:
+        sys.exit(f"rotas desconhecidas: {', '.join(unknown)} (disponíveis: {', '.join(routes)})")
+
+    driver = (GunicornDriver if args.mode == "gunicorn" else ClientDriver)(args)
+    results = {}
+    memory = None
+    try:
+        for name in selected:
+            logged_in, make_url = routes[name]
+            # URLs sorteadas antes, para o sorteio não entrar na medida
+            urls = [make_url() for _ in range(args.warmup + args.requests)]
+            warm, measured = urls[:args.warmup], urls[args.warmup:]
+            for url in warm:
+                driver.get(url, logged_in)
+
+            def timed(url):
+                started = time.perf_counter()
+                status, queries = driver.get(url, logged_in)
+                return time.perf_counter() - started, status, queries
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                samples = list(pool.map(timed, measured))
+            results[name] = summarize(samples, time.perf_counter() - started)
+            r = results[name]
+            print(
+                f"{name:15} p50 {r['p50_ms']:8.2f}ms  p95 {r['p95_ms']:8.2f}ms  p99 {r['p99_ms']:8.2f}ms  "
+                f"{r['throughput_rps']:8.1f} req/s  queries {r['queries_per_request']}  erros {r['errors']}"
+            )
+        if args.mode == "gunicorn":
+            memory = driver.memory()
+            workers = memory["workers"]
+            if workers:
+                print(
+                    f"memória: master {memory['master']['rss'] // 1024} MB RSS, "
+                    f"workers {sum(w['pss'] for w in workers) // len(workers) // 1024} MB PSS "
+                    f"({sum(w['rss'] for w in workers) // len(workers) // 1024} MB RSS) em média"
+                )
+    finally:
+        driver.close()
+
+    report = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "revision": git_revision(),
+            "mode": args.mode,
+            "workers": args.workers if args.mode == "gunicorn" else None,
+            "server_config": args.server_config if args.mode == "gunicorn" else None,
+            "threads": args.threads if args.mode == "gunicorn" and args.server_config == "repo" else None,
+            "worker_class": (os.environ.get("LUX_GUNICORN_WORKER_CLASS", "gthread") if args.server_config == "repo" else "sync")
+            if args.mode == "gunicorn" else None,
+            "preload": os.environ.get("LUX_GUNICORN_PRELOAD", "1") == "1"
+            if args.mode == "gunicorn" and args.server_config == "repo" else None,
+            "startup_seconds": getattr(driver, "startup_seconds", None),
+            "memory_kb": memory,
+            "concurrency": args.concurrency,
+            "requests_per_route": args.requests,
+            "warmup": args.warmup,
+            "seed": args.seed,
+            "cache_backend": os.environ.get("LUX_CACHE_BACKEND", "sqlite"),
+            "db_profile": os.environ.get("LUX_DB_PROFILE", "production"),
+            "dataset": counts,
+        },
+        "routes": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+        f.write("\n")
+    print(f"Resultado salvo em {args.output}")
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"], cwd=BASE_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do Lux")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    gen = sub.add_parser("generate", help="gera uma base sintética")
+    gen.add_argument("--db", required=True)
+    gen.add_argument("--scale", choices=SCALES, default="small")
+    gen.add_argument("--seed", type=int, default=42)
+    gen.add_argument("--force", action="store_true")
+    for name in SCALES["small"]:
+        gen.add_argument(f"--{name}", type=int)
+
+    bench = sub.add_parser("run", help="mede as rotas")
+    bench.add_argument("--db", required=True)
+    bench.add_argument("--mode", choices=("client", "gunicorn"), default="client")
+    bench.add_argument("--routes", help="lista separada por vírgula (padrão: todas)")
+    bench.add_argument("--requests", type=int, default=200, help="requests medidos por rota")
+    bench.add_argument("--warmup", type=int, default=20)
+    bench.add_argument("--concurrency", type=int, default=1)
+    bench.add_argument("--workers", type=int, default=2, help="workers do gunicorn")
+    bench.add_argument("--threads", type=int, default=4, help="threads por worker (--server-config repo)")
+    bench.add_argument("--server-config", choices=("repo", "bare"), default="repo",
+                       help="repo = gunicorn.conf.py; bare = `gunicorn app:app` sem configuração")
+    bench.add_argument("--seed", type=int, default=42)
+    bench.add_argument("--output", default="bench-results.json")
+
+    args = parser.parse_args()
+    # o app lê o caminho do banco na importação: define antes de importar
+    os.environ["LUX_DB_PATH"] = os.path.abspath(args.db)
+    if args.command == "generate":
+        generate(args)
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
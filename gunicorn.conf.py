@@ -0,0 +1,105 @@
+# Configuração do gunicorn para produção (procfile: `gunicorn -c gunicorn.conf.py`).
+# Tudo ajustável por variável de ambiente LUX_GUNICORN_*; os valores padrão
+# saíram do bench.py (ver `python bench.py run --mode gunicorn --server-config ...`).
+#
+# SQLite: leitura escala com processos, escrita é uma por vez (WAL + busy_timeout).
+# Por isso poucos processos com algumas threads cada (gthread): as threads
+# cobrem a espera de I/O e os streams SSE do chat sem multiplicar a memória.
+# gevent também funciona (pip install gevent), mas as chamadas ao sqlite3
+# bloqueiam o loop inteiro do worker enquanto rodam.
+import gc
+import multiprocessing
+import os
+
+wsgi_app = "app:create_app(warm_up=False)"
+bind = os.environ.get("LUX_GUNICORN_BIND", f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+
+worker_class = os.environ.get("LUX_GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.environ.get("LUX_GUNICORN_WORKERS", max(2, multiprocessing.cpu_count())))
+threads = int(os.environ.get("LUX_GUNICORN_THREADS", 4))
+# gevent: requests simultâneos por worker
+worker_connections = int(os.environ.get("LUX_GUNICORN_CONNECTIONS", 100))
+
+if worker_class == "gevent":
+    try:
+        import gevent  # noqa: F401
+    except ImportError:
+        raise SystemExit("LUX_GUNICORN_WORKER_CLASS=gevent exige o pacote gevent (pip install gevent)")
+
+# importa o app uma vez no master e cria os workers por fork (memória compartilhada
+# por copy-on-write, boot rápido); LUX_GUNICORN_PRELOAD=0 para importar em cada worker
+preload_app = os.environ.get("LUX_GUNICORN_PRELOAD", "1") == "1"
+
+# recicla o worker depois de N requests (vazamentos lentos, fragmentação);
+# o jitter evita que todos reiniciem ao mesmo tempo
+max_requests = int(os.environ.get("LUX_GUNICORN_MAX_REQUESTS", 2000))
+max_requests_jitter = int(os.environ.get("LUX_GUNICORN_MAX_REQUESTS_JITTER", 200))
+
+# gthread/gevent: timeout vale para o heartbeat do worker, não para cada request,
+# então o stream SSE (até LUX_SSE_MAX_SECONDS) não derruba o worker
+timeout = int(os.environ.get("LUX_GUNICORN_TIMEOUT", 30))
+graceful_timeout = int(os.environ.get("LUX_GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.environ.get("LUX_GUNICORN_KEEPALIVE", 5))
+
+# chat ao vivo (SSE): cada stream aberto prende uma thread do worker até
+# LUX_SSE_MAX_SECONDS. Por padrão cada worker aceita streams em até metade das
+# threads (o resto do site continua respondendo; passando disso a página do chat
+# cai para polling) e o stream fecha antes do timeout. Com muitos chats abertos,
+# suba um pool só para os streams e mande /chat/*/stream para ele no proxy, p.ex.
+#   LUX_GUNICORN_BIND=127.0.0.1:8001 LUX_GUNICORN_THREADS=32 LUX_SSE_MAX_STREAMS=30 \
+#       gunicorn -c gunicorn.conf.py
+streams_per_worker = worker_connections if worker_class == "gevent" else threads
+os.environ.setdefault("LUX_SSE_MAX_STREAMS", str(max(1, streams_per_worker // 2)))
+sse_max_seconds = float(os.environ.setdefault("LUX_SSE_MAX_SECONDS", str(max(5, timeout - 5))))
+if sse_max_seconds >= timeout:
+    raise SystemExit(
+        f"LUX_SSE_MAX_SECONDS ({sse_max_seconds:g}) precisa ser menor que o timeout do gunicorn ({timeout})"
+    )
+
+# heartbeat dos workers em memória (disco lento/overlay de container trava o heartbeat)
+if os.path.isdir("/dev/shm"):
+    worker_tmp_dir = "/dev/shm"
+
+accesslog = os.environ.get("LUX_GUNICORN_ACCESSLOG")
+loglevel = os.environ.get("LUX_GUNICORN_LOGLEVEL", "info")
+
+
+def when_ready(server):
+    # com preload, o app já foi importado no master: aquece aqui, antes do
+    # primeiro fork, e fecha as conexões usadas no warm-up
+    if not server.cfg.preload_app:
+        return
+    from app import app, build_assets, db, run_warm_up
+
+    # .gz/.br dos estáticos (no-op se já estão em dia); antes do fork, um processo só
+    build_assets()
+    run_warm_up()
+    with app.app_context():
+        db.engine.dispose()
+    # objetos do master fora do coletor: o GC dos workers não toca nessas
+    # páginas, então elas continuam compartilhadas (copy-on-write) depois do fork
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from app import after_fork
+
+    after_fork()
+
+
+def post_worker_init(worker):
+    # sem preload, cada worker aquece em segundo plano (/ready responde 503 até lá)
+    if worker.cfg.preload_app:
+        return
+    from app import start_warm_up
+
+    start_warm_up()
+
+
+def worker_exit(server, worker):
+    # grava o buffer do write-behind antes do worker sair (SIGTERM, max_requests);
+    # o atexit cobre o processo sem gunicorn
+    from app import flush_write_behind
+
+    flush_write_behind()
@@ -0,0 +1,46 @@
+// Sugestões enquanto digita nos campos com data-typeahead (categories.html).
+// GET /typeahead responde da memória do worker; o navegador guarda 30s.
+(function () {
+    document.querySelectorAll("input[data-typeahead]").forEach(function (input) {
+        const list = document.getElementById(input.getAttribute("list"));
+        const combined = input.dataset.typeahead === "combined";
+        let timer = null;
+        let last = "";
+
+        function fill(items) {
+            list.innerHTML = "";
+            items.forEach(function (item) {
+                let value = item.label;
+                if (combined && item.type === "company") {
+                    value = item.label + " + ";
+                } else if (combined && item.company && value.indexOf(" + ") < 0) {
+                    value = item.company + " + " + item.label;
+                } else if (!combined && item.type !== "company") {
+                    return;
+                }
+                const option = document.createElement("option");
+                option.value = value;
+                list.appendChild(option);
+            });
+        }
+
+        input.addEventListener("input", function () {
+            clearTimeout(timer);
+            timer = setTimeout(function () {
+                const q = input.value.trim();
+                if (!q || q === last) {
+                    return;
+                }
+                last = q;
+                fetch(input.dataset.url + "?q=" + encodeURIComponent(q))
+                    .then(function (response) { return response.json(); })
+                    .then(function (data) {
+                        // resposta de uma tecla anterior: descarta
+                        if (input.value.trim() === data.q) {
+                            fill(data.items);
+                        }
+                    });
+            }, 120);
+        });
+    });
+})();
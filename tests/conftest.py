@@ -0,0 +1,73 @@
+# Testes de regressão: base pequena gerada pelo gerador do bench.py num diretório
+# temporário e restaurada antes de cada teste (cada um apaga/renomeia à vontade).
+#   pip install -r requirements-dev.txt && python -m pytest
+import os
+import sqlite3
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORKDIR = tempfile.mkdtemp(prefix="lux-tests-")
+# o app lê a configuração na importação: tudo no diretório temporário
+os.environ["LUX_DB_PATH"] = os.path.join(WORKDIR, "test.db")
+os.environ["LUX_SIGNAL_DIR"] = os.path.join(WORKDIR, "signals")
+os.environ["LUX_CACHE_PATH"] = os.path.join(WORKDIR, "cache.db")
+os.environ["LUX_TEMPLATE_CACHE_DIR"] = os.path.join(WORKDIR, "jinja-cache")
+
+import app as lux  # noqa: E402
+from bench import PASSWORD, generate_records  # noqa: E402
+
+COUNTS = dict(companies=20, posts=200, comments=200, likes=500, investments=200, messages=200)
+BASE_DB = os.path.join(WORKDIR, "base.db")
+
+
+def copy_db(src, dst):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(dst + suffix):
+            os.remove(dst + suffix)
+    source, target = sqlite3.connect(src), sqlite3.connect(dst)
+    try:
+        source.backup(target)
+    finally:
+        source.close()
+        target.close()
+
+
+@pytest.fixture(scope="session")
+def base_db():
+    with lux.app.app_context():
+        lux.run_migrations()
+        lux.import_records(generate_records(COUNTS, 42))
+        lux.db.engine.dispose()
+    copy_db(lux.DB_PATH, BASE_DB)
+    return BASE_DB
+
+
+@pytest.fixture
+def app(base_db):
+    config = dict(lux.app.config)
+    lux.app.config["TESTING"] = True
+    with lux.app.app_context():
+        lux.db.engine.dispose()
+    copy_db(base_db, lux.DB_PATH)
+    lux.page_cache.clear()
+    lux.stream_slots.reset()
+    lux.write_buffer.reset()
+    yield lux.app
+    with lux.app.app_context():
+        lux.db.session.remove()
+    lux.app.config.clear()
+    lux.app.config.update(config)
+
+
+@pytest.fixture
+def login(app):
+    def logged_client(company_id):
+        client = app.test_client()
+        client.post("/login", data={"name": f"empresa-{company_id}", "password": PASSWORD})
+        return client
+    return logged_client
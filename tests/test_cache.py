@@ -0,0 +1,68 @@
+from app import Company, DataVersion, Post, SQLiteCache, db, page_cache, update_all_scores
+
+
+def test_etags_follow_what_the_page_shows(app):
+    # o 304 só vale se nada do que a página mostra mudou: nome da empresa no
+    # post, post novo/apagado na página da empresa
+    client = app.test_client()
+    with app.app_context():
+        company_id = db.session.get(Post, 1).company_id
+
+    def revalidate(url):
+        etag = client.get(url).headers["ETag"]
+        return lambda: client.get(url, headers={"If-None-Match": etag}).status_code
+
+    status = revalidate("/posts/1")
+    assert status() == 304
+    with app.app_context():
+        db.session.get(Company, company_id).name = "empresa renomeada"
+        db.session.commit()
+    assert status() == 200
+
+    status = revalidate(f"/companies/{company_id}")
+    assert status() == 304
+    with app.app_context():
+        db.session.add(Post(title="post novo", content="x", company_id=company_id, category_id=1))
+        db.session.commit()
+    assert status() == 200
+
+
+def test_home_search_sees_new_posts(app):
+    # /?q= depende dos posts (empresas que batem por post): post novo invalida a
+    # página; sem q, só empresas/categorias. Hit do cache = 0 queries.
+    assert isinstance(page_cache, SQLiteCache)
+    app.config["QUERY_COUNT_HEADER"] = True
+    client = app.test_client()
+
+    def queries(url):
+        return int(client.get(url).headers["X-Query-Count"])
+
+    for url in ("/?q=zirconita", "/"):
+        queries(url)
+        assert queries(url) == 0
+    with app.app_context():
+        db.session.add(Post(title="zirconita", content="zirconita", company_id=7, category_id=1))
+        db.session.commit()
+    assert queries("/?q=zirconita") > 0
+    assert queries("/") == 0
+
+
+def test_rescore_without_drift_keeps_versions(app):
+    # o rebuild_scores de hora em hora não pode invalidar ETags e caches à toa
+    with app.app_context():
+        update_all_scores()
+        versions = dict(db.session.query(DataVersion.name, DataVersion.version))
+        stamps = dict(db.session.query(Post.id, Post.updated_at))
+        assert update_all_scores() == {"post": 0, "company": 0}
+        assert dict(db.session.query(DataVersion.name, DataVersion.version)) == versions
+        assert dict(db.session.query(Post.id, Post.updated_at)) == stamps
+
+        # divergência de verdade: corrige a linha e só então muda a versão
+        db.session.execute(db.update(Post).where(Post.id == 1).values(score=-1, updated_at=stamps[1]))
+        db.session.commit()
+        versions = dict(db.session.query(DataVersion.name, DataVersion.version))
+        # o post volta ao valor certo antes, então a soma da empresa já bate
+        assert update_all_scores() == {"post": 1, "company": 0}
+        assert db.session.get(Post, 1).score >= 0
+        assert db.session.get(Post, 1).updated_at == stamps[1]
+        assert dict(db.session.query(DataVersion.name, DataVersion.version))["posts"] > versions["posts"]
@@ -0,0 +1,49 @@
+import threading
+import time
+
+from app import Message, conversation_between, db, stream_slots, unread_for
+
+
+def last_message_id(app):
+    with app.app_context():
+        return db.session.query(db.func.max(Message.id)).scalar() or 0
+
+
+def test_stream_delivers_incoming_message(app, login):
+    # o stream do destinatário marca a conversa como lida no meio do loop;
+    # o commit não pode derrubar o stream antes de entregar a mensagem
+    last_id = last_message_id(app)
+    app.config["SSE_MAX_SECONDS"] = 1.5
+    app.config["SSE_HEARTBEAT"] = 0.2
+    viewer, peer = login(2), login(3)
+
+    def send():
+        time.sleep(0.3)
+        peer.post("/chat/2", data={"message": "mensagem ao vivo"})
+
+    sender = threading.Thread(target=send)
+    sender.start()
+    with viewer.get(f"/chat/3/stream?after={last_id}") as response:
+        body = response.get_data(as_text=True)
+    sender.join()
+    assert "mensagem ao vivo" in body
+    with app.app_context():
+        assert not unread_for(conversation_between(2, 3), 2)
+
+
+def test_stream_cap_falls_back_to_polling(app, login):
+    # streams passando do limite do worker: 204 + polling, e a vaga volta no fim
+    last_id = last_message_id(app)
+    app.config["SSE_MAX_SECONDS"] = 0.5
+    app.config["SSE_HEARTBEAT"] = 0.2
+    app.config["SSE_MAX_STREAMS"] = 1
+    viewer, peer = login(2), login(3)
+    with viewer.get(f"/chat/3/stream?after={last_id}", buffered=False):
+        refused = viewer.get(f"/chat/3/stream?after={last_id}")
+        assert refused.status_code == 204
+        assert refused.headers["X-Poll-Interval"]
+        peer.post("/chat/2", data={"message": "mensagem por polling"})
+        polled = viewer.get(f"/chat/3/stream?poll=1&after={last_id}").get_json()
+        assert [m["content"] for m in polled["messages"]] == ["mensagem por polling"]
+        assert polled["last_id"] > last_id
+    assert stream_slots.active == 0
@@ -0,0 +1,22 @@
+from app import Company, Job, db, run_worker
+
+
+def test_account_deletion_is_pending_and_retryable(app, login):
+    # a exclusão só acontece no worker: a resposta diz "agendada", e um job que
+    # falhou de vez não impede pedir de novo
+    response = login(15).post("/delete_account/15")
+    assert response.status_code == 202
+    assert "agendada" in response.get_data(as_text=True)
+    with app.app_context():
+        assert db.session.get(Company, 15) is not None
+        job = Job.query.filter_by(kind="delete_company").one()
+        job.status, job.attempts = "failed", job.max_attempts
+        db.session.commit()
+
+    assert login(15).post("/delete_account/15").status_code == 202
+    with app.app_context():
+        job = Job.query.filter_by(kind="delete_company").one()
+        assert (job.status, job.attempts) == ("queued", 0)
+    run_worker(once=True)
+    with app.app_context():
+        assert db.session.get(Company, 15) is None
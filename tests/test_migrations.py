@@ -0,0 +1,40 @@
+import os
+
+import app as lux
+from conftest import ROOT, copy_db
+
+
+def use_committed_database(app):
+    with app.app_context():
+        lux.db.engine.dispose()
+    copy_db(os.path.join(ROOT, "database.db"), lux.DB_PATH)
+
+
+def test_migrations_upgrade_committed_database(app):
+    # o database.db do repositório é anterior a todas as migrações: cada uma
+    # precisa achar o schema da versão anterior, não o dos models de hoje
+    use_committed_database(app)
+    with app.app_context():
+        lux.run_migrations()
+        with lux.db.engine.connect() as conn:
+            versions = [r[0] for r in conn.exec_driver_sql("SELECT version FROM schema_version;")]
+            assert versions == [version for version, _, _ in lux.MIGRATIONS]
+            assert conn.exec_driver_sql("PRAGMA foreign_key_check;").fetchall() == []
+            assert "trending" in lux.column_names(conn, "post")
+            missing = conn.exec_driver_sql("SELECT COUNT(*) FROM post WHERE trending IS NULL;").scalar()
+            assert missing == 0
+            ddl = conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE name = 'post';").scalar()
+            assert "ON DELETE CASCADE" in ddl
+
+
+def test_migration_11_keeps_version_11_schema(app, monkeypatch):
+    # a recriação das tabelas não pode trazer colunas/índices de migrações futuras
+    monkeypatch.setattr(lux, "MIGRATIONS", [m for m in lux.MIGRATIONS if m[0] <= 11])
+    use_committed_database(app)
+    with app.app_context():
+        lux.run_migrations()
+        with lux.db.engine.connect() as conn:
+            assert "trending" not in lux.column_names(conn, "post")
+            indexes = {r[0] for r in conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index';")}
+            assert "ix_post_trending" not in indexes
+            assert "ix_post_company_score" in indexes
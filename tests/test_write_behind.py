@@ -0,0 +1,61 @@
+import pytest
+
+import app as lux
+from app import Post, db, write_buffer
+
+
+@pytest.fixture
+def write_behind(app, monkeypatch):
+    # sem a thread de fundo no caminho: grava só quando o teste chama flush()
+    app.config.update(WRITE_BEHIND=True, WRITE_BEHIND_INTERVAL=3600, WRITE_BEHIND_BATCH=1000)
+    real = lux.apply_write_batch
+    broken = {"on": False, "amount": None}
+
+    def apply(batch):
+        if broken["on"] or any(e[3] == broken["amount"] for e in batch):
+            raise RuntimeError("banco indisponível")
+        return real(batch)
+
+    monkeypatch.setattr(lux, "apply_write_batch", apply)
+    return broken
+
+
+def investment(app, post_id=1):
+    with app.app_context():
+        return db.session.get(Post, post_id).investment
+
+
+def test_full_buffer_refuses_instead_of_failing_accepted_event(app, login, write_behind):
+    # evento aceito não pode virar 500 (o cliente repete e o investimento entra
+    # duas vezes); sem vaga, o evento é recusado antes de entrar no buffer
+    app.config["WRITE_BEHIND_MAX_PENDING"] = 1
+    before = investment(app)
+    client = login(2)
+    write_behind["on"] = True
+    assert client.post("/post/1", data={"invest": "7"}).status_code == 302
+    refused = client.post("/post/1", data={"invest": "7"})
+    assert refused.status_code == 503
+    assert refused.headers["Retry-After"]
+    assert write_buffer.pending() == 1
+
+    write_behind["on"] = False
+    assert write_buffer.flush() == 1
+    assert investment(app) == before + 7
+
+
+def test_failing_event_is_dropped_after_max_retries(app, login, write_behind):
+    # um evento que nunca grava não trava o buffer: depois de N tentativas o lote
+    # vai evento a evento e só o ruim fica de fora
+    app.config["WRITE_BEHIND_MAX_RETRIES"] = 3
+    before = investment(app)
+    client = login(2)
+    write_behind["amount"] = 666
+    for amount in ("5", "666", "6"):
+        assert client.post("/post/1", data={"invest": amount}).status_code == 302
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            write_buffer.flush()
+        assert write_buffer.pending() == 3
+    assert write_buffer.flush() == 2
+    assert write_buffer.pending() == 0
+    assert investment(app) == before + 11
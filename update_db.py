@@ -1,16 +1,8 @@
-import sqlite3
+# Atualiza o schema do banco do app (o mesmo DB_PATH do app.py) rodando as
+# migrações pendentes. Equivalente a `flask --app app upgrade-db`.
+from app import app, run_migrations, schema_version
 
-conn = sqlite3.connect("Lux.db")  # substitua se seu DB tiver outro nome
-c = conn.cursor()
-
-try:
-    c.execute("ALTER TABLE company ADD COLUMN ai_score FLOAT DEFAULT 0")
-    print("Coluna ai_score adicionada!")
-except sqlite3.OperationalError as e:
-    if "duplicate column name" in str(e):
-        print("A coluna ai_score já existe.")
-    else:
-        raise e
-
-conn.commit()
-conn.close()
+with app.app_context():
+    for name in run_migrations():
+        print(f"Migração aplicada: {name}")
+    print(f"Banco na versão {schema_version()}.")